@@ -1,64 +1,232 @@
-from flask import Flask, render_template, request, redirect, url_for, send_from_directory, make_response
+from flask import Flask, render_template, request, redirect, url_for, send_from_directory, send_file, make_response, jsonify
 import os
+import datetime
+import json
+import click
+from urllib.parse import quote
+from werkzeug.exceptions import NotFound
+from werkzeug.security import safe_join
+from zoneinfo import ZoneInfo
 import database as db  # Use alias 'db' to avoid name collision
+import async_database as adb
+import migrations
+import storage
+import content_index
+import jobs
+import previews
+import background
+from versioned_cache import VersionedCache
+from lru_cache import LRUCache
 
 app = Flask(__name__, template_folder='templates', static_folder='static')
+# Stream uploaded files straight into UPLOAD_FOLDER while hashing them
+app.request_class = storage.UploadRequest
 UPLOAD_FOLDER = os.path.join(os.getcwd(), 'uploads')
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+app.config['MAX_UPLOAD_SIZE'] = storage.MAX_UPLOAD_SIZE
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('MAX_REQUEST_SIZE', 512 * 1024 * 1024))
+blob_store = storage.BlobStore(UPLOAD_FOLDER)
+
+def _reclaim_files_batch():
+    return sum(db.reclaim_files().values()) >= db.RECLAIM_BATCH_SIZE
+
+def _refresh_activity_batch():
+    return db.refresh_daily_activity() >= db.ROLLUP_BATCH_DAYS
+
+# Unlinks deleted files (see database.reclaim_files); woken after deletes
+file_reclaimer = background.BackgroundWorker('file-reclaimer', _reclaim_files_batch,
+                                             interval=float(os.environ.get('RECLAIM_INTERVAL', 60)))
+# Keeps daily_activity up to date for /api/trends
+activity_rollup = background.BackgroundWorker('activity-rollup', _refresh_activity_batch,
+                                              interval=float(os.environ.get('ROLLUP_INTERVAL', 60)))
+
+# Download offload: '' (Flask/gunicorn send the file; gunicorn uses
+# sendfile() where it can), 'x-sendfile' (Apache/lighttpd) or 'x-accel'
+# (nginx X-Accel-Redirect to X_ACCEL_PREFIX)
+app.config['FILE_OFFLOAD'] = os.environ.get('FILE_OFFLOAD', '')
+app.config['USE_X_SENDFILE'] = app.config['FILE_OFFLOAD'] == 'x-sendfile'
+app.config['X_ACCEL_PREFIX'] = os.environ.get('X_ACCEL_PREFIX', '/_protected_uploads/')
+BLOB_MAX_AGE = 365 * 24 * 3600
+# Show the planner's row estimate above paginated listings
+app.config['APPROX_TOTALS'] = os.environ.get('APPROX_TOTALS', '1') == '1'
 
 # Ensure uploads folder exists
 if not os.path.exists(UPLOAD_FOLDER):
     os.makedirs(UPLOAD_FOLDER)
 
-# Initialize database (run once)
-db.init_db()
+# Check the schema version once at startup; 'flask migrate' applies upgrades
+migrations.check_schema()
+
+# Hand the request's pooled connection back when the request ends
+app.teardown_appcontext(db.close_request_connection)
+
+@app.before_request
+def start_background_workers():
+    file_reclaimer.start()
+    activity_rollup.start()
 
 @app.route('/uploads/<path:filename>')
 def serve_uploaded_file(filename):
-    file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    print(f"Attempting to serve file: {file_path}")
-    if os.path.exists(file_path):
-        print(f"File found, serving: {file_path}")
-        response = make_response(send_from_directory(app.config['UPLOAD_FOLDER'], filename))
-        response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
-        return response
+    # Blob keys carry no filename, so links pass the original as ?name=
+    download_name = request.args.get('name') or storage.display_name(filename)
+    if blob_store.is_blob_key(filename):
+        # Content-addressed: the hash is a strong ETag and the bytes behind
+        # a key never change, so clients may cache them indefinitely
+        options = {'etag': os.path.basename(filename), 'max_age': BLOB_MAX_AGE}
     else:
-        print(f"File not found: {file_path}")
+        # Legacy flat files can be overwritten; revalidate on every use
+        options = {'max_age': 0}
+    try:
+        # send_from_directory handles Range (206), If-None-Match and
+        # If-Modified-Since (304) itself
+        response = send_from_directory(app.config['UPLOAD_FOLDER'], filename, as_attachment=True,
+                                       download_name=download_name, conditional=True, **options)
+    except NotFound:
         return "File not found", 404
+    if blob_store.is_blob_key(filename):
+        response.cache_control.immutable = True
+    if app.config['FILE_OFFLOAD'] == 'x-accel' and response.status_code != 304:
+        response = _x_accel_response(response, filename)
+    return response
 
-@app.route('/', methods=['GET', 'POST'])
-def index():
+def _x_accel_response(response, filename):
+    # Let nginx send the bytes (and apply any Range) from an internal
+    # location mapped onto UPLOAD_FOLDER, e.g.
+    #   location /_protected_uploads/ { internal; alias /app/uploads/; }
+    response.close()
+    offloaded = make_response('', 200)
+    for header in ('Content-Type', 'Content-Disposition', 'ETag', 'Last-Modified', 'Cache-Control'):
+        if header in response.headers:
+            offloaded.headers[header] = response.headers[header]
+    offloaded.headers['X-Accel-Redirect'] = app.config['X_ACCEL_PREFIX'] + quote(filename)
+    return offloaded
+
+def _preview_source(key):
+    # Uploaded file behind a storage key, or None
+    path = safe_join(app.config['UPLOAD_FOLDER'], key)
+    return path if path and os.path.isfile(path) else None
+
+# Images are only rendered by the render_previews job (`flask run-jobs`).
+# A request that misses queues it (again, if the images were evicted since)
+# at most once a minute per file and tells the client to come back.
+PREVIEW_RETRY_AFTER = 5
+preview_queue = LRUCache(maxsize=4096, ttl=60)
+
+def _queue_preview(path, key):
+    preview_queue.get(key, lambda: jobs.enqueue([jobs.render_previews_job(path, key)], rerun_done=True))
+
+@app.route('/previews/<size>/<int:page>/<path:key>')
+def serve_preview(size, page, key):
+    # JPEG of one PDF page: size 'thumb' (lists) or 'page' (preview modal)
+    path = _preview_source(key)
+    if path is None or size not in previews.cache.sizes or not previews.available() or not previews.is_pdf(path):
+        return "Preview not available", 404
+    image = previews.cache.cached(path, key, size, page)
+    if image is None:
+        count = previews.cache.known_page_count(path, key)
+        if not 1 <= page <= previews.cache.pages or (count is not None and page > count):
+            return "Preview not available", 404
+        _queue_preview(path, key)
+        response = make_response("Preview is being rendered", 503)
+        response.headers['Retry-After'] = str(PREVIEW_RETRY_AFTER)
+        return response
+    # The images of a blob never change; legacy files may be overwritten
+    immutable = blob_store.is_blob_key(key)
+    response = send_file(image, mimetype='image/jpeg', conditional=True,
+                         etag=f"{previews.cache.version(path, key)}-{size}-{page}",
+                         max_age=BLOB_MAX_AGE if immutable else 0)
+    response.cache_control.immutable = immutable
+    return response
+
+@app.route('/previews/pages/<path:key>')
+def preview_pages(key):
+    # Page images the preview modal can show for a file. Until all of them
+    # are rendered the modal falls back to PDF.js.
+    path = _preview_source(key)
+    if path is None or not previews.available() or not previews.is_pdf(path):
+        return jsonify({'error': 'Preview not available'}), 404
+    count = previews.cache.known_page_count(path, key)
+    pages = min(count or 0, previews.cache.pages)
+    if count is None or not previews.cache.rendered(path, key, 'page', pages):
+        _queue_preview(path, key)
+        return jsonify({'error': 'Preview is being rendered'}), 404
+    return jsonify({
+        'page_count': count,
+        'pages': [url_for('serve_preview', size='page', page=page, key=key) for page in range(1, pages + 1)],
+    })
+
+@app.context_processor
+def preview_settings():
+    return {'previews_available': previews.available()}
+
+# Dimension filters may be given several times (?project=A&project=B)
+DOCUMENT_FILTER_KEYS = ('document_type', 'project', 'site', 'status')
+ISSUE_FILTER_KEYS = ('project', 'site', 'status')
+DATE_FILTER_KEYS = ('date', 'date_from', 'date_to')
+# Single free-text values: filename matches anywhere in the name
+TEXT_FILTER_KEYS = ('filename',)
+
+def _read_filters(source, keys):
     filters = {}
+    for key in keys:
+        values = [v for v in source.getlist(key) if v]
+        if values:
+            filters[key] = values
+    for key in DATE_FILTER_KEYS:
+        if source.get(key):
+            filters[key] = source.get(key)
+    for key in TEXT_FILTER_KEYS:
+        if source.get(key, '').strip():
+            filters[key] = source.get(key).strip()
+    return filters
+
+def _issue_filter_args():
+    # Issue filters travel in the query string so redirects can keep them
+    filters = {key: [] for key in ISSUE_FILTER_KEYS}
+    filters.update({key: '' for key in DATE_FILTER_KEYS + TEXT_FILTER_KEYS})
+    filters.update(_read_filters(request.args, ISSUE_FILTER_KEYS))
+    return filters
+
+def _page_args():
+    cursor = request.args.get('cursor') or None
+    page_size = request.args.get('page_size', type=int)
+    return cursor, page_size
+
+async def _load_page(loader, filters):
+    cursor, page_size = _page_args()
+    with_total = app.config['APPROX_TOTALS']
+    try:
+        return await loader(filters, cursor, page_size, with_total)
+    except ValueError:
+        # Stale or tampered cursor: fall back to the first page
+        return await loader(filters, None, page_size, with_total)
+
+# The listing pages are async views so that their independent queries
+# run at once (see async_database.py); lookups are served from memory
+@app.route('/', methods=['GET', 'POST'])
+async def index():
     if request.method == 'POST' and 'filter' in request.form:
-        document_type = request.form.get('document_type')
-        project = request.form.get('project')
-        site = request.form.get('site')
-        status = request.form.get('status')
-        date = request.form.get('date')
-        if document_type:
-            filters['document_type'] = document_type
-        if project:
-            filters['project'] = project
-        if site:
-            filters['site'] = site
-        if status:
-            filters['status'] = status
-        if date:
-            filters['date'] = date
+        source = request.form
+    else:
+        source = request.args
+    filters = _read_filters(source, DOCUMENT_FILTER_KEYS)
+    if source.get('q', '').strip():
+        filters['q'] = source.get('q').strip()
 
     document_types = db.get_document_types()
     projects = db.get_projects()
     sites = db.get_sites()
     statuses = db.get_statuses()
     users = db.get_users()
-    documents = db.get_all_documents(filters)
+    page = await _load_page(adb.search_documents if filters.get('q') else adb.get_documents_page, filters)
     return render_template('index.html', 
                          document_types=document_types,
                          projects=projects,
                          sites=sites,
                          statuses=statuses,
                          users=users,
-                         documents=documents,
+                         documents=page['rows'],
+                         page=page,
                          filters=filters)
 
 @app.route('/upload', methods=['POST'])
@@ -78,62 +246,126 @@ def upload_file():
     uploaded_by = request.form['user']
     
     if file:
-        filename = file.filename
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(file_path)
-        print(f"Inserting document: {filename}, path: {file_path}")
-        db.insert_document(filename, file_path, document_type_id, project_id, site_id, status_id, uploaded_by)
+        upload = storage.ingest(file, blob_store, app.config['MAX_UPLOAD_SIZE'])
+        print(f"Inserting document: {upload.filename}, blob: {upload.storage_key}")
+        document_id = db.insert_document(upload.filename, upload.file_path, document_type_id, project_id, site_id,
+                                         status_id, uploaded_by, upload.storage_key, upload.sha256, upload.size,
+                                         place_file=upload.place)
+        # Text extraction and previews run in `flask run-jobs`, not in this request
+        jobs.enqueue([jobs.index_document_job(document_id)] + _preview_jobs([upload]))
         return redirect(url_for('index', success='Document uploaded successfully'))
 
+def _preview_jobs(uploads):
+    # Page images are only made for PDFs
+    return [jobs.render_previews_job(upload.file_path, upload.storage_key)
+            for upload in uploads if upload.filename.lower().endswith('.pdf')]
+
+# form field -> reference table its id must exist in
+DOCUMENT_FIELDS = {
+    'document_type': 'document_types',
+    'project': 'projects',
+    'site': 'sites',
+    'status': 'statuses',
+    'user': 'users',
+}
+
+def _document_metadata_error(metadata):
+    for field, kind in DOCUMENT_FIELDS.items():
+        if not metadata.get(field):
+            return f"Missing {field}"
+        if db.reference_data.name_for(kind, metadata[field]) is None:
+            return f"Unknown {field}: {metadata[field]}"
+    return None
+
+@app.route('/upload_bulk', methods=['POST'])
+def upload_bulk():
+    # Many files in one request. Form fields named like the single-upload
+    # form apply to every file; an optional 'metadata' JSON list overrides
+    # them per file, in the same order as the files.
+    files = [f for f in request.files.getlist('files') if f and f.filename]
+    if not files:
+        return jsonify({'error': 'No files uploaded'}), 400
+    try:
+        per_file = json.loads(request.form.get('metadata') or '[]')
+    except ValueError:
+        return jsonify({'error': 'metadata must be a JSON list'}), 400
+    if not isinstance(per_file, list):
+        return jsonify({'error': 'metadata must be a JSON list'}), 400
+    shared = {field: request.form.get(field) for field in DOCUMENT_FIELDS}
+
+    results = []
+    uploads = []
+    rows = []
+    for index, file in enumerate(files):
+        metadata = dict(shared)
+        if index < len(per_file) and isinstance(per_file[index], dict):
+            metadata.update({k: str(v) for k, v in per_file[index].items() if k in DOCUMENT_FIELDS and v})
+        error = _document_metadata_error(metadata)
+        if error:
+            results.append({'filename': file.filename, 'status': 'error', 'error': error})
+            continue
+        upload = storage.ingest(file, blob_store, app.config['MAX_UPLOAD_SIZE'])
+        uploads.append(upload)
+        rows.append({
+            'filename': upload.filename,
+            'file_path': upload.file_path,
+            'document_type_id': metadata['document_type'],
+            'project_id': metadata['project'],
+            'site_id': metadata['site'],
+            'status_id': metadata['status'],
+            'uploaded_by': metadata['user'],
+            'storage_key': upload.storage_key,
+            'sha256': upload.sha256,
+            'size_bytes': upload.size,
+        })
+        results.append({'filename': upload.filename, 'status': 'ok', 'sha256': upload.sha256, 'size': upload.size})
+
+    pending = [r for r in results if r['status'] == 'ok']
+    if rows:
+        try:
+            ids = db.insert_documents_bulk(rows, place_files=lambda: storage.place_all(uploads))
+            for result, document_id in zip(pending, ids):
+                result['id'] = document_id
+            jobs.enqueue([jobs.index_document_job(document_id) for document_id in ids] + _preview_jobs(uploads))
+        except Exception:
+            app.logger.exception('Bulk upload of %d file(s) failed', len(rows))
+            for result in pending:
+                result.update({'status': 'error', 'error': 'Database error, nothing from this batch was saved'})
+
+    uploaded = sum(1 for r in results if r['status'] == 'ok')
+    return jsonify({
+        'uploaded': uploaded,
+        'failed': len(results) - uploaded,
+        'results': results,
+    }), 200 if uploaded else 400
+
 @app.route('/delete/<int:document_id>', methods=['POST'])
 def delete_file(document_id):
-    file_path = db.delete_document(document_id)
-    if file_path and os.path.exists(file_path):
-        print(f"Deleting file: {file_path}")
-        os.remove(file_path)
-    else:
-        print(f"File not found for deletion: {file_path}")
+    if db.delete_document(document_id):
+        file_reclaimer.wake()
     return redirect(url_for('index', success='Document deleted successfully'))
 
 @app.route('/issues', methods=['GET', 'POST'])
-def issues():
-    filters = {}
+async def issues():
     if request.method == 'POST' and 'filter' in request.form:
-        project = request.form.get('project')
-        site = request.form.get('site')
-        status = request.form.get('status')
-        date = request.form.get('date')
-        if project:
-            filters['project'] = project
-        if site:
-            filters['site'] = site
-        if status:
-            filters['status'] = status
-        if date:
-            filters['date'] = date
+        filters = _read_filters(request.form, ISSUE_FILTER_KEYS)
         return redirect(url_for('issues', **filters))
-    else:
-        filters['project'] = request.args.get('project', '')
-        filters['site'] = request.args.get('site', '')
-        filters['status'] = request.args.get('status', '')
-        filters['date'] = request.args.get('date', '')
+    filters = _issue_filter_args()
 
     projects = db.get_projects()
     sites = db.get_sites()
     issue_statuses = db.get_issue_statuses()
     users = db.get_users()
-    issues = db.get_all_issues(filters)
-    # Debug logging to verify data
-    print("Issues:", [dict(issue) for issue in issues])
-    print("Issue Statuses:", [dict(status) for status in issue_statuses])
+    page = await _load_page(adb.get_issues_page, filters)
+    issues = await adb.load_issue_documents(page['rows'])
     return render_template('issues.html',
                          projects=projects,
                          sites=sites,
                          issue_statuses=issue_statuses,
                          users=users,
                          issues=issues,
-                         filters=filters,
-                         get_documents_for_issue=db.get_documents_for_issue)
+                         page=page,
+                         filters=filters)
 
 @app.route('/report_issue', methods=['POST'])
 def report_issue():
@@ -143,90 +375,301 @@ def report_issue():
     site_id = request.form['site']
     status_id = request.form['status']
     reported_by = request.form['reported_by']
-    deadline = request.form.get('deadline', None)
-    attachment_ids = []
-
-    if 'files' in request.files:
-        files = request.files.getlist('files')
-        issue_id = db.insert_issue(title, description, project_id, site_id, status_id, reported_by, deadline)
-        for file in files:
-            if file and file.filename != '':
-                filename = file.filename
-                file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                file.save(file_path)
-                print(f"Inserting attachment: {filename}, path: {file_path}, issue_id: {issue_id}")
-                db.insert_issue_attachment(filename, file_path, issue_id, reported_by)
-                conn = db.get_db_connection()
-                cursor = conn.cursor()
-                cursor.execute('SELECT id FROM issue_attachments WHERE filename = %s', (filename,))
-                new_attachment = cursor.fetchone()
-                conn.close()
-                if new_attachment:
-                    attachment_ids.append(str(new_attachment['id']))
-                else:
-                    print(f"Failed to find attachment in database: {filename}")
-
-    filters = {
-        'project': request.args.get('project', ''),
-        'site': request.args.get('site', ''),
-        'status': request.args.get('status', ''),
-        'date': request.args.get('date', '')
-    }
+    deadline = request.form.get('deadline') or None
+
+    uploads = [storage.ingest(file, blob_store, app.config['MAX_UPLOAD_SIZE'])
+               for file in request.files.getlist('files') if file and file.filename != '']
+    attachments = [{
+        'filename': upload.filename,
+        'file_path': upload.file_path,
+        'storage_key': upload.storage_key,
+        'sha256': upload.sha256,
+        'size_bytes': upload.size,
+    } for upload in uploads]
+    issue_id, attachment_ids = db.create_issue(title, description, project_id, site_id, status_id, reported_by,
+                                               deadline, attachments, place_files=lambda: storage.place_all(uploads))
+    app.logger.info('Created issue %s with attachments %s', issue_id, attachment_ids)
+    if uploads:
+        jobs.enqueue(_preview_jobs(uploads))
+
+    filters = _issue_filter_args()
     return redirect(url_for('issues', success='Issue reported successfully', **filters))
 
 @app.route('/delete_issue/<int:issue_id>', methods=['POST'])
 def delete_issue_route(issue_id):
-    conn = db.get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT id, file_path FROM issue_attachments WHERE issue_id = %s', (issue_id,))
-    attachments = cursor.fetchall()
-    for attachment in attachments:
-        file_path = attachment['file_path']
-        if os.path.exists(file_path):
-            os.remove(file_path)
-        db.delete_issue_attachment(attachment['id'])
-    db.delete_issue(issue_id)
-    conn.close()
-    filters = {
-        'project': request.args.get('project', ''),
-        'site': request.args.get('site', ''),
-        'status': request.args.get('status', ''),
-        'date': request.args.get('date', '')
-    }
+    if db.delete_issue(issue_id):
+        file_reclaimer.wake()
+    filters = _issue_filter_args()
     return redirect(url_for('issues', success='Issue deleted successfully', **filters))
 
+def _id_list(values):
+    if not isinstance(values, list) or not all(isinstance(v, int) and not isinstance(v, bool) for v in values):
+        raise ValueError('expected a list of integer ids')
+    return values
+
+@app.route('/api/delete', methods=['POST'])
+def delete_many():
+    # Body: {"documents": [ids], "issues": [ids]}; both optional. Everything
+    # is deleted in one transaction, files are removed in the background.
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return jsonify({'error': 'Expected a JSON object'}), 400
+    try:
+        document_ids = _id_list(payload.get('documents', []))
+        issue_ids = _id_list(payload.get('issues', []))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    deleted = db.delete_many(document_ids=document_ids, issue_ids=issue_ids)
+    if deleted['documents'] or deleted['issues']:
+        file_reclaimer.wake()
+    return jsonify({'deleted': deleted})
+
 @app.route('/update_issue_status', methods=['POST'])
 def update_issue_status():
     issue_id = request.form.get('issue_id')
     status_id = request.form.get('status')
     
     if not issue_id or not status_id:
-        filters = {
-            'project': request.args.get('project', ''),
-            'site': request.args.get('site', ''),
-            'status': request.args.get('status', ''),
-            'date': request.args.get('date', '')
-        }
+        filters = _issue_filter_args()
         return redirect(url_for('issues', error='Missing issue_id or status', **filters))
     
     success = db.update_issue_status(issue_id, status_id)
-    filters = {
-        'project': request.args.get('project', ''),
-        'site': request.args.get('site', ''),
-        'status': request.args.get('status', ''),
-        'date': request.args.get('date', '')
-    }
-    filters['status'] = ''
+    filters = _issue_filter_args()
+    filters['status'] = []
     if success:
         return redirect(url_for('issues', success='Status updated successfully', **filters))
     else:
         return redirect(url_for('issues', error='Failed to update status', **filters))
 
+@app.route('/api/db_pool')
+def db_pool_stats():
+    return jsonify(db.pool.stats())
+
+@app.route('/api/jobs')
+def job_stats():
+    # Queue depth per job kind and p50/p95 run and wait times over ?hours=
+    return jsonify(db.get_job_stats(request.args.get('hours', 24, type=int)))
+
+@app.route('/api/previews')
+def preview_cache_stats():
+    return jsonify(previews.cache.stats())
+
+@app.route('/api/trends')
+def trends():
+    # ?granularity=day|week|month&date_from=&date_to=&project=...
+    filters = _read_filters(request.args, ('project',))
+    try:
+        return jsonify(db.get_trends(request.args.get('granularity', 'day'), filters))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/api/search')
+def search():
+    # ?q=<words, "phrase", -word, or>&project=...&date_from=...&cursor=
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': 'q is required'}), 400
+    filters = _read_filters(request.args, DOCUMENT_FILTER_KEYS)
+    filters['q'] = query
+    cursor, page_size = _page_args()
+    try:
+        page = db.search_documents(filters, cursor, page_size)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    documents = [{
+        'id': row['id'],
+        'filename': row['filename'],
+        'url': url_for('serve_uploaded_file', filename=row['storage_key'] or row['filename'], name=row['filename']),
+        'document_type': row['type_name'],
+        'project': row['project_name'],
+        'site': row['site_name'],
+        'status': row['status_name'],
+        'uploaded_by': row['username'],
+        'created_at': row['created_at'].isoformat(),
+        'rank': round(row['rank'], 4),
+    } for row in page['rows']]
+    return jsonify({'q': query, 'documents': documents, 'next_cursor': page['next_cursor'],
+                    'prev_cursor': page['prev_cursor'], 'page_size': page['page_size']})
+
+# Suggestions for the filename filters, keyed by lower-cased input. Hot
+# prefixes are answered from memory; the ttl bounds how long a new upload
+# can be missing from them.
+AUTOCOMPLETE_MIN_CHARS = 3  # shorter inputs have no trigram to search by
+AUTOCOMPLETE_LIMIT = 10
+autocomplete_cache = LRUCache(maxsize=int(os.environ.get('AUTOCOMPLETE_CACHE_SIZE', 2048)),
+                              ttl=float(os.environ.get('AUTOCOMPLETE_CACHE_TTL', 30)))
+
+@app.route('/api/autocomplete/<kind>')
+def autocomplete(kind):
+    # kind: documents or attachments; ?q=<part of a filename>
+    text = request.args.get('q', '').strip().lower()
+    if kind not in db.FILENAME_SOURCES:
+        return jsonify({'error': f"Unknown filename source: {kind}"}), 404
+    if len(text) < AUTOCOMPLETE_MIN_CHARS:
+        suggestions = []
+    else:
+        suggestions = autocomplete_cache.get(
+            (kind, text), lambda: db.suggest_filenames(kind, text, AUTOCOMPLETE_LIMIT))
+    response = jsonify({'q': text, 'suggestions': suggestions})
+    response.cache_control.private = True
+    response.cache_control.max_age = int(autocomplete_cache.ttl)
+    return response
+
+@app.route('/api/autocomplete_cache')
+def autocomplete_cache_stats():
+    return jsonify(autocomplete_cache.stats())
+
+@app.route('/api/deadlines/<bucket>')
+def deadline_bucket(bucket):
+    # Pages through one deadline bucket (overdue, due_today, upcoming, later)
+    cursor, page_size = _page_args()
+    try:
+        return jsonify(db.get_deadline_bucket(bucket, cursor, page_size))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+def _dashboard_version():
+    # Deadline buckets also move when the day changes
+    today = datetime.datetime.now(ZoneInfo(db.DASHBOARD_TIMEZONE)).date()
+    return db.get_data_version() + (today,)
+
+def _dashboard_stats():
+    # Called by dashboard_cache from the (sync) dashboard views; the two
+    # aggregates run at once on the async_database executor, without an
+    # event loop
+    doc_stats, issue_stats = adb.gather_sync((db.get_dashboard_stats,), (db.get_issue_stats,))
+    return {'doc_stats': doc_stats, 'issue_stats': issue_stats}
+
+# Recomputed only after a write to documents/issues/lookup tables, a new
+# day, or DASHBOARD_CACHE_TTL seconds
+dashboard_cache = VersionedCache(_dashboard_version, _dashboard_stats,
+                                 ttl=float(os.environ.get('DASHBOARD_CACHE_TTL', 60)))
+
+@app.route('/api/dashboard')
+def dashboard_api():
+    entry = dashboard_cache.get()
+    response = app.response_class(entry['body'], mimetype='application/json')
+    response.set_etag(entry['etag'])
+    # Browsers keep the body but ask again every time; unchanged data is a 304
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
 @app.route('/dashboard')
 def dashboard():
-    doc_stats = db.get_dashboard_stats()
-    issue_stats = db.get_issue_stats()
-    return render_template('dashboard.html', doc_stats=doc_stats, issue_stats=issue_stats)
+    stats = dashboard_cache.get()['value']
+    return render_template('dashboard.html', doc_stats=stats['doc_stats'], issue_stats=stats['issue_stats'])
+
+@app.cli.command('explain-filters')
+def explain_filters_command():
+    """Check that date-range filters can use the created_at indexes."""
+    today = datetime.date.today()
+    filters = {'date_from': (today - datetime.timedelta(days=7)).isoformat(), 'date_to': today.isoformat()}
+    failed = False
+    for kind in ('documents', 'issues'):
+        plan = db.explain_listing(kind, filters, force_index=True)
+        click.echo(f"{kind}:\n  " + '\n  '.join(plan))
+        # Postgres shows an Index Cond, SQLite a SEARCH ... USING INDEX
+        uses_index = any(('Index Cond' in line or 'USING INDEX' in line) and 'created_at' in line for line in plan)
+        click.echo(f"  -> created_at index {'used' if uses_index else 'NOT used'}\n")
+        failed = failed or not uses_index
+    if failed:
+        raise SystemExit(1)
+
+@app.cli.command('fold-uploads')
+def fold_uploads_command():
+    """Move flat uploads into the content-addressed blob store."""
+    summary = storage.fold_legacy_files(blob_store, log=click.echo)
+    click.echo(f"Folded {summary['rows']} row(s) into {summary['blobs']} new blob(s); "
+               f"{summary['duplicates']} duplicate file(s) removed, "
+               f"{summary['reclaimed_bytes']} bytes reclaimed.")
+    for missing in summary['missing']:
+        click.echo(f"Missing file: {missing}")
+    if summary['orphans']:
+        click.echo(f"{len(summary['orphans'])} unreferenced file(s) left in place "
+                   f"({summary['orphan_bytes']} bytes): {', '.join(summary['orphans'])}")
+
+@app.cli.command('reclaim-files')
+@click.option('--limit', type=int, default=db.RECLAIM_BATCH_SIZE, help='Queue entries per batch.')
+def reclaim_files_command(limit):
+    """Unlink deleted files waiting in the reclaim queue."""
+    totals = {'removed': 0, 'kept': 0, 'failed': 0}
+    while True:
+        summary = db.reclaim_files(limit=limit)
+        for key in totals:
+            totals[key] += summary[key]
+        if sum(summary.values()) < limit:
+            break
+    stats = db.get_reclaim_queue_stats()
+    click.echo(f"Removed {totals['removed']} file(s), kept {totals['kept']} still referenced, "
+               f"{totals['failed']} failed. Queue: {stats['pending']} pending, {stats['failed']} given up.")
+
+@app.cli.command('reconcile-counters')
+@click.option('--fix', is_flag=True, help='Overwrite drifted counters with the recounted values.')
+def reconcile_counters_command(fix):
+    """Recount dashboard counters from scratch and report drift."""
+    drift = db.reconcile_counters(fix=fix)
+    for fact, dimension, key, stored, actual in drift:
+        click.echo(f"{fact} {dimension} {key or '-'}: stored {stored}, actual {actual}")
+    if not drift:
+        click.echo('Dashboard counters match.')
+    elif fix:
+        click.echo(f"Fixed {len(drift)} counter(s).")
+    else:
+        click.echo(f"{len(drift)} counter(s) drifted; run with --fix to correct them.")
+        raise SystemExit(1)
+
+@app.cli.command('refresh-rollups')
+def refresh_rollups_command():
+    """Roll up every day changed since the last run into daily_activity."""
+    total = 0
+    while True:
+        days = db.refresh_daily_activity()
+        total += days
+        if days < db.ROLLUP_BATCH_DAYS:
+            break
+    click.echo(f"Refreshed {total} day(s).")
+
+@app.cli.command('index-contents')
+@click.option('--reindex', is_flag=True, help='Extract every document again, not only new or changed ones.')
+def index_contents_command(reindex):
+    """Extract document text into the full-text search index."""
+    indexed = content_index.index_documents(reindex=reindex, log=click.echo)
+    click.echo(f"Indexed {indexed} document(s) ({content_index.EXTRACTOR_VERSION}).")
+
+@app.cli.command('run-jobs')
+@click.option('--processes', type=int, default=jobs.JOB_PROCESSES, help='Jobs run in parallel.')
+@click.option('--once', is_flag=True, help='Exit once no job is due instead of polling.')
+def run_jobs_command(processes, once):
+    """Run queued background jobs (text extraction after uploads)."""
+    jobs.run_worker(processes=processes, once=once, log=click.echo)
+
+@app.cli.command('render-previews')
+def render_previews_command():
+    """Queue preview rendering for every PDF uploaded so far."""
+    files = db.get_pdf_files()
+    queued = jobs.enqueue([jobs.render_previews_job(row['file_path'], row['storage_key'] or row['filename'])
+                           for row in files])
+    click.echo(f"Queued {len(queued)} of {len(files)} PDF(s); `flask run-jobs` renders them.")
+
+@app.cli.command('trigram-indexes')
+def trigram_indexes_command():
+    """Create the pg_trgm filename indexes (after installing pg_trgm)."""
+    with db.transaction() as cursor:
+        created = migrations.create_trigram_indexes(cursor, log=click.echo)
+    if not created:
+        raise SystemExit(1)
+    click.echo('Trigram indexes are in place.')
+
+@app.cli.command('migrate')
+@click.option('--target', type=int, default=None, help='Stop after this schema version.')
+def migrate_command(target):
+    """Apply pending schema migrations."""
+    applied = migrations.apply_migrations(target)
+    if applied:
+        click.echo(f"Applied migrations: {', '.join(str(v) for v in applied)}")
+    else:
+        click.echo('Schema is up to date.')
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
@@ -0,0 +1,99 @@
+import asyncio
+import functools
+import inspect
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import has_app_context
+
+import database as db
+
+# Awaitable versions of the database.py functions, under the same names,
+# for async Flask views or an ASGI app:
+#
+#     page, issues = await asyncio.gather(adb.get_issues_page(filters), adb.get_issue_stats())
+#
+# Each call runs on a thread of `executor` and borrows its own pooled
+# connection (there is no app context on those threads), so a page's
+# independent queries run side by side and it waits about as long as the
+# slowest of them. Separate calls are separate transactions: anything
+# that must see one snapshot belongs in a single database.py function.
+# A request hands its own connection back before it waits, so no thread
+# holds one connection while waiting for another, and the executor can
+# use the whole pool.
+ASYNC_DB_THREADS = int(os.environ.get('ASYNC_DB_THREADS', db.POOL_CONFIG['maxconn']))
+executor = ThreadPoolExecutor(max_workers=ASYNC_DB_THREADS, thread_name_prefix='async-db')
+
+# Connection plumbing; helpers whose first argument is a cursor are left
+# out too, since they run inside the caller's transaction
+SYNC_ONLY = {'get_db_connection', 'transaction', 'reset_after_fork', 'close_request_connection', 'execute_values'}
+
+
+def release_request_connection():
+    # database.py helpers commit their own writes, so the request
+    # connection has nothing pending here; a later helper in the same
+    # request checks out a fresh one
+    if has_app_context():
+        db.close_request_connection()
+
+
+async def run(function, *args, **kwargs):
+    # function(*args, **kwargs) on the executor
+    release_request_connection()
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(function, *args, **kwargs))
+
+
+def _awaitable(function):
+    @functools.wraps(function)
+    async def call(*args, **kwargs):
+        return await run(function, *args, **kwargs)
+    return call
+
+
+def _wrapped(name, function):
+    if name.startswith('_') or name in SYNC_ONLY or not inspect.isfunction(function):
+        return False
+    if function.__module__ != db.__name__:
+        return False
+    parameters = list(inspect.signature(function).parameters)
+    return not parameters or parameters[0] != 'cursor'
+
+
+__all__ = [name for name, function in vars(db).items() if _wrapped(name, function)]
+globals().update({name: _awaitable(getattr(db, name)) for name in __all__})
+
+
+
+# Where one database.py function runs several independent queries in a
+# row, its version here runs them at once
+
+async def _paged(load_page, count, filters, cursor, page_size, with_total):
+    if not with_total:
+        return await run(load_page, filters, cursor, page_size)
+    page, total = await asyncio.gather(run(load_page, filters, cursor, page_size), run(count, filters))
+    page['total'] = total
+    return page
+
+
+async def get_documents_page(filters=None, cursor=None, page_size=None, with_total=False):
+    return await _paged(db.get_documents_page, db.count_documents, filters, cursor, page_size, with_total)
+
+
+async def get_issues_page(filters=None, cursor=None, page_size=None, with_total=False):
+    return await _paged(db.get_issues_page, db.count_issues, filters, cursor, page_size, with_total)
+
+
+async def load_issue_documents(issues):
+    issue_ids = [issue['id'] for issue in issues]
+    attachments, linked = await asyncio.gather(run(db.get_attachments_for_issues, issue_ids),
+                                               run(db.get_linked_documents_for_issues, issue_ids))
+    return db.attach_issue_documents(issues, attachments, linked)
+
+
+def gather_sync(*calls):
+    # For sync code (e.g. the dashboard cache): runs each (function, *args)
+    # on the executor at once and returns their results in order
+    release_request_connection()
+    futures = [executor.submit(*call) for call in calls]
+    return [future.result() for future in futures]
@@ -0,0 +1,44 @@
+import os
+import threading
+
+
+class BackgroundWorker:
+    # Daemon thread that calls run_once() every `interval` seconds, or
+    # sooner after wake(). run_once() returns True while more work is
+    # waiting, and is then called again straight away. Started lazily and
+    # again after a fork, since threads do not survive one.
+    def __init__(self, name, run_once, interval=60.0):
+        self.name = name
+        self.run_once = run_once
+        self.interval = interval
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def _alive(self):
+        return self._thread is not None and self._pid == os.getpid() and self._thread.is_alive()
+
+    def start(self):
+        if self._alive():
+            return
+        with self._lock:
+            if not self._alive():
+                self._pid = os.getpid()
+                self._event = threading.Event()
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+
+    def wake(self):
+        self.start()
+        self._event.set()
+
+    def _run(self):
+        while True:
+            self._event.wait(self.interval)
+            self._event.clear()
+            try:
+                while self.run_once():
+                    pass
+            except Exception as e:
+                print(f"{self.name}: {e}")
@@ -0,0 +1,167 @@
+"""Postgres vs SQLite (WAL): the same database.py calls timed on both engines.
+
+Each engine runs in its own process, since database.py picks the backend
+at import. Postgres is whatever DATABASE_URL (or the local default)
+points at; seeded rows are removed afterwards. SQLite gets a fresh file
+in a temporary directory. Reports the median latency of each call:
+
+    python benchmarks/backends.py --seed 20000 --repeat 50
+    python benchmarks/backends.py --backends sqlite
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SEED_PREFIX = 'bench-'
+BACKENDS = ('postgres', 'sqlite')
+
+
+def seed(db, documents, issues):
+    type_id = db.get_document_types()[0]['id']
+    site_id = db.get_sites()[0]['id']
+    status_id = db.get_statuses()[0]['id']
+    user_id = db.get_users()[0]['id']
+    project_ids = [project['id'] for project in db.get_projects()]
+    for start in range(0, documents, 1000):
+        db.insert_documents_bulk([
+            {'filename': f'{SEED_PREFIX}{n} rev {"ABC"[n % 3]}.pdf', 'file_path': '', 'document_type_id': type_id,
+             'project_id': project_ids[n % len(project_ids)], 'site_id': site_id, 'status_id': status_id,
+             'uploaded_by': user_id}
+            for n in range(start, min(start + 1000, documents))])
+    issue_status_id = db.get_issue_statuses()[0]['id']
+    with db.transaction() as cursor:
+        db.execute_values(cursor, '''
+            INSERT INTO issues (title, description, project_id, site_id, status_id, reported_by, deadline) VALUES %s
+        ''', [(f'{SEED_PREFIX}{n}', '', project_ids[n % len(project_ids)], site_id, issue_status_id, user_id,
+               f'2026-{1 + n % 12:02d}-{1 + n % 28:02d}') for n in range(issues)])
+        cursor.execute('ANALYZE documents')
+        cursor.execute('ANALYZE issues')
+
+
+def cleanup(db):
+    with db.transaction() as cursor:
+        cursor.execute('SELECT id FROM documents WHERE filename LIKE %s', (SEED_PREFIX + '%',))
+        document_ids = [row['id'] for row in cursor.fetchall()]
+        cursor.execute('SELECT id FROM issues WHERE title LIKE %s', (SEED_PREFIX + '%',))
+        issue_ids = [row['id'] for row in cursor.fetchall()]
+    db.delete_many(document_ids=document_ids, issue_ids=issue_ids)
+
+
+def timed(call, repeat):
+    call()  # warm caches
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        call()
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+def measure(db, repeat):
+    project = db.get_projects()[0]['project_name']
+    type_id = db.get_document_types()[0]['id']
+    user_id = db.get_users()[0]['id']
+    inserted = []
+
+    def insert_one():
+        inserted.append(db.insert_document(f'{SEED_PREFIX}single.pdf', '', type_id, db.get_projects()[0]['id'],
+                                           db.get_sites()[0]['id'], db.get_statuses()[0]['id'], user_id))
+
+    def insert_bulk():
+        inserted.extend(db.insert_documents_bulk([
+            {'filename': f'{SEED_PREFIX}bulk.pdf', 'file_path': '', 'document_type_id': type_id,
+             'project_id': db.get_projects()[0]['id'], 'site_id': db.get_sites()[0]['id'],
+             'status_id': db.get_statuses()[0]['id'], 'uploaded_by': user_id}] * 100))
+
+    def delete_bulk():
+        db.delete_many(document_ids=inserted[-100:])
+        del inserted[-100:]
+
+    calls = [
+        ('listing page', lambda: db.get_documents_page()),
+        ('listing + project filter', lambda: db.get_documents_page({'project': project})),
+        ('listing + filename filter', lambda: db.get_documents_page({'filename': 'rev b'})),
+        ('issues page', lambda: db.get_issues_page()),
+        ('filename autocomplete', lambda: db.suggest_filenames('documents', f'{SEED_PREFIX}12')),
+        ('full-text search', lambda: db.search_documents({'q': 'rev c'})),
+        ('dashboard', lambda: (db.get_dashboard_stats(), db.get_issue_stats())),
+        ('insert 1 document', insert_one),
+        ('insert 100 documents', insert_bulk),
+        ('delete 100 documents', delete_bulk),
+    ]
+    results = {}
+    for name, call in calls:
+        if name == 'delete 100 documents':
+            # one bulk insert per timed delete
+            for _ in range(repeat + 1):
+                insert_bulk()
+        results[name] = timed(call, repeat)
+    db.delete_many(document_ids=inserted)
+    return results
+
+
+def worker(backend, documents, issues, repeat):
+    # Runs in the child process; prints the timings as JSON
+    with contextlib.redirect_stdout(io.StringIO()):
+        import database as db
+        import migrations
+        migrations.apply_migrations()
+        try:
+            seed(db, documents, issues)
+            results = measure(db, repeat)
+        finally:
+            if backend == 'postgres':
+                cleanup(db)
+    print(json.dumps(results))
+
+
+def run(backend, args):
+    env = dict(os.environ)
+    with tempfile.TemporaryDirectory() as directory:
+        if backend == 'sqlite':
+            env['DATABASE_URL'] = f"sqlite:///{os.path.join(directory, 'bench.db')}"
+        elif env.get('DATABASE_URL', '').startswith('sqlite:'):
+            del env['DATABASE_URL']
+        process = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--worker', backend, '--seed', str(args.seed),
+             '--repeat', str(args.repeat)], env=env, cwd=directory, capture_output=True, text=True)
+    if process.returncode != 0:
+        print(f"{backend} failed:\n{process.stderr.strip()}", file=sys.stderr)
+        return None
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seed', type=int, default=10000, help='Documents and issues to insert before measuring.')
+    parser.add_argument('--repeat', type=int, default=20, help='Timed calls per operation.')
+    parser.add_argument('--backends', default=','.join(BACKENDS), help='Comma-separated engines to run.')
+    parser.add_argument('--worker', choices=BACKENDS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.worker:
+        worker(args.worker, args.seed, args.seed, args.repeat)
+        return
+
+    backends = [backend for backend in args.backends.split(',') if backend in BACKENDS]
+    results = {backend: run(backend, args) for backend in backends}
+    backends = [backend for backend in backends if results[backend]]
+    if not backends:
+        raise SystemExit(1)
+    print(f"{args.seed} documents and issues, median ms of {args.repeat} calls")
+    print(f"{'operation':<28}" + ''.join(f"{backend:>12}" for backend in backends))
+    for name in results[backends[0]]:
+        print(f"{name:<28}" + ''.join(f"{results[backend][name]:>12.2f}" for backend in backends))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+"""Dashboard aggregation: per-chart queries vs GROUPING SETS vs the counters table.
+
+Seeds a large dataset, then reports for each variant the number of scans of
+documents/issues in the query plans and the median latency of the
+aggregates per dashboard load. Run against a scratch database:
+
+    python benchmarks/dashboard.py --seed 200000 --repeat 20
+    python benchmarks/dashboard.py --cleanup
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database as db  # noqa: E402
+
+SEED_PREFIX = 'bench-'
+
+# What get_dashboard_stats/get_issue_stats ran before: one query per chart
+LEGACY_QUERIES = [
+    'SELECT COUNT(*) FROM documents',
+    '''SELECT dt.type_name, COUNT(d.id) as count FROM documents d
+       JOIN document_types dt ON d.document_type_id = dt.id GROUP BY dt.id, dt.type_name''',
+    '''SELECT p.project_name, COUNT(d.id) as count FROM documents d
+       JOIN projects p ON d.project_id = p.id GROUP BY p.id, p.project_name''',
+    '''SELECT st.status_name, COUNT(d.id) as count FROM documents d
+       JOIN statuses st ON d.status_id = st.id GROUP BY st.id, st.status_name''',
+    'SELECT COUNT(*) FROM issues',
+    '''SELECT st.status_name, COUNT(i.id) as count FROM issues i
+       JOIN issue_statuses st ON i.status_id = st.id GROUP BY st.id, st.status_name''',
+    '''SELECT p.project_name, COUNT(i.id) as count FROM issues i
+       JOIN projects p ON i.project_id = p.id GROUP BY p.id, p.project_name''',
+    '''SELECT deadline, COUNT(*) as count FROM issues WHERE deadline IS NOT NULL
+       GROUP BY deadline ORDER BY deadline ASC''',
+]
+
+GROUPED_QUERIES = [db.DOCUMENT_STATS_QUERY, db.ISSUE_STATS_QUERY]
+
+# What the dashboard reads now that the triggers keep dashboard_counters
+COUNTER_QUERIES = [
+    "SELECT dimension, key, count FROM dashboard_counters WHERE fact = 'documents' AND count <> 0",
+    "SELECT dimension, key, count FROM dashboard_counters WHERE fact = 'issues' AND count <> 0",
+]
+
+# The deadline table is a row listing rather than an aggregate and runs
+# unchanged in both variants; it is timed on its own
+DEADLINE_LISTING = ['''
+    SELECT i.id, i.title, p.project_name, s.site_name, i.deadline FROM issues i
+    JOIN projects p ON i.project_id = p.id JOIN sites s ON i.site_id = s.id
+    WHERE i.deadline IS NOT NULL ORDER BY i.deadline ASC
+''']
+
+FACT_TABLES = ('documents', 'issues')
+
+
+def seed(cursor, documents, issues):
+    cursor.execute(f'''
+        INSERT INTO documents (filename, file_path, document_type_id, project_id, site_id, status_id, uploaded_by,
+                               created_at)
+        SELECT '{SEED_PREFIX}' || n, '', t.ids[1 + mod(n, array_length(t.ids, 1))],
+               p.ids[1 + mod(n, array_length(p.ids, 1))], s.ids[1 + mod(n, array_length(s.ids, 1))],
+               st.ids[1 + mod(n, array_length(st.ids, 1))], u.ids[1 + mod(n, array_length(u.ids, 1))],
+               CURRENT_TIMESTAMP - n * INTERVAL '1 minute'
+        FROM generate_series(1, %s) n,
+             (SELECT array_agg(id) ids FROM document_types) t, (SELECT array_agg(id) ids FROM projects) p,
+             (SELECT array_agg(id) ids FROM sites) s, (SELECT array_agg(id) ids FROM statuses) st,
+             (SELECT array_agg(id) ids FROM users) u
+    ''', (documents,))
+    cursor.execute(f'''
+        INSERT INTO issues (title, description, project_id, site_id, status_id, reported_by, deadline, created_at)
+        SELECT '{SEED_PREFIX}' || n, '', p.ids[1 + mod(n, array_length(p.ids, 1))],
+               s.ids[1 + mod(n, array_length(s.ids, 1))], st.ids[1 + mod(n, array_length(st.ids, 1))],
+               u.ids[1 + mod(n, array_length(u.ids, 1))],
+               CASE WHEN mod(n, 3) = 0 THEN NULL ELSE CURRENT_DATE + (mod(n, 120) - 60) END,
+               CURRENT_TIMESTAMP - n * INTERVAL '1 minute'
+        FROM generate_series(1, %s) n,
+             (SELECT array_agg(id) ids FROM projects) p, (SELECT array_agg(id) ids FROM sites) s,
+             (SELECT array_agg(id) ids FROM issue_statuses) st, (SELECT array_agg(id) ids FROM users) u
+    ''', (issues,))
+    cursor.execute('ANALYZE documents')
+    cursor.execute('ANALYZE issues')
+
+
+def cleanup(cursor):
+    cursor.execute('DELETE FROM documents WHERE filename LIKE %s', (SEED_PREFIX + '%',))
+    cursor.execute('DELETE FROM issues WHERE title LIKE %s', (SEED_PREFIX + '%',))
+
+
+def count_scans(plan):
+    # Scan nodes over the fact tables anywhere in the plan tree
+    scans = 1 if plan.get('Relation Name') in FACT_TABLES and 'Scan' in plan['Node Type'] else 0
+    return scans + sum(count_scans(child) for child in plan.get('Plans', []))
+
+
+def plan_scans(cursor, queries):
+    total = 0
+    for query in queries:
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + query)
+        total += count_scans(cursor.fetchone()[0][0]['Plan'])
+    return total
+
+
+def latency(cursor, queries, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for query in queries:
+            cursor.execute(query)
+            cursor.fetchall()
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seed', type=int, default=0, help='Documents and issues to insert before measuring.')
+    parser.add_argument('--repeat', type=int, default=10, help='Dashboard loads to time per variant.')
+    parser.add_argument('--cleanup', action='store_true', help='Remove seeded rows and exit.')
+    args = parser.parse_args()
+
+    with db.transaction() as cursor:
+        if args.cleanup:
+            cleanup(cursor)
+            print('Seeded rows removed.')
+            return
+        if args.seed:
+            seed(cursor, args.seed, args.seed)
+        cursor.execute('SELECT (SELECT COUNT(*) FROM documents), (SELECT COUNT(*) FROM issues)')
+        documents, issues = cursor.fetchone()
+
+    print(f"{documents} documents, {issues} issues, median of {args.repeat} loads")
+    print(f"{'variant':<16}{'queries':>8}{'scans':>8}{'latency ms':>12}")
+    with db.transaction() as cursor:
+        for name, queries in (('per-chart', LEGACY_QUERIES), ('grouping sets', GROUPED_QUERIES),
+                              ('counters', COUNTER_QUERIES), ('deadline list', DEADLINE_LISTING)):
+            latency(cursor, queries, 1)  # warm the cache
+            print(f"{name:<16}{len(queries):>8}{plan_scans(cursor, queries):>8}"
+                  f"{latency(cursor, queries, args.repeat):>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
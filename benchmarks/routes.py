@@ -0,0 +1,413 @@
+"""Throughput and latency of the Flask routes under concurrent load.
+
+The app runs in a child process (werkzeug's threaded server, uploads in a
+temporary directory) against the database DATABASE_URL points at:
+Postgres, or a SQLite file with sqlite:///path. It is seeded at the given
+scale and every route is driven by 1, 4 and 16 concurrent clients. For
+each route and level this reports requests per second, p50/p95/p99
+latency, and the SQL statements and pool checkouts per request. Seeded
+and benchmark-created rows and files are removed afterwards.
+
+    python benchmarks/routes.py --seed 20000 --duration 5 --output results.json
+    python benchmarks/routes.py --baseline results.json --tolerance 0.2
+
+With --baseline the run is compared against an earlier --output file and
+exits with status 1 when a route got slower, lost throughput or issues
+more queries, so it can gate a change.
+"""
+import argparse
+import http.client
+import itertools
+import json
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from urllib.parse import quote, urlencode
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from backends import SEED_PREFIX, cleanup, seed  # noqa: E402
+
+DEFAULT_CONCURRENCY = '1,4,16'
+# More queries per request than the baseline by at least this many is a
+# regression; averages move a little with the in-process caches
+QUERY_TOLERANCE = 0.5
+
+
+def _form(fields):
+    return urlencode(fields).encode(), {'Content-Type': 'application/x-www-form-urlencoded'}
+
+
+def _multipart(fields, filename, content):
+    boundary = uuid.uuid4().hex
+    parts = [f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+             for name, value in fields.items()]
+    parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+                 f'Content-Type: application/pdf\r\n\r\n'.encode() + content + b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), {'Content-Type': f'multipart/form-data; boundary={boundary}'}
+
+
+# route -> request(context, n) giving (method, path, body, headers) for
+# the n-th request. Reads come first so writes do not change what they see.
+def _index(context, n):
+    return 'GET', '/', None, {}
+
+
+def _index_filtered(context, n):
+    return 'GET', '/?' + urlencode({'project': context['project'], 'status': context['status']}), None, {}
+
+
+def _issues(context, n):
+    return 'GET', '/issues', None, {}
+
+
+def _issues_filtered(context, n):
+    return 'GET', '/issues?' + urlencode({'project': context['project'],
+                                          'status': context['issue_status']}), None, {}
+
+
+def _dashboard(context, n):
+    return 'GET', '/dashboard', None, {}
+
+
+def _download(context, n):
+    return 'GET', context['download'], None, {}
+
+
+def _upload(context, n):
+    ids = context['ids']
+    # Different bytes every time: each upload stores a new blob
+    content = b'%PDF-1.4\n% ' + f'{SEED_PREFIX}{uuid.uuid4().hex}\n'.encode()
+    content += b'0' * max(0, context['upload_bytes'] - len(content))
+    body, headers = _multipart({'document_type': ids['document_type'], 'project': ids['project'],
+                                'site': ids['site'], 'status': ids['status'], 'user': ids['user']},
+                               f'{SEED_PREFIX}upload-{n}.pdf', content)
+    return 'POST', '/upload', body, headers
+
+
+def _report_issue(context, n):
+    ids = context['ids']
+    body, headers = _form({'title': f'{SEED_PREFIX}issue-{n}', 'description': 'Benchmark issue',
+                           'project': ids['project'], 'site': ids['site'], 'status': ids['issue_statuses'][0],
+                           'reported_by': ids['user'], 'deadline': '2026-06-30'})
+    return 'POST', '/report_issue', body, headers
+
+
+def _update_issue_status(context, n):
+    issue_ids, statuses = context['issue_ids'], context['ids']['issue_statuses']
+    body, headers = _form({'issue_id': issue_ids[n % len(issue_ids)], 'status': statuses[n % len(statuses)]})
+    return 'POST', '/update_issue_status', body, headers
+
+
+ROUTES = {
+    'index': _index,
+    'index_filtered': _index_filtered,
+    'issues': _issues,
+    'issues_filtered': _issues_filtered,
+    'dashboard': _dashboard,
+    'download': _download,
+    'upload': _upload,
+    'report_issue': _report_issue,
+    'update_issue_status': _update_issue_status,
+}
+
+
+class QueryCounter:
+    # Counts statements sent through the database.py cursors, on either
+    # backend, by wrapping their execute()
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def install(self, cursor_class):
+        execute = cursor_class.execute
+
+        def counted(cursor, *args, **kwargs):
+            with self._lock:
+                self.count += 1
+            return execute(cursor, *args, **kwargs)
+
+        cursor_class.execute = counted
+
+
+def _prepare(db, client, documents, issues):
+    # Seeds the database and uploads the file the download route fetches
+    seed(db, documents, issues)
+    ids = {
+        'document_type': db.get_document_types()[0]['id'],
+        'project': db.get_projects()[0]['id'],
+        'site': db.get_sites()[0]['id'],
+        'status': db.get_statuses()[0]['id'],
+        'user': db.get_users()[0]['id'],
+        'issue_statuses': [status['id'] for status in db.get_issue_statuses()],
+    }
+    body, headers = _multipart({key: ids[key] for key in ('document_type', 'project', 'site', 'status', 'user')},
+                               f'{SEED_PREFIX}download.pdf', b'%PDF-1.4\n' + b'0' * 256 * 1024)
+    response = client.post('/upload', data=body, headers=headers)
+    if response.status_code >= 400:
+        raise RuntimeError(f"Could not upload the download fixture: {response.status_code}")
+    with db.transaction() as cursor:
+        cursor.execute('SELECT storage_key FROM documents WHERE filename = %s ORDER BY id DESC LIMIT 1',
+                       (f'{SEED_PREFIX}download.pdf',))
+        storage_key = cursor.fetchone()['storage_key']
+        cursor.execute('SELECT id FROM issues WHERE title LIKE %s ORDER BY id LIMIT 1000', (SEED_PREFIX + '%',))
+        issue_ids = [row['id'] for row in cursor.fetchall()]
+    return {
+        'ids': ids,
+        'issue_ids': issue_ids,
+        'project': db.get_projects()[0]['project_name'],
+        'status': db.get_statuses()[0]['status_name'],
+        'issue_status': db.get_issue_statuses()[0]['status_name'],
+        'download': f"/uploads/{quote(storage_key)}?name={SEED_PREFIX}download.pdf",
+        'backend': 'sqlite' if db.SQLITE else 'postgres',
+    }
+
+
+def _remove_benchmark_data(db, first_job_id):
+    cleanup(db)
+    while sum(db.reclaim_files(limit=1000).values()):
+        pass
+    with db.transaction() as cursor:
+        cursor.execute('DELETE FROM jobs WHERE id > %s', (first_job_id,))
+
+
+def _stop(signum, frame):
+    raise SystemExit(0)
+
+
+def serve(documents, issues):
+    # Child process: seed, print the context as one JSON line, serve until
+    # SIGTERM, then remove everything the benchmark added
+    ready = sys.stdout
+    sys.stdout = open(os.devnull, 'w')  # the app logs with print()
+    import psycopg2.extras
+    from werkzeug.serving import WSGIRequestHandler, make_server
+    import app
+    import database as db
+    import migrations
+    import sqlite_backend
+
+    migrations.apply_migrations()
+    queries = QueryCounter()
+    queries.install(psycopg2.extras.DictCursor)
+    queries.install(sqlite_backend.Cursor)
+
+    @app.app.route('/_bench/stats')
+    def bench_stats():
+        stats = db.pool.stats()
+        return {'queries': queries.count, 'checkouts': stats['checkouts'],
+                'connections_opened': stats['connections_opened'], 'pool_waits': stats.get('waits', 0)}
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    with db.transaction() as cursor:
+        cursor.execute('SELECT COALESCE(MAX(id), 0) FROM jobs')
+        first_job_id = cursor.fetchone()[0]
+    signal.signal(signal.SIGTERM, _stop)
+    server = None
+    try:
+        context = _prepare(db, app.app.test_client(), documents, issues)
+        server = make_server('127.0.0.1', 0, app.app, threaded=True, request_handler=QuietHandler)
+        context['port'] = server.server_port
+        print(json.dumps(context), file=ready, flush=True)
+        server.serve_forever()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        if server is not None:
+            server.server_close()
+        _remove_benchmark_data(db, first_job_id)
+
+
+def _get_json(port, path):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    try:
+        conn.request('GET', path)
+        return json.loads(conn.getresponse().read())
+    finally:
+        conn.close()
+
+
+def drive(port, route, context, concurrency, duration):
+    # `concurrency` clients on keep-alive connections send requests back to
+    # back for `duration` seconds; returns (latencies in ms, errors, seconds)
+    sequence = itertools.count()
+    latencies = [[] for _ in range(concurrency)]
+    errors = [0] * concurrency
+    deadline = time.monotonic() + duration
+
+    def client(slot):
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        while time.monotonic() < deadline:
+            method, path, body, headers = route(context, next(sequence))
+            started = time.perf_counter()
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                response = conn.getresponse()
+                response.read()
+                failed = response.status >= 400
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+                failed = True
+            latencies[slot].append((time.perf_counter() - started) * 1000)
+            errors[slot] += failed
+        conn.close()
+
+    threads = [threading.Thread(target=client, args=(slot,)) for slot in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return [ms for slot in latencies for ms in slot], sum(errors), time.perf_counter() - started
+
+
+def _percentiles(latencies):
+    if len(latencies) < 2:
+        return latencies * 3
+    cuts = statistics.quantiles(latencies, n=100, method='inclusive')
+    return cuts[49], cuts[94], cuts[98]
+
+
+def measure(port, route, context, concurrency, duration):
+    drive(port, route, context, 1, min(1.0, duration / 5))  # warm caches and connections
+    before = _get_json(port, '/_bench/stats')
+    latencies, errors, elapsed = drive(port, route, context, concurrency, duration)
+    after = _get_json(port, '/_bench/stats')
+    requests = len(latencies)
+    p50, p95, p99 = _percentiles(latencies)
+    return {
+        'requests': requests,
+        'errors': errors,
+        'throughput_rps': requests / elapsed,
+        'mean_ms': statistics.fmean(latencies) if latencies else None,
+        'p50_ms': p50,
+        'p95_ms': p95,
+        'p99_ms': p99,
+        'queries_per_request': (after['queries'] - before['queries']) / max(requests, 1),
+        'checkouts_per_request': (after['checkouts'] - before['checkouts']) / max(requests, 1),
+        'connections_opened': after['connections_opened'] - before['connections_opened'],
+        # Checkouts that found the pool exhausted and had to wait
+        'pool_waits': after['pool_waits'] - before['pool_waits'],
+    }
+
+
+def compare(baseline, results, tolerance):
+    # [(route, concurrency, metric, baseline, now)] that got worse
+    regressions = []
+    for route, levels in results['routes'].items():
+        for level, now in levels.items():
+            before = baseline.get('routes', {}).get(route, {}).get(level)
+            if not before:
+                continue
+            if now['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+                regressions.append((route, level, 'p95_ms', before['p95_ms'], now['p95_ms']))
+            if now['throughput_rps'] < before['throughput_rps'] * (1 - tolerance):
+                regressions.append((route, level, 'throughput_rps', before['throughput_rps'], now['throughput_rps']))
+            if now['queries_per_request'] > before['queries_per_request'] + QUERY_TOLERANCE:
+                regressions.append((route, level, 'queries_per_request', before['queries_per_request'],
+                                    now['queries_per_request']))
+            if now['errors'] > before['errors']:
+                regressions.append((route, level, 'errors', before['errors'], now['errors']))
+    return regressions
+
+
+def _revision():
+    process = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True)
+    return process.stdout.strip() or None
+
+
+def report(results, baseline):
+    print(f"{results['backend']}, {results['seed']} documents and issues, {results['duration']}s per run")
+    print(f"{'route':<20}{'clients':>8}{'req/s':>9}{'p50':>8}{'p95':>8}{'p99':>8}{'queries':>9}{'conns':>7}{'waits':>7}"
+          + (f"{'p95 vs base':>13}" if baseline else ''))
+    for route, levels in results['routes'].items():
+        for level, r in levels.items():
+            line = (f"{route:<20}{level:>8}{r['throughput_rps']:>9.1f}{r['p50_ms']:>8.1f}{r['p95_ms']:>8.1f}"
+                    f"{r['p99_ms']:>8.1f}{r['queries_per_request']:>9.1f}{r['checkouts_per_request']:>7.1f}"
+                    f"{r.get('pool_waits', 0):>7}")
+            before = (baseline or {}).get('routes', {}).get(route, {}).get(level)
+            if before:
+                line += f"{(r['p95_ms'] / before['p95_ms'] - 1) * 100:>+12.0f}%"
+            if r['errors']:
+                line += f"  {r['errors']} errors"
+            print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seed', type=int, default=10000, help='Documents and issues to insert before measuring.')
+    parser.add_argument('--duration', type=float, default=5, help='Seconds per route and concurrency level.')
+    parser.add_argument('--concurrency', default=DEFAULT_CONCURRENCY, help='Comma-separated client counts.')
+    parser.add_argument('--routes', default=','.join(ROUTES), help='Comma-separated routes to run.')
+    parser.add_argument('--upload-bytes', type=int, default=64 * 1024, help='Size of each uploaded file.')
+    parser.add_argument('--output', help='Write the results to this JSON file.')
+    parser.add_argument('--baseline', help='Compare with the JSON of an earlier run; exit 1 on a regression.')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Allowed relative loss in p95 latency and throughput against the baseline.')
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        serve(args.seed, args.seed)
+        return
+
+    routes = [route for route in args.routes.split(',') if route in ROUTES]
+    levels = [int(level) for level in args.concurrency.split(',')]
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    # Background workers would add their own queries to the counts
+    env = dict(os.environ, RECLAIM_INTERVAL='86400', ROLLUP_INTERVAL='86400')
+    with tempfile.TemporaryDirectory() as directory:
+        server = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve', '--seed', str(args.seed)],
+                                  env=env, cwd=directory, stdout=subprocess.PIPE, text=True)
+        try:
+            line = server.stdout.readline()
+            if not line:
+                raise SystemExit(f"Server failed to start (exit status {server.wait()})")
+            context = json.loads(line)
+            context['upload_bytes'] = args.upload_bytes
+            results = {
+                'backend': context['backend'],
+                'revision': _revision(),
+                'started_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                'seed': args.seed,
+                'duration': args.duration,
+                'routes': {},
+            }
+            for route in routes:
+                for level in levels:
+                    print(f"{route} with {level} client(s)...", file=sys.stderr)
+                    results['routes'].setdefault(route, {})[str(level)] = measure(
+                        context['port'], ROUTES[route], context, level, args.duration)
+        finally:
+            server.send_signal(signal.SIGTERM)
+            server.wait(timeout=600)
+
+    report(results, baseline)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if baseline:
+        regressions = compare(baseline, results, args.tolerance)
+        for route, level, metric, before, now in regressions:
+            print(f"REGRESSION {route} ({level} clients): {metric} {before:.2f} -> {now:.2f}")
+        if regressions:
+            raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
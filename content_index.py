@@ -0,0 +1,115 @@
+import os
+import zipfile
+from xml.etree import ElementTree
+
+try:
+    from pypdf import PdfReader
+except ImportError:  # optional: without it PDFs are only searchable by filename
+    PdfReader = None
+
+import database as db
+
+# Text beyond this is not indexed (a tsvector is limited to 1 MB)
+MAX_TEXT_CHARS = int(os.environ.get('MAX_INDEXED_CHARS', 500000))
+TEXT_EXTENSIONS = {'.txt', '.csv', '.md'}
+WORD_NS = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+
+# Stored with every indexed document. It changes when the extractors or
+# the search language do (e.g. pypdf installed later), which makes the
+# next run extract everything again.
+EXTRACTOR_VERSION = f"1;pdf={'pypdf' if PdfReader else 'none'};lang={db.SEARCH_LANGUAGE}"
+
+
+def _pdf_text(path):
+    if PdfReader is None:
+        return ''
+    parts = []
+    size = 0
+    for page in PdfReader(path).pages:
+        text = page.extract_text() or ''
+        parts.append(text)
+        size += len(text)
+        if size >= MAX_TEXT_CHARS:
+            break
+    return '\n'.join(parts)
+
+
+def _docx_text(path):
+    # word/document.xml holds the body; every run of text is a <w:t>
+    with zipfile.ZipFile(path) as archive:
+        root = ElementTree.fromstring(archive.read('word/document.xml'))
+    return '\n'.join(''.join(node.text or '' for node in paragraph.iter(WORD_NS + 't'))
+                     for paragraph in root.iter(WORD_NS + 'p'))
+
+
+def _plain_text(path):
+    with open(path, encoding='utf-8', errors='replace') as f:
+        return f.read(MAX_TEXT_CHARS)
+
+
+EXTRACTORS = {'.pdf': _pdf_text, '.docx': _docx_text}
+EXTRACTORS.update({extension: _plain_text for extension in TEXT_EXTENSIONS})
+
+
+def extract_text(path, filename):
+    # Plain text of an uploaded file; '' for types we cannot read and for
+    # files that fail to parse
+    extractor = EXTRACTORS.get(os.path.splitext(filename)[1].lower())
+    if extractor is None:
+        return ''
+    try:
+        text = extractor(path)
+    except Exception as e:
+        print(f"Could not extract text from {filename}: {e}")
+        return ''
+    # Postgres text cannot hold NUL characters
+    return text[:MAX_TEXT_CHARS].replace('\x00', ' ')
+
+
+def _content_key(row):
+    # Blob-store files are identified by their hash; legacy flat files by
+    # modification time and size
+    if row['sha256']:
+        return row['sha256']
+    stat = os.stat(row['file_path'])
+    return f"{stat.st_mtime_ns}:{stat.st_size}"
+
+
+def index_documents(batch_size=100, reindex=False, ids=None, log=print):
+    # Brings document_contents up to date and returns the number of
+    # documents (re)indexed. Unchanged documents cost nothing but the
+    # pending-rows query; content already extracted for another document
+    # with the same hash is copied inside the database instead of being
+    # extracted again. reindex=True extracts every document afresh; `ids`
+    # limits the pass to those documents.
+    indexed = 0
+    after_id = 0
+    while True:
+        rows = db.get_documents_to_index(EXTRACTOR_VERSION, after_id, batch_size, everything=reindex, ids=ids)
+        if not rows:
+            return indexed
+        after_id = rows[-1]['id']
+        sources = {} if reindex else db.find_indexed_contents([row['sha256'] for row in rows if row['sha256']],
+                                                               EXTRACTOR_VERSION)
+        copies = []
+        extracted = []
+        texts = {}  # sha256 -> text, for duplicates within the batch
+        for row in rows:
+            if row['sha256'] in sources:
+                copies.append((row['id'], sources[row['sha256']]))
+                continue
+            if not os.path.exists(row['file_path']):
+                log(f"Missing file for document {row['id']}: {row['file_path']}")
+                continue
+            key = _content_key(row)
+            if not reindex and key == row['content_key'] and row['extractor'] == EXTRACTOR_VERSION:
+                continue  # legacy file, unchanged since it was indexed
+            if row['sha256'] and row['sha256'] in texts:
+                text = texts[row['sha256']]
+            else:
+                text = extract_text(row['file_path'], row['filename'])
+                if row['sha256']:
+                    texts[row['sha256']] = text
+            extracted.append((row['id'], key, text))
+        db.save_document_contents(EXTRACTOR_VERSION, extracted, copies)
+        indexed += len(extracted) + len(copies)
@@ -12,17 +12,12 @@ conn = psycopg2.connect(
 )
 cursor = conn.cursor()
 
-# Drop old tables if they exist
-cursor.execute('DROP TABLE IF EXISTS issue_documents')
-cursor.execute('DROP TABLE IF EXISTS issue_attachments')
-cursor.execute('DROP TABLE IF EXISTS issues')
-cursor.execute('DROP TABLE IF EXISTS documents')
-cursor.execute('DROP TABLE IF EXISTS issue_statuses')
-cursor.execute('DROP TABLE IF EXISTS document_types')
-cursor.execute('DROP TABLE IF EXISTS projects')
-cursor.execute('DROP TABLE IF EXISTS sites')
-cursor.execute('DROP TABLE IF EXISTS statuses')
-cursor.execute('DROP TABLE IF EXISTS users')
+# Drop every table in the schema, including the ones added by migrations
+# and the migration history, so that 'flask --app app migrate' rebuilds
+# them afterwards. CASCADE takes the foreign keys between them along.
+cursor.execute("SELECT tablename FROM pg_tables WHERE schemaname = current_schema()")
+for (table,) in cursor.fetchall():
+    cursor.execute(f'DROP TABLE IF EXISTS "{table}" CASCADE')
 
 # Create document_types table
 cursor.execute('''
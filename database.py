@@ -1,13 +1,30 @@
 import psycopg2
-from psycopg2.extras import DictCursor
+import psycopg2.extras
+from psycopg2.extras import DictCursor, Json
 import os
-from datetime import datetime
+import re
+import sqlite3
+from datetime import date, datetime, timedelta
 import urllib.parse
+import base64
+import json
+import logging
+from contextlib import contextmanager
+from zoneinfo import ZoneInfo
+from flask import g, has_app_context
+from db_pool import ConnectionPool
+from reference_cache import ReferenceCache
+from sqlite_backend import ThreadConnections
 
-# Use DATABASE_URL from environment (set by Render)
+# Use DATABASE_URL from environment (set by Render). sqlite:///path/to/file.db
+# runs on a single SQLite file instead (see sqlite_backend.py).
 DATABASE_URL = os.environ.get('DATABASE_URL')
+SQLITE = bool(DATABASE_URL) and DATABASE_URL.startswith('sqlite:')
 
-if DATABASE_URL:
+if SQLITE:
+    SQLITE_PATH = DATABASE_URL.split(':', 1)[1].removeprefix('//').removeprefix('/') or 'documents.db'
+    DATABASE = None
+elif DATABASE_URL:
     # Parse the DATABASE_URL
     parsed_url = urllib.parse.urlparse(DATABASE_URL)
     DATABASE = {
@@ -28,523 +45,1649 @@ else:
         'port': '5432'
     }
 
+# Connection pool settings
+POOL_CONFIG = {
+    'minconn': int(os.environ.get('DB_POOL_MIN', 1)),
+    'maxconn': int(os.environ.get('DB_POOL_MAX', 10)),
+    'timeout': float(os.environ.get('DB_POOL_TIMEOUT', 10)),
+    'max_uses': int(os.environ.get('DB_POOL_MAX_USES', 1000)),
+    'max_idle': float(os.environ.get('DB_POOL_MAX_IDLE', 300)),
+    'health_check_interval': float(os.environ.get('DB_POOL_HEALTH_CHECK', 30)),
+}
+
+# Set on every SQLite connection. WAL lets readers carry on while one
+# writer commits; with it synchronous=NORMAL only syncs at checkpoints,
+# which can lose the last commits on power loss but never corrupts the
+# file. The page cache (KiB when negative) and memory map are per
+# connection, i.e. per thread.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL'),
+    'foreign_keys': 'ON',
+    'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000)),
+    'cache_size': -int(os.environ.get('SQLITE_CACHE_KB', 64 * 1024)),
+    'mmap_size': int(os.environ.get('SQLITE_MMAP_BYTES', 256 * 1024 * 1024)),
+    'temp_store': 'MEMORY',
+}
+
+# Errors raised by either driver
+DatabaseError = (psycopg2.Error, sqlite3.Error)
+
+# Listing pages (keyset pagination on created_at, id)
+PAGE_SIZE = int(os.environ.get('PAGE_SIZE', 50))
+MAX_PAGE_SIZE = int(os.environ.get('MAX_PAGE_SIZE', 500))
+
+def _connect():
+    return psycopg2.connect(**DATABASE, cursor_factory=DictCursor)
+
+logger = logging.getLogger(__name__)
+
+if SQLITE:
+    pool = ThreadConnections(SQLITE_PATH, SQLITE_PRAGMAS)
+else:
+    pool = ConnectionPool(_connect, **POOL_CONFIG)
+
+def execute_values(cursor, sql, values, page_size=100, fetch=False):
+    # psycopg2.extras.execute_values on either backend
+    if SQLITE:
+        return cursor.execute_values(sql, values, fetch=fetch)
+    return psycopg2.extras.execute_values(cursor, sql, values, page_size=page_size, fetch=fetch)
+
+def _from_now(amount, unit):
+    # SQL for the current time plus `amount` (an SQL expression, negative
+    # for the past) seconds/hours/days
+    if SQLITE:
+        return f"datetime('now', ({amount}) || ' {unit}s')"
+    return f"CURRENT_TIMESTAMP + ({amount}) * INTERVAL '1 {unit}'"
+
+# Postgres type -> the SQLite expression standing in for a cast to it
+SQLITE_CASTS = {
+    'bigint': 'CAST({} AS INTEGER)',
+    'date': 'date({})',
+    'integer[]': '{}',  # lists are bound as JSON arrays
+}
+
+def _cast(expression, type_name):
+    # SQL for expression::type_name on either backend
+    if SQLITE:
+        return SQLITE_CASTS[type_name].format(expression)
+    return f'{expression}::{type_name}'
+
+def _as_date(value):
+    # SQLite returns computed dates as text
+    return date.fromisoformat(value) if isinstance(value, str) else value
+
 def get_db_connection():
-    conn = psycopg2.connect(**DATABASE, cursor_factory=DictCursor)
-    return conn
+    # Inside a Flask request every helper shares one pooled connection,
+    # which is handed back in close_request_connection(). Outside of an
+    # app context (scripts, init_db) each caller borrows its own.
+    if has_app_context():
+        if 'db_conn' not in g:
+            g.db_conn = pool.getconn()
+        return pool.wrap(g.db_conn, shared=True)
+    return pool.connection()
+
+def reset_after_fork():
+    # A forked process must not use its parent's connections, including
+    # one held by an app context it inherited (the flask CLI runs every
+    # command inside one)
+    pool.reset()
+    if has_app_context():
+        g.pop('db_conn', None)
 
-def init_db():
+def close_request_connection(exception=None):
+    conn = g.pop('db_conn', None)
+    if conn is not None:
+        pool.putconn(conn)
+
+@contextmanager
+def transaction():
+    # Yields a cursor; commits on success and rolls back on error
     conn = get_db_connection()
-    cursor = conn.cursor()
+    try:
+        yield conn.cursor()
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
 
-    # Create document_types table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS document_types (
-            id SERIAL PRIMARY KEY,
-            type_name TEXT NOT NULL UNIQUE
-        )
-    ''')
+# Lookup tables are served from memory; see reference_cache.py
+reference_data = ReferenceCache(
+    get_db_connection,
+    ttl=float(os.environ.get('REFERENCE_CACHE_TTL', 300)),
+    check_interval=float(os.environ.get('REFERENCE_CACHE_CHECK_INTERVAL', 5)),
+)
 
-    # Create projects table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS projects (
-            id SERIAL PRIMARY KEY,
-            project_name TEXT NOT NULL UNIQUE
-        )
-    ''')
+def get_document_types():
+    return reference_data.rows('document_types')
 
-    # Create sites table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS sites (
-            id SERIAL PRIMARY KEY,
-            site_name TEXT NOT NULL UNIQUE
-        )
-    ''')
+def get_projects():
+    return reference_data.rows('projects')
 
-    # Create statuses table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS statuses (
-            id SERIAL PRIMARY KEY,
-            status_name TEXT NOT NULL UNIQUE
-        )
-    ''')
+def get_sites():
+    return reference_data.rows('sites')
 
-    # Create users table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id SERIAL PRIMARY KEY,
-            username TEXT NOT NULL UNIQUE
-        )
-    ''')
+def get_statuses():
+    return reference_data.rows('statuses')
 
-    # Create documents table with foreign keys
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS documents (
-            id SERIAL PRIMARY KEY,
-            filename TEXT NOT NULL,
-            file_path TEXT NOT NULL,
-            document_type_id INTEGER,
-            project_id INTEGER,
-            site_id INTEGER,
-            status_id INTEGER,
-            uploaded_by INTEGER,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (document_type_id) REFERENCES document_types(id),
-            FOREIGN KEY (project_id) REFERENCES projects(id),
-            FOREIGN KEY (site_id) REFERENCES sites(id),
-            FOREIGN KEY (status_id) REFERENCES statuses(id),
-            FOREIGN KEY (uploaded_by) REFERENCES users(id)
-        )
-    ''')
+def get_users():
+    return reference_data.rows('users')
 
-    # Create issue_statuses table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS issue_statuses (
-            id SERIAL PRIMARY KEY,
-            status_name TEXT NOT NULL UNIQUE
-        )
-    ''')
+def get_issue_statuses():
+    return reference_data.rows('issue_statuses')
 
-    # Create issues table with deadline
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS issues (
-            id SERIAL PRIMARY KEY,
-            title TEXT NOT NULL,
-            description TEXT,
-            project_id INTEGER,
-            site_id INTEGER,
-            status_id INTEGER,
-            reported_by INTEGER,
-            deadline DATE,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (project_id) REFERENCES projects(id),
-            FOREIGN KEY (site_id) REFERENCES sites(id),
-            FOREIGN KEY (status_id) REFERENCES issue_statuses(id),
-            FOREIGN KEY (reported_by) REFERENCES users(id)
-        )
-    ''')
+def is_blob_key(storage_key):
+    return bool(storage_key) and storage_key.startswith('blobs/')
 
-    # Create issue_documents junction table
+def acquire_blob(cursor, sha256, size_bytes):
+    # Takes a reference and holds the blob's row lock until commit, so the
+    # file can be put in place without racing a delete of the same content
     cursor.execute('''
-        CREATE TABLE IF NOT EXISTS issue_documents (
-            issue_id INTEGER,
-            document_id INTEGER,
-            FOREIGN KEY (issue_id) REFERENCES issues(id),
-            FOREIGN KEY (document_id) REFERENCES documents(id),
-            PRIMARY KEY (issue_id, document_id)
-        )
-    ''')
+        INSERT INTO blobs (sha256, size_bytes, refcount) VALUES (%s, %s, 1)
+        ON CONFLICT (sha256) DO UPDATE SET refcount = blobs.refcount + 1
+    ''', (sha256, size_bytes))
 
-    # Create issue_attachments table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS issue_attachments (
-            id SERIAL PRIMARY KEY,
-            filename TEXT NOT NULL,
-            file_path TEXT NOT NULL,
-            issue_id INTEGER,
-            uploaded_by INTEGER,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (issue_id) REFERENCES issues(id),
-            FOREIGN KEY (uploaded_by) REFERENCES users(id)
-        )
-    ''')
+def acquire_blobs(cursor, blobs):
+    # Batched acquire_blob(): blobs is a list of (sha256, size_bytes), one
+    # entry per new reference. Rows are locked in hash order so two bulk
+    # uploads cannot deadlock on each other.
+    counts = {}
+    for sha256, size_bytes in blobs:
+        size, count = counts.get(sha256, (size_bytes, 0))
+        counts[sha256] = (size, count + 1)
+    if not counts:
+        return
+    execute_values(cursor, '''
+        INSERT INTO blobs (sha256, size_bytes, refcount) VALUES %s
+        ON CONFLICT (sha256) DO UPDATE SET refcount = blobs.refcount + EXCLUDED.refcount
+    ''', [(sha256, size, count) for sha256, (size, count) in sorted(counts.items())])
 
-    # Insert default data if tables are empty
-    # Check and insert document_types
-    cursor.execute('SELECT COUNT(*) FROM document_types')
-    doc_type_count = cursor.fetchone()[0]
-    if doc_type_count == 0:
-        cursor.execute('INSERT INTO document_types (type_name) VALUES (%s) ON CONFLICT (type_name) DO NOTHING', ('Type A',))
-        cursor.execute('INSERT INTO document_types (type_name) VALUES (%s) ON CONFLICT (type_name) DO NOTHING', ('Type B',))
-
-    # Check and insert statuses (for documents)
-    cursor.execute('SELECT COUNT(*) FROM statuses')
-    status_count = cursor.fetchone()[0]
-    if status_count == 0:
-        cursor.execute('INSERT INTO statuses (status_name) VALUES (%s) ON CONFLICT (status_name) DO NOTHING', ('Draft',))
-        cursor.execute('INSERT INTO statuses (status_name) VALUES (%s) ON CONFLICT (status_name) DO NOTHING', ('Final',))
-
-    # Check and insert projects
-    cursor.execute('SELECT COUNT(*) FROM projects')
-    project_count = cursor.fetchone()[0]
-    if project_count == 0:
-        cursor.execute('INSERT INTO projects (project_name) VALUES (%s) ON CONFLICT (project_name) DO NOTHING', ('Project A',))
-        cursor.execute('INSERT INTO projects (project_name) VALUES (%s) ON CONFLICT (project_name) DO NOTHING', ('Project B',))
-
-    # Check and insert sites
-    cursor.execute('SELECT COUNT(*) FROM sites')
-    site_count = cursor.fetchone()[0]
-    if site_count == 0:
-        cursor.execute('INSERT INTO sites (site_name) VALUES (%s) ON CONFLICT (site_name) DO NOTHING', ('Site 1',))
-        cursor.execute('INSERT INTO sites (site_name) VALUES (%s) ON CONFLICT (site_name) DO NOTHING', ('Site 2',))
-
-    # Check and insert issue statuses
-    cursor.execute('SELECT COUNT(*) FROM issue_statuses')
-    issue_status_count = cursor.fetchone()[0]
-    if issue_status_count == 0:
-        cursor.execute('INSERT INTO issue_statuses (status_name) VALUES (%s) ON CONFLICT (type_name) DO NOTHING', ('Open',))
-        cursor.execute('INSERT INTO issue_statuses (status_name) VALUES (%s) ON CONFLICT (type_name) DO NOTHING', ('Closed',))
-
-    # Check and insert users
-    cursor.execute('SELECT COUNT(*) FROM users')
-    user_count = cursor.fetchone()[0]
-    if user_count == 0:
-        cursor.execute('INSERT INTO users (username) VALUES (%s) ON CONFLICT (username) DO NOTHING', ('user1',))
-
-    # Check and insert test documents
-    cursor.execute('SELECT COUNT(*) FROM documents')
-    document_count = cursor.fetchone()[0]
-    if document_count == 0:
-        uploads_dir = os.path.join(os.getcwd(), 'uploads')
-        cursor.execute('''
-            INSERT INTO documents (filename, file_path, document_type_id, project_id, site_id, status_id, uploaded_by)
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
-        ''', ('doc1.pdf', os.path.join(uploads_dir, 'doc1.pdf'), 1, 1, 1, 1, 1))
-        cursor.execute('''
-            INSERT INTO documents (filename, file_path, document_type_id, project_id, site_id, status_id, uploaded_by)
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
-        ''', ('doc2.pdf', os.path.join(uploads_dir, 'doc2.pdf'), 2, 2, 2, 2, 1))
+def release_files(cursor, rows):
+    # Drops the blob references held by deleted upload rows (dicts with
+    # file_path, storage_key, sha256) with one UPDATE, and queues every file
+    # that may now be unreferenced for reclaim_files(). Nothing is unlinked
+    # here, so deletes never wait on the disk. Returns the number queued.
+    counts = {}
+    paths = {}
+    queue = []
+    for row in rows:
+        if is_blob_key(row['storage_key']):
+            counts[row['sha256']] = counts.get(row['sha256'], 0) + 1
+            paths[row['sha256']] = row['file_path']
+        elif row['file_path']:
+            queue.append((row['file_path'], None))
+    if counts:
+        # Same lock order as acquire_blobs()
+        cursor.execute('SELECT sha256 FROM blobs WHERE sha256 = ANY(%s) ORDER BY sha256 FOR UPDATE',
+                       (sorted(counts),))
+        released = execute_values(cursor, '''
+            UPDATE blobs SET refcount = blobs.refcount - released.count
+            FROM (VALUES %s) AS released (sha256, count)
+            WHERE blobs.sha256 = released.sha256
+            RETURNING blobs.sha256, blobs.refcount
+        ''', sorted(counts.items()), page_size=len(counts), fetch=True)
+        queue += [(paths[row['sha256']], row['sha256']) for row in released if row['refcount'] <= 0]
+    if queue:
+        execute_values(cursor, 'INSERT INTO file_reclaim_queue (file_path, sha256) VALUES %s', queue)
+    return len(queue)
 
-    # Check and insert test issues with deadlines
-    cursor.execute('SELECT COUNT(*) FROM issues')
-    issue_count = cursor.fetchone()[0]
-    if issue_count == 0:
-        cursor.execute('''
-            INSERT INTO issues (title, description, project_id, site_id, status_id, reported_by, deadline)
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
-        ''', ('Test Issue 1', 'Description 1', 1, 1, 1, 1, '2025-05-14'))
+def release_placed_files(files):
+    # After a failed transaction in which place_files() already put files
+    # (dicts with file_path, storage_key, sha256, size_bytes) on disk: the
+    # rollback took their blob references back, so nothing would ever
+    # reclaim them. A zero-count blobs row plus a queue entry hands them to
+    # reclaim_files(), which removes them under the blob row lock, or keeps
+    # them if another upload has taken a reference in the meantime.
+    blobs = sorted({(f['sha256'], f['size_bytes']) for f in files if is_blob_key(f.get('storage_key'))})
+    queue = [(f['file_path'], f['sha256'] if is_blob_key(f.get('storage_key')) else None) for f in files]
+    try:
+        with transaction() as cursor:
+            if blobs:
+                execute_values(cursor, '''
+                    INSERT INTO blobs (sha256, size_bytes, refcount) VALUES %s
+                    ON CONFLICT (sha256) DO NOTHING
+                ''', [(sha256, size, 0) for sha256, size in blobs])
+            execute_values(cursor, 'INSERT INTO file_reclaim_queue (file_path, sha256) VALUES %s', queue)
+    except Exception as e:
+        print(f"Could not queue {len(queue)} orphaned upload file(s) for reclaim: {e}")
+
+def insert_document(filename, file_path, document_type_id, project_id, site_id, status_id, uploaded_by,
+                    storage_key=None, sha256=None, size_bytes=None, place_file=None):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    placed = []
+    try:
+        if is_blob_key(storage_key):
+            acquire_blob(cursor, sha256, size_bytes)
+        if place_file:
+            place_file()
+            placed = [{'file_path': file_path, 'storage_key': storage_key, 'sha256': sha256,
+                       'size_bytes': size_bytes}]
         cursor.execute('''
-            INSERT INTO issues (title, description, project_id, site_id, status_id, reported_by, deadline)
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
-        ''', ('Test Issue 2', 'Description 2', 1, 1, 1, 1, '2025-05-15'))
+            INSERT INTO documents (filename, file_path, document_type_id, project_id, site_id, status_id, uploaded_by,
+                                   storage_key, sha256, size_bytes)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            RETURNING id
+        ''', (filename, file_path, document_type_id, project_id, site_id, status_id, uploaded_by,
+              storage_key, sha256, size_bytes))
+        document_id = cursor.fetchone()['id']
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        release_placed_files(placed)
+        raise
+    finally:
+        conn.close()
+    return document_id
+
+DOCUMENT_INSERT_COLUMNS = ('filename', 'file_path', 'document_type_id', 'project_id', 'site_id', 'status_id',
+                           'uploaded_by', 'storage_key', 'sha256', 'size_bytes')
+
+def insert_documents_bulk(documents, place_files=None):
+    # Inserts many documents (dicts keyed by DOCUMENT_INSERT_COLUMNS) in one
+    # transaction with a single multi-row INSERT ... RETURNING id. Returns
+    # the new ids in the order given.
+    if not documents:
+        return []
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    placed = []
+    try:
+        acquire_blobs(cursor, [(d['sha256'], d['size_bytes']) for d in documents if is_blob_key(d.get('storage_key'))])
+        if place_files:
+            place_files()
+            placed = documents
+        rows = execute_values(cursor, f'''
+            INSERT INTO documents ({', '.join(DOCUMENT_INSERT_COLUMNS)}) VALUES %s RETURNING id
+        ''', [tuple(d.get(column) for column in DOCUMENT_INSERT_COLUMNS) for d in documents],
+            page_size=len(documents), fetch=True)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        release_placed_files(placed)
+        raise
+    finally:
+        conn.close()
+    return [row['id'] for row in rows]
+
+ATTACHMENT_INSERT_COLUMNS = ('filename', 'file_path', 'issue_id', 'uploaded_by', 'storage_key', 'sha256', 'size_bytes')
+
+def create_issue(title, description, project_id, site_id, status_id, reported_by, deadline, attachments=(),
+                 place_files=None):
+    # The issue and all of its attachments (dicts with filename, file_path,
+    # storage_key, sha256, size_bytes) in one transaction and a fixed
+    # number of statements however many files there are. Returns
+    # (issue_id, [attachment ids in the order given]).
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    placed = []
+    try:
         cursor.execute('''
             INSERT INTO issues (title, description, project_id, site_id, status_id, reported_by, deadline)
             VALUES (%s, %s, %s, %s, %s, %s, %s)
-        ''', ('Test Issue 3', 'Description 3', 2, 2, 2, 1, '2025-05-16'))
+            RETURNING id
+        ''', (title, description, project_id, site_id, status_id, reported_by, deadline))
+        issue_id = cursor.fetchone()['id']
+        attachment_ids = []
+        if attachments:
+            acquire_blobs(cursor, [(a['sha256'], a['size_bytes']) for a in attachments
+                                   if is_blob_key(a.get('storage_key'))])
+            if place_files:
+                place_files()
+                placed = attachments
+            values = [tuple(issue_id if column == 'issue_id' else reported_by if column == 'uploaded_by'
+                            else a.get(column) for column in ATTACHMENT_INSERT_COLUMNS)
+                      for a in attachments]
+            rows = execute_values(cursor, f'''
+                INSERT INTO issue_attachments ({', '.join(ATTACHMENT_INSERT_COLUMNS)}) VALUES %s RETURNING id
+            ''', values, page_size=len(values), fetch=True)
+            attachment_ids = [row['id'] for row in rows]
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        release_placed_files(placed)
+        raise
+    finally:
+        conn.close()
+    return issue_id, attachment_ids
 
-    conn.commit()
-    conn.close()
+DOCUMENTS_QUERY = '''
+    SELECT d.id, d.filename, d.file_path, d.storage_key, d.size_bytes, dt.type_name, p.project_name, s.site_name, st.status_name, u.username, d.created_at
+    FROM documents d
+    JOIN document_types dt ON d.document_type_id = dt.id
+    JOIN projects p ON d.project_id = p.id
+    JOIN sites s ON d.site_id = s.id
+    JOIN statuses st ON d.status_id = st.id
+    JOIN users u ON d.uploaded_by = u.id
+'''
 
-def get_document_types():
+ISSUES_QUERY = '''
+    SELECT i.id, i.title, i.description, p.project_name, s.site_name, st.status_name, st.id as status_id,
+           u.username, i.deadline, i.created_at
+    FROM issues i
+    JOIN projects p ON i.project_id = p.id
+    JOIN sites s ON i.site_id = s.id
+    JOIN issue_statuses st ON i.status_id = st.id
+    JOIN users u ON i.reported_by = u.id
+'''
+
+def _parse_date(value):
+    if not value:
+        return None
+    try:
+        return date.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+
+def date_range(filters):
+    # A single 'date' means that whole day; 'date_from'/'date_to' are
+    # inclusive days. Returns the half-open [start, end) bounds.
+    day = _parse_date(filters.get('date'))
+    if day:
+        return day, day + timedelta(days=1)
+    start = _parse_date(filters.get('date_from'))
+    end = _parse_date(filters.get('date_to'))
+    return start, end + timedelta(days=1) if end else None
+
+def _created_at_range(alias, filters):
+    # Compare the bare column so the created_at index can be used;
+    # DATE(created_at) = %s forces a scan of every row.
+    conditions = []
+    params = []
+    start, end = date_range(filters)
+    if start:
+        conditions.append(f'{alias}.created_at >= %s')
+        params.append(start)
+    if end:
+        conditions.append(f'{alias}.created_at < %s')
+        params.append(end)
+    return conditions, params
+
+# filter key -> (fact table column, reference kind)
+DOCUMENT_DIMENSIONS = {
+    'document_type': ('d.document_type_id', 'document_types'),
+    'project': ('d.project_id', 'projects'),
+    'site': ('d.site_id', 'sites'),
+    'status': ('d.status_id', 'statuses'),
+}
+
+ISSUE_DIMENSIONS = {
+    'project': ('i.project_id', 'projects'),
+    'site': ('i.site_id', 'sites'),
+    'status': ('i.status_id', 'issue_statuses'),
+}
+
+def _filter_values(value):
+    # A filter may be a single name or a list of names
+    if isinstance(value, (list, tuple, set)):
+        return [v for v in value if v]
+    return [value] if value else []
+
+def _dimension_conditions(dimensions, filters):
+    # Names are resolved to ids through the reference cache so the WHERE
+    # clause hits the fact table's own (foreign key) indexes rather than
+    # filtering through the joined lookup tables.
+    conditions = []
+    params = []
+    for key, (column, kind) in dimensions.items():
+        names = _filter_values(filters.get(key))
+        if not names:
+            continue
+        ids = sorted({reference_data.id_for(kind, name) for name in names} - {None})
+        if not ids:
+            # Only unknown names: nothing can match
+            conditions.append('FALSE')
+        elif len(ids) == 1:
+            conditions.append(f'{column} = %s')
+            params.append(ids[0])
+        else:
+            conditions.append(f'{column} = ANY(%s)')
+            params.append(ids)
+    return conditions, params
+
+def _escape_like(text):
+    # `text` with its LIKE wildcards taken literally
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+def contains_pattern(text):
+    # ILIKE pattern matching `text` anywhere
+    return f'%{_escape_like(text)}%'
+
+def _fts_phrase(text):
+    # `text` as one quoted FTS5 string, special characters and all
+    return '"' + text.replace('"', '""') + '"'
+
+def _filename_condition(table, alias, text):
+    # Substring match on filename. Postgres uses the pg_trgm index from
+    # three characters on; SQLite its FTS5 trigram table, which matches
+    # a quoted string as a case-insensitive substring.
+    if SQLITE and len(text) >= 3:
+        return (f'{alias}.id IN (SELECT rowid FROM {table}_filename_trgm WHERE {table}_filename_trgm MATCH %s)',
+                _fts_phrase(text))
+    return f'{alias}.filename ILIKE %s', contains_pattern(text)
+
+def _document_conditions(filters):
+    params = []
+    conditions = []
+
+    if filters:
+        conditions, params = _dimension_conditions(DOCUMENT_DIMENSIONS, filters)
+        date_conditions, date_params = _created_at_range('d', filters)
+        conditions.extend(date_conditions)
+        params.extend(date_params)
+        if filters.get('filename'):
+            condition, param = _filename_condition('documents', 'd', filters['filename'])
+            conditions.append(condition)
+            params.append(param)
+
+    return conditions, params
+
+def _issue_conditions(filters):
+    params = []
+    conditions = []
+
+    if filters:
+        conditions, params = _dimension_conditions(ISSUE_DIMENSIONS, filters)
+        date_conditions, date_params = _created_at_range('i', filters)
+        conditions.extend(date_conditions)
+        params.extend(date_params)
+        if filters.get('filename'):
+            # Issues with a matching attachment
+            condition, param = _filename_condition('issue_attachments', 'a', filters['filename'])
+            conditions.append(f'EXISTS (SELECT 1 FROM issue_attachments a WHERE a.issue_id = i.id AND {condition})')
+            params.append(param)
+
+    return conditions, params
+
+def encode_cursor(row, direction):
+    # Opaque page token: the (created_at, id) key of the boundary row
+    payload = json.dumps({'c': row['created_at'].isoformat(), 'i': row['id'], 'd': direction})
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+def decode_cursor(token):
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        direction = payload['d']
+        if direction not in ('next', 'prev'):
+            raise ValueError(direction)
+        return datetime.fromisoformat(payload['c']), int(payload['i']), direction
+    except (ValueError, KeyError, TypeError) as e:
+        raise ValueError(f"Invalid page cursor: {token}") from e
+
+def _approximate_count(cursor, query, params):
+    # Planner estimate instead of COUNT(*): costs the same at any table size.
+    # SQLite has no row estimates to offer, so it counts.
+    if SQLITE:
+        cursor.execute(f'SELECT COUNT(*) FROM ({query}) counted', params)
+        return cursor.fetchone()[0]
+    cursor.execute('EXPLAIN (FORMAT JSON) ' + query, params)
+    plan = cursor.fetchone()[0]
+    return int(plan[0]['Plan']['Plan Rows'])
+
+def _count_rows(base_query, conditions, params):
+    query = base_query
+    if conditions:
+        query += ' WHERE ' + ' AND '.join(conditions)
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute('SELECT * FROM document_types')
-    document_types = cursor.fetchall()
+    total = _approximate_count(cursor, query, params)
     conn.close()
-    return document_types
+    return total
 
-def get_projects():
+def _paginate(base_query, alias, conditions, params, cursor_token=None, page_size=None, with_total=False):
+    page_size = max(1, min(page_size or PAGE_SIZE, MAX_PAGE_SIZE))
+    conditions = list(conditions)
+    params = list(params)
+    direction = 'next'
+    key = None
+    if cursor_token:
+        created_at, row_id, direction = decode_cursor(cursor_token)
+        key = (created_at, row_id)
+
+    total = _count_rows(base_query, conditions, params) if with_total else None
+
+    if key:
+        op = '<' if direction == 'next' else '>'
+        conditions.append(f'({alias}.created_at, {alias}.id) {op} (%s, %s)')
+        params.extend(key)
+    query = base_query
+    if conditions:
+        query += ' WHERE ' + ' AND '.join(conditions)
+    order = 'DESC' if direction == 'next' else 'ASC'
+    query += f' ORDER BY {alias}.created_at {order}, {alias}.id {order} LIMIT %s'
+    params.append(page_size + 1)
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute('SELECT * FROM projects')
-    projects = cursor.fetchall()
+    cursor.execute(query, params)
+    rows = cursor.fetchall()
     conn.close()
-    return projects
 
-def get_sites():
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if direction == 'prev':
+        rows.reverse()
+        has_next, has_prev = True, has_more
+    else:
+        has_next, has_prev = has_more, key is not None
+
+    return {
+        'rows': rows,
+        'next_cursor': encode_cursor(rows[-1], 'next') if rows and has_next else None,
+        'prev_cursor': encode_cursor(rows[0], 'prev') if rows and has_prev else None,
+        'page_size': page_size,
+        'total': total,
+    }
+
+def get_documents_page(filters=None, cursor=None, page_size=None, with_total=False):
+    conditions, params = _document_conditions(filters)
+    return _paginate(DOCUMENTS_QUERY, 'd', conditions, params, cursor, page_size, with_total)
+
+def get_issues_page(filters=None, cursor=None, page_size=None, with_total=False):
+    conditions, params = _issue_conditions(filters)
+    return _paginate(ISSUES_QUERY, 'i', conditions, params, cursor, page_size, with_total)
+
+def count_documents(filters=None):
+    # The total get_documents_page(with_total=True) reports, on its own
+    conditions, params = _document_conditions(filters)
+    return _count_rows(DOCUMENTS_QUERY, conditions, params)
+
+def count_issues(filters=None):
+    conditions, params = _issue_conditions(filters)
+    return _count_rows(ISSUES_QUERY, conditions, params)
+
+# kind -> table whose filenames /api/autocomplete suggests from
+FILENAME_SOURCES = {
+    'documents': 'documents',
+    'attachments': 'issue_attachments',
+}
+# Matches looked at per suggestion request; the best `limit` of them are
+# returned, prefix matches and short names first
+SUGGEST_CANDIDATES = int(os.environ.get('SUGGEST_CANDIDATES', 500))
+
+def suggest_filenames(kind, text, limit=10):
+    table = FILENAME_SOURCES.get(kind)
+    if table is None:
+        raise ValueError(f"Unknown filename source: {kind}")
+    condition, param = _filename_condition(table, table, text)
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute('SELECT * FROM sites')
-    sites = cursor.fetchall()
+    cursor.execute(f'''
+        SELECT filename
+        FROM (SELECT filename FROM {table} WHERE {condition} LIMIT %s) candidates
+        GROUP BY filename
+        ORDER BY filename ILIKE %s DESC, length(filename), filename
+        LIMIT %s
+    ''', (param, SUGGEST_CANDIDATES, _escape_like(text) + '%', limit))
+    names = [row['filename'] for row in cursor.fetchall()]
     conn.close()
-    return sites
+    return names
+
+# Text search configuration for document contents; filenames always use
+# 'simple' so that names are matched as written
+SEARCH_LANGUAGE = os.environ.get('SEARCH_LANGUAGE', 'english')
+
+def _encode_offset(offset):
+    return base64.urlsafe_b64encode(json.dumps({'o': offset}).encode()).decode().rstrip('=')
+
+def _decode_offset(token):
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        offset = int(json.loads(base64.urlsafe_b64decode(padded.encode()))['o'])
+        if offset < 0:
+            raise ValueError(offset)
+        return offset
+    except (ValueError, KeyError, TypeError) as e:
+        raise ValueError(f"Invalid page cursor: {token}") from e
+
+def _fts_query(text):
+    # websearch_to_tsquery syntax as an FTS5 query: words and "phrases"
+    # are quoted strings, `or` between two terms is OR and -term is NOT.
+    # None when there is nothing to match.
+    terms = []
+    excluded = []
+    for negate, phrase, word in re.findall(r'(-?)(?:"([^"]*)"?|([^\s"]+))', text):
+        term = phrase or word
+        if not negate and not phrase and term.lower() == 'or':
+            if terms and terms[-1] != 'OR':
+                terms.append('OR')
+            continue
+        if not re.search(r'\w', term):
+            continue
+        if negate:
+            excluded.append(_fts_phrase(term))
+        else:
+            if terms and terms[-1] != 'OR':
+                terms.append('AND')
+            terms.append(_fts_phrase(term))
+    while terms and terms[-1] in ('AND', 'OR'):
+        terms.pop()
+    if not terms:
+        return None
+    query = ' '.join(terms)
+    for term in excluded:
+        query = f'({query}) NOT {term}'
+    return query
+
+def search_documents(filters, cursor=None, page_size=None, with_total=False):
+    # Documents matching filters['q'] (web search syntax: words, "phrases",
+    # -excluded, or) in their filename or extracted contents, best first,
+    # narrowed by the usual listing filters. Same page shape as
+    # get_documents_page; rank order has no stable key, so the cursor is
+    # an offset.
+    text = filters.get('q', '').strip()
+    page_size = max(1, min(page_size or PAGE_SIZE, MAX_PAGE_SIZE))
+    offset = _decode_offset(cursor) if cursor else 0
+    conditions, params = _document_conditions({k: v for k, v in filters.items() if k != 'q'})
+    if SQLITE:
+        ranked, ranked_params = _ranked_sqlite(text, conditions, params)
+        if ranked is None:
+            return {'rows': [], 'next_cursor': None, 'prev_cursor': None, 'page_size': page_size,
+                    'total': 0 if with_total else None}
+    else:
+        ranked, ranked_params = _ranked_postgres(text, conditions, params)
 
-def get_statuses():
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute('SELECT * FROM statuses')
-    statuses = cursor.fetchall()
+    total = _approximate_count(cursor, ranked, ranked_params) if with_total else None
+    cursor.execute(f'''
+        SELECT listed.*, r.rank
+        FROM ({ranked} ORDER BY rank DESC, d.id DESC LIMIT %s OFFSET %s) r
+        JOIN ({DOCUMENTS_QUERY}) listed ON listed.id = r.id
+        ORDER BY r.rank DESC, r.id DESC
+    ''', ranked_params + [page_size + 1, offset])
+    rows = cursor.fetchall()
     conn.close()
-    return statuses
+    return {
+        'rows': rows[:page_size],
+        'next_cursor': _encode_offset(offset + page_size) if len(rows) > page_size else None,
+        'prev_cursor': _encode_offset(max(0, offset - page_size)) if offset else None,
+        'page_size': page_size,
+        'total': total,
+    }
 
-def get_users():
+def _ranked_postgres(text, conditions, params):
+    query_params = [text, SEARCH_LANGUAGE, text]
+    # Each branch of the UNION is a GIN index scan
+    ranked = f'''
+        SELECT d.id,
+               ts_rank(setweight(to_tsvector('simple', d.filename), 'A'), websearch_to_tsquery('simple', %s))
+               + COALESCE(ts_rank(c.content_tsv, websearch_to_tsquery(%s::regconfig, %s)), 0) AS rank
+        FROM (
+            SELECT id FROM documents WHERE to_tsvector('simple', filename) @@ websearch_to_tsquery('simple', %s)
+            UNION
+            SELECT document_id FROM document_contents
+            WHERE content_tsv @@ websearch_to_tsquery(%s::regconfig, %s)
+        ) matches
+        JOIN documents d ON d.id = matches.id
+        LEFT JOIN document_contents c ON c.document_id = d.id
+        {'WHERE ' + ' AND '.join(conditions) if conditions else ''}
+    '''
+    return ranked, query_params + query_params + params
+
+def _ranked_sqlite(text, conditions, params):
+    # The same over the FTS5 tables. bm25() is lower for better matches;
+    # filename hits count ten times as much, like weight 'A' against the
+    # default 'D' in ts_rank.
+    match = _fts_query(text)
+    if match is None:
+        return None, None
+    ranked = f'''
+        SELECT d.id, m.rank
+        FROM (
+            SELECT id, SUM(rank) AS rank
+            FROM (
+                SELECT rowid AS id, -10 * bm25(documents_filename_words) AS rank
+                FROM documents_filename_words WHERE documents_filename_words MATCH %s
+                UNION ALL
+                SELECT rowid, -bm25(document_contents_fts)
+                FROM document_contents_fts WHERE document_contents_fts MATCH %s
+            ) hits
+            GROUP BY id
+        ) m
+        JOIN documents d ON d.id = m.id
+        {'WHERE ' + ' AND '.join(conditions) if conditions else ''}
+    '''
+    return ranked, [match, match] + params
+
+def get_documents_to_index(extractor, after_id, limit, everything=False, ids=None):
+    # Documents with no extracted contents, contents from another
+    # extractor version or from a different file (or all of them),
+    # optionally only among `ids`. Legacy files (no hash) are always
+    # returned; the caller compares mtime and size.
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute('SELECT * FROM users')
-    users = cursor.fetchall()
+    ids_param = _cast('%s', 'integer[]')
+    cursor.execute(f'''
+        SELECT d.id, d.filename, d.file_path, d.sha256, c.content_key, c.extractor
+        FROM documents d
+        LEFT JOIN document_contents c ON c.document_id = d.id
+        WHERE d.id > %s
+          AND ({ids_param} IS NULL OR d.id = ANY({ids_param}))
+          AND (%s OR c.document_id IS NULL OR c.extractor <> %s OR d.sha256 IS NULL OR c.content_key <> d.sha256)
+        ORDER BY d.id
+        LIMIT %s
+    ''', (after_id, ids, ids, everything, extractor, limit))
+    rows = cursor.fetchall()
     conn.close()
-    return users
+    return rows
 
-def get_issue_statuses():
+def find_indexed_contents(hashes, extractor):
+    # sha256 -> id of a document whose contents for that hash are indexed
+    if not hashes:
+        return {}
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute('SELECT * FROM issue_statuses')
-    statuses = cursor.fetchall()
+    cursor.execute('''
+        SELECT d.sha256, MIN(d.id) AS id
+        FROM documents d
+        JOIN document_contents c ON c.document_id = d.id
+        WHERE d.sha256 = ANY(%s) AND c.content_key = d.sha256 AND c.extractor = %s
+        GROUP BY d.sha256
+    ''', (list(set(hashes)), extractor))
+    sources = {row['sha256']: row['id'] for row in cursor.fetchall()}
     conn.close()
-    return statuses
+    return sources
 
-def insert_document(filename, file_path, document_type_id, project_id, site_id, status_id, uploaded_by):
+def save_document_contents(extractor, extracted, copies):
+    # extracted: [(document_id, content_key, text)]; copies: [(document_id,
+    # id of a document with the same file)] whose vector is reused as is
+    if SQLITE:
+        return _save_document_contents_sqlite(extractor, extracted, copies)
+    with transaction() as cursor:
+        if extracted:
+            execute_values(cursor, '''
+                INSERT INTO document_contents (document_id, content_key, extractor, content_tsv)
+                SELECT v.document_id, v.content_key, v.extractor, to_tsvector(v.language::regconfig, v.text)
+                FROM (VALUES %s) AS v (document_id, content_key, extractor, language, text)
+                JOIN documents d ON d.id = v.document_id
+                ON CONFLICT (document_id) DO UPDATE SET
+                    content_key = EXCLUDED.content_key, extractor = EXCLUDED.extractor,
+                    content_tsv = EXCLUDED.content_tsv, indexed_at = CURRENT_TIMESTAMP
+            ''', [(document_id, key, extractor, SEARCH_LANGUAGE, text) for document_id, key, text in extracted])
+        if copies:
+            execute_values(cursor, '''
+                INSERT INTO document_contents (document_id, content_key, extractor, content_tsv)
+                SELECT v.document_id, c.content_key, c.extractor, c.content_tsv
+                FROM (VALUES %s) AS v (document_id, source_id)
+                JOIN document_contents c ON c.document_id = v.source_id
+                JOIN documents d ON d.id = v.document_id
+                ON CONFLICT (document_id) DO UPDATE SET
+                    content_key = EXCLUDED.content_key, extractor = EXCLUDED.extractor,
+                    content_tsv = EXCLUDED.content_tsv, indexed_at = CURRENT_TIMESTAMP
+            ''', copies)
+
+def _save_document_contents_sqlite(extractor, extracted, copies):
+    # The text goes to the FTS5 table under the document's id as rowid.
+    # WHERE TRUE keeps SQLite from reading ON CONFLICT as a join condition.
+    upsert = '''
+        ON CONFLICT (document_id) DO UPDATE SET
+            content_key = EXCLUDED.content_key, extractor = EXCLUDED.extractor, indexed_at = CURRENT_TIMESTAMP
+    '''
+    with transaction() as cursor:
+        if extracted:
+            execute_values(cursor, '''
+                INSERT INTO document_contents (document_id, content_key, extractor)
+                SELECT v.document_id, v.content_key, v.extractor
+                FROM (VALUES %s) AS v (document_id, content_key, extractor)
+                JOIN documents d ON d.id = v.document_id
+                WHERE TRUE
+            ''' + upsert, [(document_id, key, extractor) for document_id, key, _ in extracted])
+            cursor.execute('DELETE FROM document_contents_fts WHERE rowid = ANY(%s)',
+                           ([document_id for document_id, _, _ in extracted],))
+            execute_values(cursor, '''
+                INSERT INTO document_contents_fts (rowid, content)
+                SELECT v.document_id, v.text
+                FROM (VALUES %s) AS v (document_id, text)
+                JOIN document_contents c ON c.document_id = v.document_id
+            ''', [(document_id, text) for document_id, _, text in extracted])
+        if copies:
+            execute_values(cursor, '''
+                INSERT INTO document_contents (document_id, content_key, extractor)
+                SELECT v.document_id, c.content_key, c.extractor
+                FROM (VALUES %s) AS v (document_id, source_id)
+                JOIN document_contents c ON c.document_id = v.source_id
+                JOIN documents d ON d.id = v.document_id
+                WHERE TRUE
+            ''' + upsert, copies)
+            cursor.execute('DELETE FROM document_contents_fts WHERE rowid = ANY(%s)',
+                           ([document_id for document_id, _ in copies],))
+            execute_values(cursor, '''
+                INSERT INTO document_contents_fts (rowid, content)
+                SELECT v.document_id, f.content
+                FROM (VALUES %s) AS v (document_id, source_id)
+                JOIN document_contents_fts f ON f.rowid = v.source_id
+                JOIN document_contents c ON c.document_id = v.document_id
+            ''', copies)
+
+def explain_listing(kind, filters, force_index=False):
+    # EXPLAIN output for the listing query built from filters. With
+    # force_index, sequential scans are disabled for the transaction so a
+    # small development table still shows whether an index *can* be used.
+    # SQLite gives its EXPLAIN QUERY PLAN lines and has nothing to force.
+    if kind == 'documents':
+        base_query, alias, (conditions, params) = DOCUMENTS_QUERY, 'd', _document_conditions(filters)
+    else:
+        base_query, alias, (conditions, params) = ISSUES_QUERY, 'i', _issue_conditions(filters)
+    query = base_query
+    if conditions:
+        query += ' WHERE ' + ' AND '.join(conditions)
+    query += f' ORDER BY {alias}.created_at DESC, {alias}.id DESC'
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO documents (filename, file_path, document_type_id, project_id, site_id, status_id, uploaded_by)
-        VALUES (%s, %s, %s, %s, %s, %s, %s)
-    ''', (filename, file_path, document_type_id, project_id, site_id, status_id, uploaded_by))
-    conn.commit()
+    if SQLITE:
+        cursor.execute('EXPLAIN QUERY PLAN ' + query, params)
+        plan = [row['detail'] for row in cursor.fetchall()]
+        conn.close()
+        return plan
+    if force_index:
+        cursor.execute('SET LOCAL enable_seqscan = off')
+    cursor.execute('EXPLAIN ' + query, params)
+    plan = [row[0] for row in cursor.fetchall()]
+    conn.rollback()
     conn.close()
+    return plan
 
-def insert_issue_attachment(filename, file_path, issue_id, uploaded_by):
+def get_attachments_for_issues(issue_ids):
+    # One query for the whole page instead of one per issue row
+    attachments = {issue_id: [] for issue_id in issue_ids}
+    if not issue_ids:
+        return attachments
     conn = get_db_connection()
     cursor = conn.cursor()
     cursor.execute('''
-        INSERT INTO issue_attachments (filename, file_path, issue_id, uploaded_by)
-        VALUES (%s, %s, %s, %s)
-    ''', (filename, file_path, issue_id, uploaded_by))
-    conn.commit()
+        SELECT ia.id, ia.filename, ia.storage_key, ia.issue_id
+        FROM issue_attachments ia
+        WHERE ia.issue_id = ANY(%s)
+        ORDER BY ia.issue_id, ia.id
+    ''', (list(issue_ids),))
+    for row in cursor.fetchall():
+        attachments[row['issue_id']].append(row)
     conn.close()
+    return attachments
 
-def insert_issue(title, description, project_id, site_id, status_id, reported_by, deadline, attachment_ids=None):
+def get_linked_documents_for_issues(issue_ids):
+    linked = {issue_id: [] for issue_id in issue_ids}
+    if not issue_ids:
+        return linked
     conn = get_db_connection()
     cursor = conn.cursor()
     cursor.execute('''
-        INSERT INTO issues (title, description, project_id, site_id, status_id, reported_by, deadline)
-        VALUES (%s, %s, %s, %s, %s, %s, %s)
-        RETURNING id
-    ''', (title, description, project_id, site_id, status_id, reported_by, deadline))
-    issue_id = cursor.fetchone()['id']
-    conn.commit()
+        SELECT d.id, d.filename, d.storage_key, idoc.issue_id
+        FROM issue_documents idoc
+        JOIN documents d ON idoc.document_id = d.id
+        WHERE idoc.issue_id = ANY(%s)
+        ORDER BY idoc.issue_id, d.id
+    ''', (list(issue_ids),))
+    for row in cursor.fetchall():
+        linked[row['issue_id']].append(row)
     conn.close()
-    return issue_id
+    return linked
 
-def get_all_documents(filters=None):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    query = '''
-        SELECT d.id, d.filename, d.file_path, dt.type_name, p.project_name, s.site_name, st.status_name, u.username, d.created_at
-        FROM documents d
-        JOIN document_types dt ON d.document_type_id = dt.id
-        JOIN projects p ON d.project_id = p.id
-        JOIN sites s ON d.site_id = s.id
-        JOIN statuses st ON d.status_id = st.id
-        JOIN users u ON d.uploaded_by = u.id
+def load_issue_documents(issues):
+    # Returns the issue rows as dicts with 'attachments' and
+    # 'linked_documents' filled in, using two queries in total
+    issue_ids = [issue['id'] for issue in issues]
+    return attach_issue_documents(issues, get_attachments_for_issues(issue_ids),
+                                  get_linked_documents_for_issues(issue_ids))
+
+def attach_issue_documents(issues, attachments, linked):
+    loaded = []
+    for issue in issues:
+        issue_dict = dict(issue)
+        issue_dict['attachments'] = attachments[issue['id']]
+        issue_dict['linked_documents'] = linked[issue['id']]
+        loaded.append(issue_dict)
+    return loaded
+
+def _delete_documents(cursor, document_ids):
+    # issue_documents rows go with them (ON DELETE CASCADE)
+    cursor.execute('''
+        DELETE FROM documents WHERE id = ANY(%s) RETURNING file_path, storage_key, sha256
+    ''', (list(document_ids),))
+    rows = cursor.fetchall()
+    release_files(cursor, rows)
+    return len(rows)
+
+def _delete_issues(cursor, issue_ids):
+    # Attachments are deleted explicitly (rather than left to the cascade)
+    # to get their files back; issue_documents rows cascade
+    issue_ids = list(issue_ids)
+    cursor.execute('''
+        DELETE FROM issue_attachments WHERE issue_id = ANY(%s) RETURNING file_path, storage_key, sha256
+    ''', (issue_ids,))
+    release_files(cursor, cursor.fetchall())
+    cursor.execute('DELETE FROM issues WHERE id = ANY(%s)', (issue_ids,))
+    return cursor.rowcount
+
+def delete_many(document_ids=(), issue_ids=()):
+    # Deletes any number of documents and issues in one transaction and a
+    # fixed number of statements. Files are queued for reclaim_files().
+    # Returns {'documents': n, 'issues': n} with the counts actually deleted.
+    deleted = {'documents': 0, 'issues': 0}
+    with transaction() as cursor:
+        if issue_ids:
+            deleted['issues'] = _delete_issues(cursor, issue_ids)
+        if document_ids:
+            deleted['documents'] = _delete_documents(cursor, document_ids)
+    return deleted
+
+def delete_document(document_id):
+    return delete_many(document_ids=[document_id])['documents'] > 0
+
+RECLAIM_BATCH_SIZE = int(os.environ.get('RECLAIM_BATCH_SIZE', 100))
+RECLAIM_MAX_ATTEMPTS = int(os.environ.get('RECLAIM_MAX_ATTEMPTS', 8))
+RECLAIM_RETRY_DELAY = float(os.environ.get('RECLAIM_RETRY_DELAY', 30))
+
+def reclaim_files(limit=RECLAIM_BATCH_SIZE, max_attempts=RECLAIM_MAX_ATTEMPTS):
+    # Drains up to `limit` due entries from file_reclaim_queue. Workers in
+    # other processes skip the rows this one holds. Before a file is
+    # unlinked its reference count is checked again under the row lock: a
+    # blob uploaded again since it was queued, or a legacy path another row
+    # still points at, is kept. Failures are retried with exponential
+    # backoff until max_attempts.
+    summary = {'removed': 0, 'kept': 0, 'failed': 0}
+    with transaction() as cursor:
+        cursor.execute('''
+            SELECT id, file_path, sha256, attempts FROM file_reclaim_queue
+            WHERE not_before <= CURRENT_TIMESTAMP AND attempts < %s
+            ORDER BY id
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        ''', (max_attempts, limit))
+        for job in cursor.fetchall():
+            cursor.execute('SAVEPOINT reclaim_file')
+            try:
+                if job['sha256']:
+                    # Holds the blob row lock until commit; an upload of the
+                    # same content waits and then finds the file gone
+                    cursor.execute('''
+                        DELETE FROM blobs WHERE sha256 = %s AND refcount <= 0 RETURNING sha256
+                    ''', (job['sha256'],))
+                    unreferenced = cursor.fetchone() is not None
+                else:
+                    cursor.execute('''
+                        SELECT EXISTS (SELECT 1 FROM documents WHERE file_path = %s)
+                            OR EXISTS (SELECT 1 FROM issue_attachments WHERE file_path = %s)
+                    ''', (job['file_path'], job['file_path']))
+                    unreferenced = not cursor.fetchone()[0]
+                if unreferenced:
+                    try:
+                        os.remove(job['file_path'])
+                    except FileNotFoundError:
+                        pass
+                    summary['removed'] += 1
+                else:
+                    summary['kept'] += 1
+                cursor.execute('DELETE FROM file_reclaim_queue WHERE id = %s', (job['id'],))
+                cursor.execute('RELEASE SAVEPOINT reclaim_file')
+            except (OSError, *DatabaseError) as e:
+                cursor.execute('ROLLBACK TO SAVEPOINT reclaim_file')
+                delay = RECLAIM_RETRY_DELAY * 2 ** job['attempts']
+                cursor.execute(f'''
+                    UPDATE file_reclaim_queue
+                    SET attempts = attempts + 1, last_error = %s, not_before = {_from_now('%s', 'second')}
+                    WHERE id = %s
+                ''', (str(e), delay, job['id']))
+                print(f"Could not reclaim {job['file_path']}: {e}")
+                summary['failed'] += 1
+    return summary
+
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 5))
+JOB_RETRY_DELAY = float(os.environ.get('JOB_RETRY_DELAY', 10))
+# A job still 'running' after this long belonged to a worker that died
+JOB_LOCK_TIMEOUT = float(os.environ.get('JOB_LOCK_TIMEOUT', 600))
+JOB_RETENTION_DAYS = int(os.environ.get('JOB_RETENTION_DAYS', 7))
+
+def enqueue_jobs(jobs, cursor=None, rerun_done=False):
+    # jobs: [(kind, payload, idempotency_key or None)]. A key that is
+    # already queued, running or done is not queued again; with
+    # rerun_done a done one is set back to pending (e.g. when its output
+    # has since been evicted). Returns the ids of the jobs actually queued.
+    if not jobs:
+        return []
+    values = [(kind, Json(payload), key, JOB_MAX_ATTEMPTS) for kind, payload, key in jobs]
+    on_conflict = 'DO NOTHING'
+    if rerun_done:
+        on_conflict = '''
+            DO UPDATE SET status = 'pending', attempts = 0, run_after = CURRENT_TIMESTAMP,
+                          last_error = NULL, finished_at = NULL, duration_ms = NULL
+            WHERE jobs.status = 'done'
+        '''
+    sql = f'''
+        INSERT INTO jobs (kind, payload, idempotency_key, max_attempts) VALUES %s
+        ON CONFLICT (idempotency_key) {on_conflict}
+        RETURNING id
     '''
-    params = []
-    conditions = []
+    if cursor is not None:
+        return [row['id'] for row in execute_values(cursor, sql, values, page_size=len(values), fetch=True)]
+    with transaction() as cursor:
+        return [row['id'] for row in execute_values(cursor, sql, values, page_size=len(values), fetch=True)]
 
-    if filters:
-        if filters.get('document_type'):
-            conditions.append('dt.type_name = %s')
-            params.append(filters['document_type'])
-        if filters.get('project'):
-            conditions.append('p.project_name = %s')
-            params.append(filters['project'])
-        if filters.get('site'):
-            conditions.append('s.site_name = %s')
-            params.append(filters['site'])
-        if filters.get('status'):
-            conditions.append('st.status_name = %s')
-            params.append(filters['status'])
-        if filters.get('date'):
-            conditions.append('DATE(d.created_at) = %s')
-            params.append(filters['date'])
+def claim_jobs(worker, limit):
+    # Marks up to `limit` due jobs as running for this worker; other
+    # workers skip the rows locked here instead of waiting for them
+    with transaction() as cursor:
+        cursor.execute('''
+            UPDATE jobs SET status = 'running', attempts = attempts + 1, locked_by = %s,
+                            locked_at = CURRENT_TIMESTAMP, started_at = CURRENT_TIMESTAMP
+            WHERE id IN (
+                SELECT id FROM jobs
+                WHERE status = 'pending' AND run_after <= CURRENT_TIMESTAMP
+                ORDER BY run_after, id
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING id, kind, payload, attempts, max_attempts, created_at, started_at
+        ''', (worker, limit))
+        return sorted(cursor.fetchall(), key=lambda job: job['id'])
 
-    if conditions:
-        query += ' WHERE ' + ' AND '.join(conditions)
+def finish_job(job_id, duration_ms):
+    with transaction() as cursor:
+        cursor.execute('''
+            UPDATE jobs SET status = 'done', finished_at = CURRENT_TIMESTAMP, duration_ms = %s,
+                            locked_by = NULL, last_error = NULL
+            WHERE id = %s
+        ''', (duration_ms, job_id))
 
-    query += ' ORDER BY d.created_at DESC'
-    cursor.execute(query, params)
-    documents = cursor.fetchall()
-    conn.close()
-    return documents
+def fail_job(job_id, error, duration_ms=None, permanent=False):
+    # Back to pending with exponential backoff, or failed for good once
+    # max_attempts is used up or when retrying cannot help (permanent).
+    # Returns the new status.
+    with transaction() as cursor:
+        cursor.execute(f'''
+            UPDATE jobs
+            SET status = CASE WHEN attempts >= max_attempts OR %(permanent)s THEN 'failed' ELSE 'pending' END,
+                run_after = {_from_now('%(delay)s * power(2, attempts - 1)', 'second')},
+                finished_at = CASE WHEN attempts >= max_attempts OR %(permanent)s THEN CURRENT_TIMESTAMP END,
+                duration_ms = %(duration_ms)s, locked_by = NULL, last_error = %(error)s
+            WHERE id = %(id)s
+            RETURNING status
+        ''', {'permanent': permanent, 'delay': JOB_RETRY_DELAY, 'duration_ms': duration_ms, 'error': error,
+              'id': job_id})
+        row = cursor.fetchone()
+        return row['status'] if row else None
+
+def requeue_stale_jobs(timeout=JOB_LOCK_TIMEOUT):
+    # Jobs whose worker was killed mid-run; the lost run counts as an attempt
+    with transaction() as cursor:
+        cursor.execute(f'''
+            UPDATE jobs
+            SET status = CASE WHEN attempts >= max_attempts THEN 'failed' ELSE 'pending' END,
+                finished_at = CASE WHEN attempts >= max_attempts THEN CURRENT_TIMESTAMP END,
+                locked_by = NULL, last_error = 'worker lost (lock timed out)'
+            WHERE status = 'running' AND locked_at < {_from_now('-%s', 'second')}
+        ''', (timeout,))
+        return cursor.rowcount
+
+def prune_jobs(days=JOB_RETENTION_DAYS):
+    # Finished jobs (and their idempotency keys) are kept for `days`
+    with transaction() as cursor:
+        cursor.execute(f'''
+            DELETE FROM jobs WHERE status = 'done' AND finished_at < {_from_now('-%s', 'day')}
+        ''', (days,))
+        return cursor.rowcount
+
+def _percentiles(values, fractions=(0.5, 0.95)):
+    # percentile_cont() over a list, for SQLite
+    if not values:
+        return [None] * len(fractions)
+    values = sorted(values)
+    result = []
+    for fraction in fractions:
+        position = fraction * (len(values) - 1)
+        low = int(position)
+        high = min(low + 1, len(values) - 1)
+        result.append(values[low] + (values[high] - values[low]) * (position - low))
+    return result
 
-def get_all_issues(filters=None):
+def get_job_stats(hours=24):
+    # Per kind: queue depth now, and counts plus run/wait timings of the
+    # jobs finished in the last `hours`
+    recent = f"finished_at >= {_from_now('-%(hours)s', 'hour')}"
+    if SQLITE:
+        # No percentile_cont(): the timings of recent jobs are ranked here
+        timings = ''
+    else:
+        timings = f''',
+               percentile_cont(ARRAY[0.5, 0.95]) WITHIN GROUP (ORDER BY duration_ms)
+                   FILTER (WHERE status = 'done' AND {recent}) AS duration_ms,
+               percentile_cont(ARRAY[0.5, 0.95])
+                   WITHIN GROUP (ORDER BY EXTRACT(EPOCH FROM started_at - created_at) * 1000)
+                   FILTER (WHERE status = 'done' AND {recent}) AS wait_ms'''
     conn = get_db_connection()
     cursor = conn.cursor()
-    query = '''
-        SELECT i.id, i.title, i.description, p.project_name, s.site_name, st.status_name, st.id as status_id,
-               u.username, i.deadline, i.created_at
-        FROM issues i
-        JOIN projects p ON i.project_id = p.id
-        JOIN sites s ON i.site_id = s.id
-        JOIN issue_statuses st ON i.status_id = st.id
-        JOIN users u ON i.reported_by = u.id
-    '''
-    params = []
-    conditions = []
+    cursor.execute(f'''
+        SELECT kind,
+               COUNT(*) FILTER (WHERE status = 'pending') AS pending,
+               COUNT(*) FILTER (WHERE status = 'running') AS running,
+               COUNT(*) FILTER (WHERE status = 'failed') AS failed,
+               COUNT(*) FILTER (WHERE status = 'done' AND {recent}) AS done_recently,
+               {_cast(f'SUM(attempts - 1) FILTER (WHERE {recent})', 'bigint')} AS retries_recently{timings}
+        FROM jobs
+        GROUP BY kind
+        ORDER BY kind
+    ''', {'hours': hours})
+    rows = cursor.fetchall()
+    percentiles = {}
+    if SQLITE:
+        cursor.execute(f'''
+            SELECT kind, duration_ms, (julianday(started_at) - julianday(created_at)) * 86400000 AS wait_ms
+            FROM jobs
+            WHERE status = 'done' AND {recent}
+        ''', {'hours': hours})
+        samples = {}
+        for sample in cursor.fetchall():
+            durations, waits = samples.setdefault(sample['kind'], ([], []))
+            if sample['duration_ms'] is not None:
+                durations.append(sample['duration_ms'])
+            if sample['wait_ms'] is not None:
+                waits.append(sample['wait_ms'])
+        percentiles = {kind: (_percentiles(durations), _percentiles(waits))
+                       for kind, (durations, waits) in samples.items()}
+    conn.close()
+    stats = {}
+    for row in rows:
+        if SQLITE:
+            duration, wait = percentiles.get(row['kind'], ([None, None], [None, None]))
+        else:
+            duration = row['duration_ms'] or [None, None]
+            wait = row['wait_ms'] or [None, None]
+        stats[row['kind']] = {
+            'pending': row['pending'],
+            'running': row['running'],
+            'failed': row['failed'],
+            'done_recently': row['done_recently'],
+            'retries_recently': row['retries_recently'] or 0,
+            'duration_ms_p50': duration[0],
+            'duration_ms_p95': duration[1],
+            'wait_ms_p50': wait[0],
+            'wait_ms_p95': wait[1],
+        }
+    return stats
 
-    if filters:
-        if filters.get('project'):
-            conditions.append('p.project_name = %s')
-            params.append(filters['project'])
-        if filters.get('site'):
-            conditions.append('s.site_name = %s')
-            params.append(filters['site'])
-        if filters.get('status'):
-            conditions.append('st.status_name = %s')
-            params.append(filters['status'])
-        if filters.get('date'):
-            conditions.append('DATE(i.created_at) = %s')
-            params.append(filters['date'])
+# fact table -> column rolled up per day next to project_id, and the
+# reference kind it names
+ROLLUP_CATEGORIES = {
+    'documents': ('document_type_id', 'document_types', 'by_type'),
+    'issues': ('status_id', 'issue_statuses', 'by_status'),
+}
+ROLLUP_BATCH_DAYS = int(os.environ.get('ROLLUP_BATCH_DAYS', 366))
 
-    if conditions:
-        query += ' WHERE ' + ' AND '.join(conditions)
+def refresh_daily_activity(max_days=ROLLUP_BATCH_DAYS):
+    # Recounts the days marked in activity_dirty_days, at most max_days per
+    # call, into daily_activity; each day is one index range scan on
+    # created_at. Claimed markers are deleted in the same transaction, and
+    # a write that commits meanwhile marks its day again for the next run.
+    # Returns the number of days refreshed.
+    with transaction() as cursor:
+        cursor.execute('''
+            DELETE FROM activity_dirty_days WHERE (fact, day) IN (
+                SELECT fact, day FROM activity_dirty_days ORDER BY fact, day LIMIT %s FOR UPDATE SKIP LOCKED
+            )
+            RETURNING fact, day
+        ''', (max_days,))
+        days = {}
+        for row in cursor.fetchall():
+            days.setdefault(row['fact'], []).append(row['day'])
+        if SQLITE:
+            day_list = '(SELECT value AS day FROM json_each(%s)) AS d'
+            next_day = "date(d.day, '+1 day')"
+        else:
+            day_list = 'unnest(%s::date[]) AS d (day)'
+            next_day = 'd.day + 1'
+        for fact, fact_days in days.items():
+            column = ROLLUP_CATEGORIES[fact][0]
+            cursor.execute('DELETE FROM daily_activity WHERE fact = %s AND day = ANY(%s)', (fact, fact_days))
+            cursor.execute(f'''
+                INSERT INTO daily_activity (fact, day, project_id, category_id, count)
+                SELECT %s, d.day, t.project_id, t.{column}, COUNT(*)
+                FROM {day_list}
+                JOIN {fact} t ON t.created_at >= d.day AND t.created_at < {next_day}
+                GROUP BY d.day, t.project_id, t.{column}
+            ''', (fact, fact_days))
+    return sum(len(fact_days) for fact_days in days.values())
 
-    query += ' ORDER BY i.created_at DESC'
-    cursor.execute(query, params)
-    issues = cursor.fetchall()
-    conn.close()
-    return issues
+TREND_GRANULARITIES = ('day', 'week', 'month')
+TREND_DEFAULT_DAYS = int(os.environ.get('TREND_DEFAULT_DAYS', 90))
+MAX_TREND_PERIODS = 1000
+
+def _trend_periods(start, end, granularity):
+    # Period starts covering [start, end), truncated like date_trunc()
+    if granularity == 'week':
+        period = start - timedelta(days=start.weekday())
+    elif granularity == 'month':
+        period = start.replace(day=1)
+    else:
+        period = start
+    periods = []
+    while period < end:
+        periods.append(period)
+        if len(periods) > MAX_TREND_PERIODS:
+            raise ValueError(f"More than {MAX_TREND_PERIODS} {granularity}s in range")
+        if granularity == 'week':
+            period += timedelta(days=7)
+        elif granularity == 'month':
+            period = (period.replace(day=28) + timedelta(days=4)).replace(day=1)
+        else:
+            period += timedelta(days=1)
+    return periods
+
+def get_trends(granularity='day', filters=None):
+    # Documents uploaded and issues reported per day/week/month, read from
+    # daily_activity so the cost depends on the days in range rather than
+    # the rows in documents/issues. filters takes date/date_from/date_to
+    # (default: the last TREND_DEFAULT_DAYS days) and project names.
+    if granularity not in TREND_GRANULARITIES:
+        raise ValueError(f"granularity must be one of {', '.join(TREND_GRANULARITIES)}")
+    filters = filters or {}
+    start, end = date_range(filters)
+    end = end or date.today() + timedelta(days=1)
+    start = start or end - timedelta(days=TREND_DEFAULT_DAYS)
+    periods = _trend_periods(start, end, granularity)
 
-def get_documents_for_issue(issue_id):
+    conditions, params = _dimension_conditions({'project': ('a.project_id', 'projects')}, filters)
+    conditions = ['a.day >= %s', 'a.day < %s'] + conditions
+    if not SQLITE:
+        period = f"date_trunc('{granularity}', a.day)::date"
+    elif granularity == 'week':
+        period = "date(a.day, '-6 days', 'weekday 1')"  # the Monday on or before
+    elif granularity == 'month':
+        period = "date(a.day, 'start of month')"
+    else:
+        period = 'a.day'
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute('''
-        SELECT ia.id, ia.filename
-        FROM issue_attachments ia
-        WHERE ia.issue_id = %s
-    ''', (issue_id,))
-    documents = cursor.fetchall()
+    cursor.execute(f'''
+        SELECT {period} AS period, a.fact, a.project_id, a.category_id, {_cast('SUM(a.count)', 'bigint')} AS count
+        FROM daily_activity a
+        WHERE {' AND '.join(conditions)}
+        GROUP BY 1, 2, 3, 4
+    ''', [start, end] + params)
+    rows = cursor.fetchall()
+    cursor.execute('SELECT COUNT(*) FROM activity_dirty_days')
+    pending_days = cursor.fetchone()[0]
     conn.close()
-    return documents
 
-def delete_document(document_id):
+    series = {}
+    for fact, (_, _, category_key) in ROLLUP_CATEGORIES.items():
+        series[fact] = {period: {'period': period.isoformat(), 'count': 0, 'by_project': {}, category_key: {}}
+                        for period in periods}
+    for row in rows:
+        _, kind, category_key = ROLLUP_CATEGORIES[row['fact']]
+        point = series[row['fact']].get(_as_date(row['period']))
+        if point is None:
+            continue
+        point['count'] += row['count']
+        project = reference_data.name_for('projects', row['project_id'])
+        if project is not None:
+            point['by_project'][project] = point['by_project'].get(project, 0) + row['count']
+        category = reference_data.name_for(kind, row['category_id'])
+        if category is not None:
+            point[category_key][category] = point[category_key].get(category, 0) + row['count']
+
+    trends = {fact: list(points.values()) for fact, points in series.items()}
+    trends.update({
+        'granularity': granularity,
+        'from': start.isoformat(),
+        'to': (end - timedelta(days=1)).isoformat(),
+        # Days changed since the rollup job last ran; not in the counts yet
+        'pending_days': pending_days,
+    })
+    return trends
+
+def get_reclaim_queue_stats():
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute('SELECT file_path FROM documents WHERE id = %s', (document_id,))
-    document = cursor.fetchone()
-    if document:
-        cursor.execute('DELETE FROM documents WHERE id = %s', (document_id,))
-        cursor.execute('DELETE FROM issue_documents WHERE document_id = %s', (document_id,))
-        conn.commit()
-        conn.close()
-        return document['file_path']
+    cursor.execute('''
+        SELECT COUNT(*) FILTER (WHERE attempts < %s) AS pending,
+               COUNT(*) FILTER (WHERE attempts >= %s) AS failed
+        FROM file_reclaim_queue
+    ''', (RECLAIM_MAX_ATTEMPTS, RECLAIM_MAX_ATTEMPTS))
+    row = cursor.fetchone()
     conn.close()
-    return None
+    return {'pending': row['pending'], 'failed': row['failed']}
 
-def delete_issue_attachment(attachment_id):
+def get_pdf_files():
+    # Every stored PDF once, for backfilling previews
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute('SELECT file_path FROM issue_attachments WHERE id = %s', (attachment_id,))
-    attachment = cursor.fetchone()
-    if attachment:
-        cursor.execute('DELETE FROM issue_attachments WHERE id = %s', (attachment_id,))
-        conn.commit()
-        conn.close()
-        return attachment['file_path']
+    cursor.execute('''
+        SELECT MIN(filename) AS filename, MIN(file_path) AS file_path, MIN(storage_key) AS storage_key
+        FROM (
+            SELECT filename, file_path, storage_key FROM documents
+            UNION ALL
+            SELECT filename, file_path, storage_key FROM issue_attachments
+        ) files
+        WHERE lower(filename) LIKE '%.pdf'
+        GROUP BY COALESCE(storage_key, file_path)
+        ORDER BY COALESCE(storage_key, file_path)
+    ''')
+    rows = cursor.fetchall()
     conn.close()
-    return None
+    return rows
 
-def delete_issue(issue_id):
+def get_unfolded_files():
+    # Upload rows whose file still lives in the flat uploads directory
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute('DELETE FROM issues WHERE id = %s', (issue_id,))
-    cursor.execute('DELETE FROM issue_documents WHERE issue_id = %s', (issue_id,))
-    cursor.execute('DELETE FROM issue_attachments WHERE issue_id = %s', (issue_id,))
-    conn.commit()
+    cursor.execute('''
+        SELECT 'documents' AS table_name, id, filename, file_path, storage_key FROM documents
+        WHERE storage_key IS NULL OR storage_key NOT LIKE 'blobs/%'
+        UNION ALL
+        SELECT 'issue_attachments', id, filename, file_path, storage_key FROM issue_attachments
+        WHERE storage_key IS NULL OR storage_key NOT LIKE 'blobs/%'
+        ORDER BY table_name, id
+    ''')
+    rows = cursor.fetchall()
     conn.close()
+    return rows
+
+def set_file_location(cursor, table_name, row_id, storage_key, file_path, sha256, size_bytes):
+    if table_name not in ('documents', 'issue_attachments'):
+        raise ValueError(f"Not an upload table: {table_name}")
+    cursor.execute(f'''
+        UPDATE {table_name} SET storage_key = %s, file_path = %s, sha256 = %s, size_bytes = %s
+        WHERE id = %s
+    ''', (storage_key, file_path, sha256, size_bytes, row_id))
+
+def delete_issue(issue_id):
+    return delete_many(issue_ids=[issue_id])['issues'] > 0
 
 def update_issue_status(issue_id, status_id):
+    # False when the issue does not exist or the update fails; the
+    # connection is rolled back so the rest of the request can still use it
+    conn = get_db_connection()
+    cursor = conn.cursor()
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
         cursor.execute('UPDATE issues SET status_id = %s WHERE id = %s', (status_id, issue_id))
-        conn.commit()
         affected_rows = cursor.rowcount
-        cursor.close()
-        conn.close()
-        return affected_rows > 0  # Returns True if the update was successful
-    except Exception as e:
-        print(f"Error updating issue status: {e}")
+        conn.commit()
+        return affected_rows > 0
+    except Exception:
+        conn.rollback()
+        logger.exception('Error updating status of issue %s', issue_id)
         return False
+    finally:
+        conn.close()
 
-def get_dashboard_stats():
+# Every dashboard breakdown of a fact table counted from scratch in one
+# scan: each grouping set is one chart, () is the total, and `dimension`
+# says which set a row belongs to. The dashboard reads the trigger-kept
+# dashboard_counters instead; reconcile_counters checks them against these.
+DOCUMENT_STATS_QUERY = '''
+    SELECT CASE WHEN GROUPING(document_type_id) = 0 THEN 'type'
+                WHEN GROUPING(project_id) = 0 THEN 'project'
+                WHEN GROUPING(status_id) = 0 THEN 'status'
+                ELSE 'total' END AS dimension,
+           document_type_id, project_id, status_id, COUNT(*) AS count
+    FROM documents
+    GROUP BY GROUPING SETS ((document_type_id), (project_id), (status_id), ())
+'''
+
+ISSUE_STATS_QUERY = '''
+    SELECT CASE WHEN GROUPING(status_id) = 0 THEN 'status'
+                WHEN GROUPING(project_id) = 0 THEN 'project'
+                WHEN GROUPING(deadline) = 0 THEN 'deadline'
+                ELSE 'total' END AS dimension,
+           status_id, project_id, deadline, COUNT(*) AS count
+    FROM issues
+    GROUP BY GROUPING SETS ((status_id), (project_id), (deadline), ())
+'''
+
+# fact table -> {counter dimension: column}; the dimension names match the
+# grouping sets above and the dashboard_counters rows kept by triggers
+COUNTED_DIMENSIONS = {
+    'documents': {'type': 'document_type_id', 'project': 'project_id', 'status': 'status_id'},
+    'issues': {'status': 'status_id', 'project': 'project_id', 'deadline': 'deadline'},
+}
+
+def _union_stats_query(table, dimensions):
+    # The grouping-set queries above for SQLite, which has no GROUPING
+    # SETS: one GROUP BY per chart, so one scan each
+    columns = list(dimensions.values())
+    selects = [f"SELECT 'total' AS dimension, {', '.join('NULL AS ' + c for c in columns)}, COUNT(*) AS count "
+               f"FROM {table}"]
+    for dimension, column in dimensions.items():
+        values = ', '.join(c if c == column else f'NULL AS {c}' for c in columns)
+        selects.append(f"SELECT '{dimension}', {values}, COUNT(*) FROM {table} GROUP BY {column}")
+    return ' UNION ALL '.join(selects)
+
+def get_counters(fact):
+    # {dimension: {key: count}} for one fact table, read from
+    # dashboard_counters; the total is under counters['total']['']
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute('SELECT COUNT(*) FROM documents')
-    total_docs = cursor.fetchone()[0]
-    print(f"Total documents in database: {total_docs}")
     cursor.execute('''
-        SELECT dt.type_name, COUNT(d.id) as count
-        FROM documents d
-        JOIN document_types dt ON d.document_type_id = dt.id
-        GROUP BY dt.id, dt.type_name
-    ''')
-    documents_by_type = [{'type_name': row['type_name'], 'count': row['count']} for row in cursor.fetchall()]
-    print(f"Documents by type: {documents_by_type}")
-    cursor.execute('''
-        SELECT p.project_name, COUNT(d.id) as count
-        FROM documents d
-        JOIN projects p ON d.project_id = p.id
-        GROUP BY p.id, p.project_name
-    ''')
-    documents_by_project = [{'project_name': row['project_name'], 'count': row['count']} for row in cursor.fetchall()]
-    print(f"Documents by project: {documents_by_project}")
+        SELECT dimension, key, count FROM dashboard_counters WHERE fact = %s AND count <> 0
+    ''', (fact,))
+    counters = {}
+    for row in cursor.fetchall():
+        counters.setdefault(row['dimension'], {})[row['key']] = row['count']
+    conn.close()
+    return counters
+
+def _breakdown(counters, dimension, kind, name_key):
+    # [{name_key: name, 'count': n}] for one dimension, in id order
+    breakdown = []
+    for key, count in sorted(counters.get(dimension, {}).items(), key=lambda item: int(item[0])):
+        name = reference_data.name_for(kind, key)
+        if name is not None:
+            breakdown.append({name_key: name, 'count': count})
+    return breakdown
+
+def _total(counters):
+    return counters.get('total', {}).get('', 0)
+
+def reconcile_counters(fix=False):
+    # Counts documents and issues from scratch (the grouping-set queries)
+    # and compares with dashboard_counters. Returns the drifted counters as
+    # (fact, dimension, key, stored, actual); with fix=True they are
+    # corrected. Writers are held off by a SHARE lock while this runs (on
+    # SQLite by taking the write lock).
+    drift = []
+    with transaction() as cursor:
+        cursor.execute('LOCK TABLE documents, issues IN SHARE MODE')
+        actual = {}
+        for fact, query in (('documents', DOCUMENT_STATS_QUERY), ('issues', ISSUE_STATS_QUERY)):
+            if SQLITE:
+                query = _union_stats_query(fact, COUNTED_DIMENSIONS[fact])
+            cursor.execute(query)
+            for row in cursor.fetchall():
+                if row['dimension'] == 'total':
+                    actual[(fact, 'total', '')] = row['count']
+                elif row[COUNTED_DIMENSIONS[fact][row['dimension']]] is not None:
+                    key = str(row[COUNTED_DIMENSIONS[fact][row['dimension']]])
+                    actual[(fact, row['dimension'], key)] = row['count']
+        cursor.execute('SELECT fact, dimension, key, count FROM dashboard_counters')
+        stored = {(row['fact'], row['dimension'], row['key']): row['count'] for row in cursor.fetchall()}
+        for counter in sorted(set(actual) | set(stored)):
+            if stored.get(counter, 0) != actual.get(counter, 0):
+                drift.append(counter + (stored.get(counter, 0), actual.get(counter, 0)))
+        if fix and drift:
+            execute_values(cursor, '''
+                INSERT INTO dashboard_counters (fact, dimension, key, count) VALUES %s
+                ON CONFLICT (fact, dimension, key) DO UPDATE SET count = EXCLUDED.count
+            ''', [(fact, dimension, key, count) for fact, dimension, key, _, count in drift])
+    return drift
+
+def get_data_version():
+    # (fact table version, reference data version); triggers bump them on
+    # every write, so an unchanged pair means unchanged dashboard numbers
+    conn = get_db_connection()
+    cursor = conn.cursor()
     cursor.execute('''
-        SELECT st.status_name, COUNT(d.id) as count
-        FROM documents d
-        JOIN statuses st ON d.status_id = st.id
-        GROUP BY st.id, st.status_name
+        SELECT d.version AS data_version, r.version AS reference_version
+        FROM data_version d, reference_version r
+        WHERE d.id = 1 AND r.id = 1
     ''')
-    documents_by_status = [{'status_name': row['status_name'], 'count': row['count']} for row in cursor.fetchall()]
-    print(f"Documents by status: {documents_by_status}")
+    row = cursor.fetchone()
+    conn.close()
+    return row['data_version'], row['reference_version']
+
+def get_dashboard_stats():
+    counters = get_counters('documents')
     stats = {
-        'total_documents': total_docs,
-        'documents_by_type': documents_by_type,
-        'documents_by_project': documents_by_project,
-        'documents_by_status': documents_by_status
+        'total_documents': _total(counters),
+        'documents_by_type': _breakdown(counters, 'type', 'document_types', 'type_name'),
+        'documents_by_project': _breakdown(counters, 'project', 'projects', 'project_name'),
+        'documents_by_status': _breakdown(counters, 'status', 'statuses', 'status_name'),
     }
-    conn.close()
+    print(f"Total documents in database: {stats['total_documents']}")
     return stats
 
+# Deadlines are classified against today's date in this timezone
+DASHBOARD_TIMEZONE = os.environ.get('DASHBOARD_TIMEZONE', 'UTC')
+ZoneInfo(DASHBOARD_TIMEZONE)  # fail at startup on an unknown name
+DEADLINE_HORIZON_DAYS = int(os.environ.get('DEADLINE_HORIZON_DAYS', 30))
+DEADLINE_ROW_LIMIT = int(os.environ.get('DEADLINE_ROW_LIMIT', 10))
+
+# bucket -> (label, condition on {deadline} relative to t.today and
+# t.horizon_end). Only the first three are listed on the dashboard;
+# 'later' is counted.
+DEADLINE_BUCKETS = {
+    'overdue': ('Overdue', '{deadline} < t.today'),
+    'due_today': ('Due Today', '{deadline} = t.today'),
+    'upcoming': ('Upcoming', '{deadline} > t.today AND {deadline} <= t.horizon_end'),
+    'later': ('Later', '{deadline} > t.horizon_end'),
+}
+DASHBOARD_DEADLINE_BUCKETS = ('overdue', 'due_today', 'upcoming')
+
+if SQLITE:
+    # SQLite has no time zone data; today is worked out in Python
+    TODAY_CTE = 'WITH t AS (SELECT %(today)s AS today, %(horizon_end)s AS horizon_end)'
+else:
+    TODAY_CTE = '''
+        WITH t AS (SELECT today, today + %(horizon)s AS horizon_end
+                   FROM (SELECT (CURRENT_TIMESTAMP AT TIME ZONE %(tz)s)::date AS today) now)
+    '''
+
+def _deadline_params(**params):
+    params.update({'tz': DASHBOARD_TIMEZONE, 'horizon': DEADLINE_HORIZON_DAYS})
+    if SQLITE:
+        params['today'] = datetime.now(ZoneInfo(DASHBOARD_TIMEZONE)).date()
+        params['horizon_end'] = params['today'] + timedelta(days=DEADLINE_HORIZON_DAYS)
+    return params
+
+def _deadline_bucket_query(bucket, after=False):
+    # One bucket in (deadline, id) order; read straight off the partial
+    # deadline index and stopped at the LIMIT. t is read through scalar
+    # subqueries: joined in, its dates are no index bounds and the scan
+    # starts at the earliest deadline.
+    condition = DEADLINE_BUCKETS[bucket][1].format(deadline='i.deadline')
+    condition = condition.replace('t.today', '(SELECT today FROM t)')
+    condition = condition.replace('t.horizon_end', '(SELECT horizon_end FROM t)')
+    if after:
+        condition += ' AND (i.deadline, i.id) > (%(after_deadline)s, %(after_id)s)'
+    return f'''
+        SELECT '{bucket}' AS bucket, (SELECT today FROM t) AS today, i.id, i.title, i.project_id, i.site_id,
+               i.deadline
+        FROM issues i
+        WHERE {condition}
+        ORDER BY i.deadline, i.id
+        LIMIT %(limit)s
+    '''
+
+def _deadline_row(row):
+    return {
+        'id': row['id'],
+        'title': row['title'],
+        'project_name': reference_data.name_for('projects', row['project_id']),
+        'site_name': reference_data.name_for('sites', row['site_id']),
+        'deadline': _as_date(row['deadline']).isoformat(),
+        'bucket': row['bucket'],
+        'status': DEADLINE_BUCKETS[row['bucket']][0],
+    }
+
+def _encode_deadline_cursor(row):
+    payload = json.dumps({'dl': row['deadline'], 'i': row['id']})
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+def _decode_deadline_cursor(token):
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return date.fromisoformat(payload['dl']), int(payload['i'])
+    except (ValueError, KeyError, TypeError) as e:
+        raise ValueError(f"Invalid page cursor: {token}") from e
+
+def get_deadline_bucket(bucket, cursor_token=None, page_size=None):
+    # One page of a deadline bucket, for drilling in from the dashboard
+    if bucket not in DEADLINE_BUCKETS:
+        raise ValueError(f"bucket must be one of {', '.join(DEADLINE_BUCKETS)}")
+    page_size = max(1, min(page_size or PAGE_SIZE, MAX_PAGE_SIZE))
+    params = _deadline_params(limit=page_size + 1)
+    if cursor_token:
+        params['after_deadline'], params['after_id'] = _decode_deadline_cursor(cursor_token)
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(TODAY_CTE + _deadline_bucket_query(bucket, after=bool(cursor_token)), params)
+    rows = cursor.fetchall()
+    if not rows:
+        cursor.execute(TODAY_CTE + ' SELECT today FROM t', params)
+        today = _as_date(cursor.fetchone()['today'])
+    else:
+        today = _as_date(rows[0]['today'])
+    conn.close()
+    issues = [_deadline_row(row) for row in rows[:page_size]]
+    return {
+        'bucket': bucket,
+        'label': DEADLINE_BUCKETS[bucket][0],
+        'today': today.isoformat(),
+        'issues': issues,
+        'next_cursor': _encode_deadline_cursor(issues[-1]) if len(rows) > page_size else None,
+        'page_size': page_size,
+    }
+
 def get_issue_stats():
+    counters = get_counters('issues')
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute('SELECT COUNT(*) FROM issues')
-    total_issues = cursor.fetchone()[0]
-    print(f"Total issues in database: {total_issues}")
-    current_date = datetime(2025, 5, 16, 14, 53)  # 05:53 PM +03, May 16, 2025
-    cursor.execute('''
-        SELECT i.id, i.title, p.project_name, s.site_name, i.deadline
-        FROM issues i
-        JOIN projects p ON i.project_id = p.id
-        JOIN sites s ON i.site_id = s.id
-        WHERE i.deadline IS NOT NULL
-        ORDER BY i.deadline ASC
-    ''')
-    issues_with_deadlines = cursor.fetchall()
-    print("Issues with deadlines:", [dict(issue) for issue in issues_with_deadlines])
-    issues_with_deadlines_list = []
-    for issue in issues_with_deadlines:
-        issue_dict = dict(issue)
-        if issue_dict['deadline']:
-            deadline_date = issue_dict['deadline']  # Already a datetime.date object
-            if deadline_date < current_date.date():
-                issue_dict['status'] = 'Overdue'
-            elif deadline_date == current_date.date():
-                issue_dict['status'] = 'Due Today'
-            else:
-                issue_dict['status'] = 'Upcoming'
-        issues_with_deadlines_list.append(issue_dict)
-    cursor.execute('''
-        SELECT st.status_name, COUNT(i.id) as count
-        FROM issues i
-        JOIN issue_statuses st ON i.status_id = st.id
-        GROUP BY st.id, st.status_name
-    ''')
-    issues_by_status = [{'status_name': row['status_name'], 'count': row['count']} for row in cursor.fetchall()]
-    print(f"Issues by status: {issues_by_status}")
-    cursor.execute('''
-        SELECT p.project_name, COUNT(i.id) as count
-        FROM issues i
-        JOIN projects p ON i.project_id = p.id
-        GROUP BY p.id, p.project_name
-    ''')
-    issues_by_project = [{'project_name': row['project_name'], 'count': row['count']} for row in cursor.fetchall()]
-    print(f"Issues by project: {issues_by_project}")
-    cursor.execute('''
-        SELECT deadline, COUNT(*) as count
-        FROM issues
-        WHERE deadline IS NOT NULL
-        GROUP BY deadline
-        ORDER BY deadline ASC
-    ''')
-    deadlines_count = [{'deadline': str(row['deadline']), 'count': row['count']} for row in cursor.fetchall()]
-    print(f"Deadlines count: {deadlines_count}")
+    # Bucket sizes come from the per-deadline counters, so they cost one
+    # row per distinct deadline rather than one per issue
+    deadline = _cast('c.key', 'date')
+    buckets = ', '.join(
+        _cast(f"COALESCE(SUM(c.count) FILTER (WHERE {condition.format(deadline=deadline)}), 0)", 'bigint')
+        + f' AS {bucket}'
+        for bucket, (_, condition) in DEADLINE_BUCKETS.items())
+    cursor.execute(f'''
+        {TODAY_CTE}
+        SELECT t.today, {buckets}
+        FROM t
+        LEFT JOIN dashboard_counters c ON c.fact = 'issues' AND c.dimension = 'deadline' AND c.count <> 0
+        GROUP BY t.today
+    ''', _deadline_params())
+    row = cursor.fetchone()
+    today = _as_date(row['today'])
+    deadline_buckets = {bucket: row[bucket] for bucket in DEADLINE_BUCKETS}
+    # The first DEADLINE_ROW_LIMIT issues of each bucket in one round trip
+    cursor.execute(TODAY_CTE + ' ' + ' UNION ALL '.join(
+        f'SELECT * FROM ({_deadline_bucket_query(bucket)}) {bucket}' for bucket in DASHBOARD_DEADLINE_BUCKETS),
+        _deadline_params(limit=DEADLINE_ROW_LIMIT))
+    issues_with_deadlines = [_deadline_row(row) for row in cursor.fetchall()]
+    conn.close()
+    # Where /api/deadlines/<bucket> picks up for the rest of each bucket
+    deadline_cursors = {}
+    for bucket in DASHBOARD_DEADLINE_BUCKETS:
+        shown = [issue for issue in issues_with_deadlines if issue['bucket'] == bucket]
+        if shown and deadline_buckets[bucket] > len(shown):
+            deadline_cursors[bucket] = _encode_deadline_cursor(shown[-1])
+    window_start = (today - timedelta(days=DEADLINE_HORIZON_DAYS)).isoformat()
+    window_end = (today + timedelta(days=DEADLINE_HORIZON_DAYS)).isoformat()
     stats = {
-        'total_issues': total_issues,
-        'issues_by_status': issues_by_status,
-        'issues_by_project': issues_by_project,
-        'issues_with_deadlines': issues_with_deadlines_list,
-        'deadlines_count': deadlines_count
+        'total_issues': _total(counters),
+        'issues_by_status': _breakdown(counters, 'status', 'issue_statuses', 'status_name'),
+        'issues_by_project': _breakdown(counters, 'project', 'projects', 'project_name'),
+        'issues_with_deadlines': issues_with_deadlines,
+        'deadline_buckets': deadline_buckets,
+        'deadline_cursors': deadline_cursors,
+        'today': today.isoformat(),
+        'horizon_days': DEADLINE_HORIZON_DAYS,
+        'deadlines_count': [{'deadline': deadline, 'count': count}
+                            for deadline, count in sorted(counters.get('deadline', {}).items())
+                            if window_start <= deadline <= window_end],
     }
-    conn.close()
-    return stats
\ No newline at end of file
+    print(f"Total issues in database: {stats['total_issues']}")
+    return stats
@@ -0,0 +1,291 @@
+import os
+import threading
+import time
+from collections import deque
+
+import psycopg2
+from psycopg2 import extensions
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class PooledConnection:
+    # Proxy handed out by the pool. Everything is forwarded to the real
+    # psycopg2 connection except close(), which gives the connection back
+    # to the pool instead of tearing it down.
+    def __init__(self, pool, conn, shared=False):
+        self._pool = pool
+        self._conn = conn
+        self._shared = shared
+        self._released = False
+
+    def close(self):
+        # Shared connections belong to the current Flask request and are
+        # only released in the teardown handler.
+        if self._shared or self._released:
+            return
+        self._released = True
+        self._pool.putconn(self._conn)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self._conn.commit()
+        else:
+            self._conn.rollback()
+        self.close()
+
+
+class ConnectionPool:
+    def __init__(self, connect, minconn=1, maxconn=10, timeout=10.0,
+                 max_uses=1000, max_idle=300.0, health_check_interval=30.0):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError('Invalid pool size: min=%s max=%s' % (minconn, maxconn))
+        self._connect = connect
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.max_uses = max_uses
+        self.max_idle = max_idle
+        self.health_check_interval = health_check_interval
+        self._cond = threading.Condition()
+        self._reset_state()
+
+    def _reset_state(self):
+        self._pid = os.getpid()
+        self._generation = getattr(self, '_generation', 0) + 1
+        self._idle = deque()  # (conn, returned_at)
+        self._uses = {}       # id(conn) -> number of checkouts
+        self._in_use = set()
+        # Slots held while a connection is opened or health-checked; that
+        # I/O runs without the lock, so a slow connect or a dead socket
+        # only holds up the thread that ran into it
+        self._pending = 0
+        self._stats = {
+            'checkouts': 0,
+            'waits': 0,
+            'wait_time': 0.0,
+            'timeouts': 0,
+            'connections_opened': 0,
+            'connections_closed': 0,
+            'recycled': 0,
+            'health_check_failures': 0,
+        }
+
+    def reset(self):
+        # Called after fork (e.g. from gunicorn's post_fork hook). The
+        # inherited sockets belong to the parent, so the connections are
+        # dropped without close(): closing them here would terminate the
+        # parent's server sessions.
+        with self._cond:
+            self._reset_state()
+
+    def _check_fork(self):
+        if os.getpid() != self._pid:
+            self._reset_state()
+
+    @property
+    def size(self):
+        return len(self._idle) + len(self._in_use) + self._pending
+
+    def _forget(self, conn):
+        # Bookkeeping for a connection leaving the pool; the caller closes
+        # it once the lock is released
+        self._uses.pop(id(conn), None)
+        self._in_use.discard(id(conn))
+        self._stats['connections_closed'] += 1
+
+    @staticmethod
+    def _close(conns):
+        for conn in conns:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def _healthy(self, conn, returned_at):
+        # May run a query: call without the lock
+        if conn.closed:
+            return False
+        if time.monotonic() - returned_at < self.health_check_interval:
+            return True
+        try:
+            cursor = conn.cursor()
+            cursor.execute('SELECT 1')
+            cursor.close()
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _pop_idle(self, closing):
+        # Most recently returned idle entry, skipping (into `closing`) the
+        # ones idle for longer than max_idle
+        while self._idle:
+            conn, returned_at = self._idle.pop()
+            if time.monotonic() - returned_at > self.max_idle and self.size >= self.minconn:
+                self._stats['recycled'] += 1
+                self._forget(conn)
+                closing.append(conn)
+                continue
+            return conn, returned_at
+        return None
+
+    def _release_slot(self, generation):
+        # Gives back a slot reserved by _reserve; the caller holds the lock
+        if generation == self._generation:
+            self._pending -= 1
+        self._cond.notify()
+
+    def _reserve(self, deadline, started, closing):
+        # Under the lock: takes an idle entry or a free slot for a new
+        # connection, waiting until `deadline` for one. Either way counts
+        # as pending until getconn() records the outcome.
+        entry = self._pop_idle(closing)
+        waited = False
+        while entry is None and self.size >= self.maxconn:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self._stats['timeouts'] += 1
+                self._stats['wait_time'] += time.monotonic() - started
+                raise PoolTimeout('No database connection available after %.1fs' % (deadline - started))
+            if not waited:
+                self._stats['waits'] += 1
+                waited = True
+            self._cond.wait(remaining)
+            self._check_fork()
+            entry = self._pop_idle(closing)
+        if waited:
+            self._stats['wait_time'] += time.monotonic() - started
+        self._pending += 1
+        return entry
+
+    def _prefill(self):
+        # Opens the connections missing below minconn and files them as idle
+        with self._cond:
+            self._check_fork()
+            missing = max(0, self.minconn - self.size)
+            self._pending += missing
+            generation = self._generation
+        opened = []
+        try:
+            for _ in range(missing):
+                opened.append(self._connect())
+        finally:
+            with self._cond:
+                for _ in range(missing):
+                    self._release_slot(generation)
+                for conn in opened:
+                    self._uses[id(conn)] = 0
+                    self._stats['connections_opened'] += 1
+                    self._idle.appendleft((conn, time.monotonic()))
+
+    def getconn(self, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+        if self.size < self.minconn:
+            self._prefill()
+        while True:
+            closing = []
+            try:
+                with self._cond:
+                    self._check_fork()
+                    entry = self._reserve(deadline, started, closing)
+                    generation = self._generation
+            finally:
+                self._close(closing)
+
+            try:
+                if entry is None:
+                    conn = self._connect()
+                elif self._healthy(*entry):
+                    conn = entry[0]
+                else:
+                    conn = None
+            except BaseException:
+                with self._cond:
+                    self._release_slot(generation)
+                raise
+
+            with self._cond:
+                self._release_slot(generation)
+                if conn is None:
+                    self._stats['health_check_failures'] += 1
+                    self._forget(entry[0])
+                else:
+                    if entry is None:
+                        self._uses[id(conn)] = 0
+                        self._stats['connections_opened'] += 1
+                    self._in_use.add(id(conn))
+                    self._uses[id(conn)] = self._uses.get(id(conn), 0) + 1
+                    self._stats['checkouts'] += 1
+                    return conn
+            self._close([entry[0]])
+
+    def putconn(self, conn):
+        with self._cond:
+            if os.getpid() != self._pid or id(conn) not in self._in_use:
+                # Connection from before a fork, or returned twice
+                return
+        # Still counted as in use while the rollback runs without the lock
+        if not conn.closed:
+            status = conn.get_transaction_status()
+            if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+                conn.close()
+            elif status != extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    conn.close()
+        closing = []
+        with self._cond:
+            if os.getpid() != self._pid or id(conn) not in self._in_use:
+                return
+            if conn.closed:
+                self._forget(conn)
+            elif self._uses.get(id(conn), 0) >= self.max_uses:
+                self._stats['recycled'] += 1
+                self._forget(conn)
+                closing.append(conn)
+            else:
+                self._in_use.discard(id(conn))
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+        self._close(closing)
+
+    def wrap(self, conn, shared=False):
+        return PooledConnection(self, conn, shared=shared)
+
+    def connection(self):
+        return self.wrap(self.getconn())
+
+    def closeall(self):
+        closing = []
+        with self._cond:
+            while self._idle:
+                conn, _ = self._idle.pop()
+                self._forget(conn)
+                closing.append(conn)
+        self._close(closing)
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats['wait_time'] = round(stats['wait_time'], 4)
+            stats.update({
+                'pid': self._pid,
+                'min': self.minconn,
+                'max': self.maxconn,
+                'in_use': len(self._in_use),
+                'idle': len(self._idle),
+                'pending': self._pending,
+            })
+            return stats
@@ -0,0 +1,11 @@
+# Gunicorn settings (picked up automatically from the working directory)
+import os
+
+bind = '0.0.0.0:' + os.environ.get('PORT', '5000')
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+
+def post_fork(server, worker):
+    # Workers must not reuse connections opened by the master before fork
+    import database
+    database.pool.reset()
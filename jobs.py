@@ -0,0 +1,155 @@
+import os
+import signal
+import socket
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import content_index
+import database as db
+import previews
+
+# Work that used to run inside a request goes through the jobs table
+# (see database.enqueue_jobs / claim_jobs) and is picked up by
+# `flask run-jobs`, which needs nothing but the database.
+JOB_PROCESSES = int(os.environ.get('JOB_PROCESSES', os.cpu_count() or 2))
+POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', 1))
+# How often a worker requeues jobs of dead workers and prunes old ones
+MAINTENANCE_INTERVAL = 60
+
+
+class PermanentJobError(Exception):
+    # Raised by a handler when running the job again cannot succeed (e.g.
+    # the input file is unreadable): the job fails at once instead of
+    # backing off until max_attempts
+    pass
+
+
+def _index_document(payload):
+    content_index.index_documents(ids=[payload['document_id']])
+
+
+def _render_previews(payload):
+    if os.path.exists(payload['file_path']):
+        try:
+            previews.cache.render_all(payload['file_path'], payload['storage_key'])
+        except previews.UnreadablePdf as e:
+            raise PermanentJobError(str(e)) from e
+
+
+# kind -> handler(payload); handlers run in a pool process and must be
+# safe to run twice for the same payload. Any exception but
+# PermanentJobError is taken as transient and retried.
+HANDLERS = {
+    'index_document': _index_document,
+    'render_previews': _render_previews,
+}
+
+
+def index_document_job(document_id):
+    return ('index_document', {'document_id': document_id}, f'index_document:{document_id}')
+
+
+def render_previews_job(file_path, storage_key):
+    # Keyed on the storage key: identical uploads share one blob and so
+    # one set of images
+    return ('render_previews', {'file_path': file_path, 'storage_key': storage_key},
+            f'render_previews:{storage_key}')
+
+
+def enqueue(jobs, rerun_done=False):
+    # jobs: [(kind, payload, idempotency_key)], e.g. index_document_job(id).
+    # Called after the upload has committed: if this fails the upload
+    # still stands and `flask index-contents` picks the document up.
+    try:
+        return db.enqueue_jobs(jobs, rerun_done=rerun_done)
+    except Exception as e:
+        print(f"Could not enqueue {len(jobs)} job(s): {e}")
+        return []
+
+
+def _execute(kind, payload):
+    # Runs in a pool process; returns (error or None, duration in ms,
+    # whether the error is permanent)
+    started = time.perf_counter()
+    permanent = False
+    try:
+        handler = HANDLERS.get(kind)
+        if handler is None:
+            raise PermanentJobError(f"Unknown job kind: {kind}")
+        handler(payload)
+        error = None
+    except PermanentJobError as e:
+        error = f"{type(e).__name__}: {e}"
+        permanent = True
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    return error, (time.perf_counter() - started) * 1000, permanent
+
+
+def _record(job, error, duration_ms, log, permanent=False):
+    if error is None:
+        db.finish_job(job['id'], duration_ms)
+        log(f"Job {job['id']} {job['kind']} done in {duration_ms:.0f} ms (attempt {job['attempts']})")
+    else:
+        status = db.fail_job(job['id'], error, duration_ms, permanent)
+        log(f"Job {job['id']} {job['kind']} {'failed' if status == 'failed' else 'will be retried'} "
+            f"(attempt {job['attempts']}/{job['max_attempts']}): {error}")
+
+
+def _stop(signum, frame):
+    raise SystemExit(0)
+
+
+def run_worker(processes=JOB_PROCESSES, poll_interval=POLL_INTERVAL, once=False, log=print):
+    # Claims due jobs whenever a pool process is free. With once=True it
+    # returns as soon as nothing is due; otherwise it runs until SIGTERM
+    # or Ctrl-C and lets running jobs finish first.
+    worker = f"{socket.gethostname()}:{os.getpid()}"
+    signal.signal(signal.SIGTERM, _stop)
+    executor = ProcessPoolExecutor(max_workers=processes, initializer=db.reset_after_fork)
+    running = {}  # future -> job
+    maintained_at = 0.0
+    log(f"Job worker {worker} started with {processes} process(es)")
+    try:
+        while True:
+            if time.monotonic() - maintained_at >= MAINTENANCE_INTERVAL:
+                requeued = db.requeue_stale_jobs()
+                if requeued:
+                    log(f"Requeued {requeued} job(s) of lost workers")
+                db.prune_jobs()
+                maintained_at = time.monotonic()
+            free = processes - len(running)
+            if free:
+                for job in db.claim_jobs(worker, free):
+                    running[executor.submit(_execute, job['kind'], job['payload'])] = job
+            if not running:
+                if once:
+                    return
+                time.sleep(poll_interval)
+                continue
+            done, _ = wait(running, timeout=poll_interval, return_when=FIRST_COMPLETED)
+            broken = False
+            for future in done:
+                job = running.pop(future)
+                try:
+                    error, duration_ms, permanent = future.result()
+                except BrokenProcessPool as e:
+                    # A pool process died (e.g. killed for memory); every
+                    # job it held fails this attempt
+                    error, duration_ms, permanent = f"Worker process died: {e}", None, False
+                    broken = True
+                _record(job, error, duration_ms, log, permanent)
+            if broken:
+                executor.shutdown(wait=False)
+                executor = ProcessPoolExecutor(max_workers=processes, initializer=db.reset_after_fork)
+    except (KeyboardInterrupt, SystemExit):
+        log(f"Job worker {worker} stopping; waiting for {len(running)} running job(s)")
+    finally:
+        executor.shutdown(wait=True)
+        for future, job in running.items():
+            try:
+                error, duration_ms, permanent = future.result()
+            except BrokenProcessPool as e:
+                error, duration_ms, permanent = f"Worker process died: {e}", None, False
+            _record(job, error, duration_ms, log, permanent)
@@ -0,0 +1,44 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    # Bounded in-process cache for small, hot lookups. The least recently
+    # used entry is dropped once `maxsize` is reached, and entries older
+    # than `ttl` seconds are recomputed, which bounds how stale a result
+    # can be when another process changed the data.
+    def __init__(self, maxsize=1024, ttl=30.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (stored_at, value)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, compute):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[0] < self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+        # Computed outside the lock: a slow query must not block hits on
+        # other keys. Two concurrent misses on one key both compute it.
+        value = compute()
+        with self._lock:
+            self._entries[key] = (now, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+            self.misses += 1
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {'size': len(self._entries), 'maxsize': self.maxsize, 'ttl': self.ttl,
+                'hits': self.hits, 'misses': self.misses}
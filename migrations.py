@@ -0,0 +1,964 @@
+import os
+import sqlite3
+import sys
+
+import psycopg2
+
+import database as db
+
+# Arbitrary key for pg_advisory_xact_lock so that several workers starting
+# at once do not apply the same migration twice
+MIGRATION_LOCK_ID = 7305921
+
+SCHEMA_VERSION_TABLE = '''
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        description TEXT NOT NULL,
+        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+'''
+
+def _001_initial_schema(cursor):
+    # Create document_types table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS document_types (
+            id SERIAL PRIMARY KEY,
+            type_name TEXT NOT NULL UNIQUE
+        )
+    ''')
+
+    # Create projects table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS projects (
+            id SERIAL PRIMARY KEY,
+            project_name TEXT NOT NULL UNIQUE
+        )
+    ''')
+
+    # Create sites table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sites (
+            id SERIAL PRIMARY KEY,
+            site_name TEXT NOT NULL UNIQUE
+        )
+    ''')
+
+    # Create statuses table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS statuses (
+            id SERIAL PRIMARY KEY,
+            status_name TEXT NOT NULL UNIQUE
+        )
+    ''')
+
+    # Create users table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id SERIAL PRIMARY KEY,
+            username TEXT NOT NULL UNIQUE
+        )
+    ''')
+
+    # Create documents table with foreign keys
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS documents (
+            id SERIAL PRIMARY KEY,
+            filename TEXT NOT NULL,
+            file_path TEXT NOT NULL,
+            document_type_id INTEGER,
+            project_id INTEGER,
+            site_id INTEGER,
+            status_id INTEGER,
+            uploaded_by INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (document_type_id) REFERENCES document_types(id),
+            FOREIGN KEY (project_id) REFERENCES projects(id),
+            FOREIGN KEY (site_id) REFERENCES sites(id),
+            FOREIGN KEY (status_id) REFERENCES statuses(id),
+            FOREIGN KEY (uploaded_by) REFERENCES users(id)
+        )
+    ''')
+
+    # Create issue_statuses table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS issue_statuses (
+            id SERIAL PRIMARY KEY,
+            status_name TEXT NOT NULL UNIQUE
+        )
+    ''')
+
+    # Create issues table with deadline
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS issues (
+            id SERIAL PRIMARY KEY,
+            title TEXT NOT NULL,
+            description TEXT,
+            project_id INTEGER,
+            site_id INTEGER,
+            status_id INTEGER,
+            reported_by INTEGER,
+            deadline DATE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (project_id) REFERENCES projects(id),
+            FOREIGN KEY (site_id) REFERENCES sites(id),
+            FOREIGN KEY (status_id) REFERENCES issue_statuses(id),
+            FOREIGN KEY (reported_by) REFERENCES users(id)
+        )
+    ''')
+
+    # Create issue_documents junction table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS issue_documents (
+            issue_id INTEGER,
+            document_id INTEGER,
+            FOREIGN KEY (issue_id) REFERENCES issues(id),
+            FOREIGN KEY (document_id) REFERENCES documents(id),
+            PRIMARY KEY (issue_id, document_id)
+        )
+    ''')
+
+    # Create issue_attachments table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS issue_attachments (
+            id SERIAL PRIMARY KEY,
+            filename TEXT NOT NULL,
+            file_path TEXT NOT NULL,
+            issue_id INTEGER,
+            uploaded_by INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (issue_id) REFERENCES issues(id),
+            FOREIGN KEY (uploaded_by) REFERENCES users(id)
+        )
+    ''')
+
+    # Insert default data if tables are empty
+    # Check and insert document_types
+    cursor.execute('SELECT COUNT(*) FROM document_types')
+    doc_type_count = cursor.fetchone()[0]
+    if doc_type_count == 0:
+        cursor.execute('INSERT INTO document_types (type_name) VALUES (%s) ON CONFLICT (type_name) DO NOTHING', ('Type A',))
+        cursor.execute('INSERT INTO document_types (type_name) VALUES (%s) ON CONFLICT (type_name) DO NOTHING', ('Type B',))
+
+    # Check and insert statuses (for documents)
+    cursor.execute('SELECT COUNT(*) FROM statuses')
+    status_count = cursor.fetchone()[0]
+    if status_count == 0:
+        cursor.execute('INSERT INTO statuses (status_name) VALUES (%s) ON CONFLICT (status_name) DO NOTHING', ('Draft',))
+        cursor.execute('INSERT INTO statuses (status_name) VALUES (%s) ON CONFLICT (status_name) DO NOTHING', ('Final',))
+
+    # Check and insert projects
+    cursor.execute('SELECT COUNT(*) FROM projects')
+    project_count = cursor.fetchone()[0]
+    if project_count == 0:
+        cursor.execute('INSERT INTO projects (project_name) VALUES (%s) ON CONFLICT (project_name) DO NOTHING', ('Project A',))
+        cursor.execute('INSERT INTO projects (project_name) VALUES (%s) ON CONFLICT (project_name) DO NOTHING', ('Project B',))
+
+    # Check and insert sites
+    cursor.execute('SELECT COUNT(*) FROM sites')
+    site_count = cursor.fetchone()[0]
+    if site_count == 0:
+        cursor.execute('INSERT INTO sites (site_name) VALUES (%s) ON CONFLICT (site_name) DO NOTHING', ('Site 1',))
+        cursor.execute('INSERT INTO sites (site_name) VALUES (%s) ON CONFLICT (site_name) DO NOTHING', ('Site 2',))
+
+    # Check and insert issue statuses
+    cursor.execute('SELECT COUNT(*) FROM issue_statuses')
+    issue_status_count = cursor.fetchone()[0]
+    if issue_status_count == 0:
+        cursor.execute('INSERT INTO issue_statuses (status_name) VALUES (%s) ON CONFLICT (status_name) DO NOTHING', ('Open',))
+        cursor.execute('INSERT INTO issue_statuses (status_name) VALUES (%s) ON CONFLICT (status_name) DO NOTHING', ('Closed',))
+
+    # Check and insert users
+    cursor.execute('SELECT COUNT(*) FROM users')
+    user_count = cursor.fetchone()[0]
+    if user_count == 0:
+        cursor.execute('INSERT INTO users (username) VALUES (%s) ON CONFLICT (username) DO NOTHING', ('user1',))
+
+    # Check and insert test documents
+    cursor.execute('SELECT COUNT(*) FROM documents')
+    document_count = cursor.fetchone()[0]
+    if document_count == 0:
+        uploads_dir = os.path.join(os.getcwd(), 'uploads')
+        cursor.execute('''
+            INSERT INTO documents (filename, file_path, document_type_id, project_id, site_id, status_id, uploaded_by)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+        ''', ('doc1.pdf', os.path.join(uploads_dir, 'doc1.pdf'), 1, 1, 1, 1, 1))
+        cursor.execute('''
+            INSERT INTO documents (filename, file_path, document_type_id, project_id, site_id, status_id, uploaded_by)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+        ''', ('doc2.pdf', os.path.join(uploads_dir, 'doc2.pdf'), 2, 2, 2, 2, 1))
+
+    # Check and insert test issues with deadlines
+    cursor.execute('SELECT COUNT(*) FROM issues')
+    issue_count = cursor.fetchone()[0]
+    if issue_count == 0:
+        cursor.execute('''
+            INSERT INTO issues (title, description, project_id, site_id, status_id, reported_by, deadline)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+        ''', ('Test Issue 1', 'Description 1', 1, 1, 1, 1, '2025-05-14'))
+        cursor.execute('''
+            INSERT INTO issues (title, description, project_id, site_id, status_id, reported_by, deadline)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+        ''', ('Test Issue 2', 'Description 2', 1, 1, 1, 1, '2025-05-15'))
+        cursor.execute('''
+            INSERT INTO issues (title, description, project_id, site_id, status_id, reported_by, deadline)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+        ''', ('Test Issue 3', 'Description 3', 2, 2, 2, 1, '2025-05-16'))
+
+def _002_document_indexes(cursor):
+    # Foreign keys used by the listing joins and filters
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_documents_document_type_id ON documents (document_type_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_documents_project_id ON documents (project_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_documents_site_id ON documents (site_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_documents_status_id ON documents (status_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_documents_uploaded_by ON documents (uploaded_by)')
+    # Matches ORDER BY created_at DESC, id DESC and the keyset cursor
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_documents_created_at_id ON documents (created_at DESC, id DESC)')
+
+def _003_issue_indexes(cursor):
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_issues_project_id ON issues (project_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_issues_site_id ON issues (site_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_issues_status_id ON issues (status_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_issues_reported_by ON issues (reported_by)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_issues_created_at_id ON issues (created_at DESC, id DESC)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_issues_deadline ON issues (deadline) WHERE deadline IS NOT NULL')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_issue_attachments_issue_id ON issue_attachments (issue_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_issue_attachments_uploaded_by ON issue_attachments (uploaded_by)')
+    # The primary key already covers lookups by issue_id
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_issue_documents_document_id ON issue_documents (document_id)')
+
+def _004_reference_version(cursor):
+    # Single-row counter bumped by any write to the lookup tables; the
+    # in-process reference cache compares it to decide when to reload
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS reference_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version BIGINT NOT NULL DEFAULT 0
+        )
+    ''')
+    cursor.execute('INSERT INTO reference_version (id, version) VALUES (1, 0) ON CONFLICT (id) DO NOTHING')
+    cursor.execute('''
+        CREATE OR REPLACE FUNCTION bump_reference_version() RETURNS trigger AS $$
+        BEGIN
+            UPDATE reference_version SET version = version + 1 WHERE id = 1;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    ''')
+    for table in ('document_types', 'projects', 'sites', 'statuses', 'users', 'issue_statuses'):
+        cursor.execute(f'DROP TRIGGER IF EXISTS {table}_reference_version ON {table}')
+        cursor.execute(f'''
+            CREATE TRIGGER {table}_reference_version
+            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {table}
+            FOR EACH STATEMENT EXECUTE FUNCTION bump_reference_version()
+        ''')
+
+def _005_filter_indexes(cursor):
+    # One index per filter dimension, ordered like the listings, so a
+    # filtered page is read in order straight from the index. Each one
+    # also covers the single-column foreign key index it replaces.
+    for column in ('document_type_id', 'project_id', 'site_id', 'status_id'):
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_documents_{column}_created_at '
+                       f'ON documents ({column}, created_at DESC, id DESC)')
+        cursor.execute(f'DROP INDEX IF EXISTS idx_documents_{column}')
+    for column in ('project_id', 'site_id', 'status_id'):
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_issues_{column}_created_at '
+                       f'ON issues ({column}, created_at DESC, id DESC)')
+        cursor.execute(f'DROP INDEX IF EXISTS idx_issues_{column}')
+    # The most common combination on the issues page
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_issues_project_id_status_id_created_at '
+                   'ON issues (project_id, status_id, created_at DESC, id DESC)')
+
+def _006_upload_metadata(cursor):
+    # storage_key is the file's name inside UPLOAD_FOLDER; rows from before
+    # this migration keep NULL and are still stored under their filename
+    for table in ('documents', 'issue_attachments'):
+        cursor.execute(f'ALTER TABLE {table} ADD COLUMN IF NOT EXISTS storage_key TEXT')
+        cursor.execute(f'ALTER TABLE {table} ADD COLUMN IF NOT EXISTS sha256 TEXT')
+        cursor.execute(f'ALTER TABLE {table} ADD COLUMN IF NOT EXISTS size_bytes BIGINT')
+
+def _007_blobs(cursor):
+    # Reference counts for the content-addressed store under uploads/blobs
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS blobs (
+            sha256 TEXT PRIMARY KEY,
+            size_bytes BIGINT NOT NULL,
+            refcount INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+def _008_cascades_and_reclaim_queue(cursor):
+    # Child rows go with their issue/document, so deletes are one statement
+    # per table instead of row-by-row cleanup in the right order
+    for table, column, parent in (('issue_documents', 'issue_id', 'issues'),
+                                  ('issue_documents', 'document_id', 'documents'),
+                                  ('issue_attachments', 'issue_id', 'issues')):
+        cursor.execute(f'ALTER TABLE {table} DROP CONSTRAINT IF EXISTS {table}_{column}_fkey')
+        cursor.execute(f'ALTER TABLE {table} ADD CONSTRAINT {table}_{column}_fkey '
+                       f'FOREIGN KEY ({column}) REFERENCES {parent}(id) ON DELETE CASCADE')
+    # Files waiting to be unlinked (see database.reclaim_files). sha256 is
+    # set for blob-store files and NULL for legacy flat files.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS file_reclaim_queue (
+            id BIGSERIAL PRIMARY KEY,
+            file_path TEXT NOT NULL,
+            sha256 TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT,
+            not_before TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_file_reclaim_queue_not_before ON file_reclaim_queue (not_before)')
+
+# fact table -> (counter dimension, column) kept in dashboard_counters
+COUNTED_DIMENSIONS = {
+    'documents': (('type', 'document_type_id'), ('project', 'project_id'), ('status', 'status_id')),
+    'issues': (('status', 'status_id'), ('project', 'project_id'), ('deadline', 'deadline')),
+}
+
+def _counter_upsert(fact, source):
+    # Adds each row's delta from `source` to the total and to each
+    # dimension's counter. Rows are upserted in key order so concurrent writers lock
+    # the counters in the same order.
+    dimensions = ', '.join(f"('{dimension}', {column}::text)" for dimension, column in COUNTED_DIMENSIONS[fact])
+    return f'''
+        INSERT INTO dashboard_counters (fact, dimension, key, count)
+        SELECT '{fact}', d.dimension, d.key, SUM(c.delta)
+        FROM ({source}) c
+        CROSS JOIN LATERAL (VALUES ('total', ''), {dimensions}) AS d (dimension, key)
+        WHERE d.key IS NOT NULL
+        GROUP BY d.dimension, d.key
+        HAVING SUM(c.delta) <> 0
+        ORDER BY d.dimension, d.key
+        ON CONFLICT (fact, dimension, key) DO UPDATE SET count = dashboard_counters.count + EXCLUDED.count
+    '''
+
+def _009_dashboard_counters(cursor):
+    # Row counts per dashboard category, maintained by statement-level
+    # triggers over the transition tables, so the dashboard reads a few
+    # dozen rows instead of counting documents and issues. Every write
+    # path (bulk inserts, delete_many, cascades) is covered.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS dashboard_counters (
+            fact TEXT NOT NULL,
+            dimension TEXT NOT NULL,
+            key TEXT NOT NULL,
+            count BIGINT NOT NULL DEFAULT 0,
+            PRIMARY KEY (fact, dimension, key)
+        )
+    ''')
+    for fact, dimensions in COUNTED_DIMENSIONS.items():
+        columns = ', '.join(column for _, column in dimensions)
+        added = f'SELECT {columns}, 1 AS delta FROM new_rows'
+        removed = f'SELECT {columns}, -1 AS delta FROM old_rows'
+        for operation, source, transition in (
+                ('insert', added, 'NEW TABLE AS new_rows'),
+                ('delete', removed, 'OLD TABLE AS old_rows'),
+                ('update', f'{added} UNION ALL {removed}', 'OLD TABLE AS old_rows NEW TABLE AS new_rows')):
+            cursor.execute(f'''
+                CREATE OR REPLACE FUNCTION count_{fact}_{operation}() RETURNS trigger AS $$
+                BEGIN
+                    {_counter_upsert(fact, source)};
+                    RETURN NULL;
+                END;
+                $$ LANGUAGE plpgsql
+            ''')
+            cursor.execute(f'DROP TRIGGER IF EXISTS {fact}_counters_{operation} ON {fact}')
+            cursor.execute(f'''
+                CREATE TRIGGER {fact}_counters_{operation}
+                AFTER {operation.upper()} ON {fact}
+                REFERENCING {transition}
+                FOR EACH STATEMENT EXECUTE FUNCTION count_{fact}_{operation}()
+            ''')
+        # Existing rows; the table lock keeps writers out until commit
+        cursor.execute(f'LOCK TABLE {fact} IN SHARE MODE')
+        cursor.execute(f"DELETE FROM dashboard_counters WHERE fact = '{fact}'")
+        cursor.execute(_counter_upsert(fact, f'SELECT {columns}, 1 AS delta FROM {fact}'))
+
+# fact table -> column rolled up per day next to project_id
+ROLLUP_CATEGORIES = {'documents': 'document_type_id', 'issues': 'status_id'}
+
+def _010_daily_activity(cursor):
+    # Rows created per day x project x type (documents) or status (issues).
+    # Triggers only record which days changed in activity_dirty_days; the
+    # rollup job (database.refresh_daily_activity) recounts just those days.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS daily_activity (
+            fact TEXT NOT NULL,
+            day DATE NOT NULL,
+            project_id INTEGER,
+            category_id INTEGER,
+            count BIGINT NOT NULL
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_daily_activity_fact_day ON daily_activity (fact, day)')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS activity_dirty_days (
+            fact TEXT NOT NULL,
+            day DATE NOT NULL,
+            PRIMARY KEY (fact, day)
+        )
+    ''')
+    for fact in ROLLUP_CATEGORIES:
+        for operation, source, transition in (
+                ('insert', 'SELECT created_at FROM new_rows', 'NEW TABLE AS new_rows'),
+                ('delete', 'SELECT created_at FROM old_rows', 'OLD TABLE AS old_rows'),
+                ('update', 'SELECT created_at FROM new_rows UNION SELECT created_at FROM old_rows',
+                 'OLD TABLE AS old_rows NEW TABLE AS new_rows')):
+            cursor.execute(f'''
+                CREATE OR REPLACE FUNCTION mark_{fact}_days_{operation}() RETURNS trigger AS $$
+                BEGIN
+                    INSERT INTO activity_dirty_days (fact, day)
+                    SELECT DISTINCT '{fact}', created_at::date FROM ({source}) changed
+                    WHERE created_at IS NOT NULL
+                    ORDER BY 2
+                    ON CONFLICT DO NOTHING;
+                    RETURN NULL;
+                END;
+                $$ LANGUAGE plpgsql
+            ''')
+            cursor.execute(f'DROP TRIGGER IF EXISTS {fact}_activity_{operation} ON {fact}')
+            cursor.execute(f'''
+                CREATE TRIGGER {fact}_activity_{operation}
+                AFTER {operation.upper()} ON {fact}
+                REFERENCING {transition}
+                FOR EACH STATEMENT EXECUTE FUNCTION mark_{fact}_days_{operation}()
+            ''')
+        # Every day with existing rows gets rolled up on the job's first run
+        cursor.execute(f'''
+            INSERT INTO activity_dirty_days (fact, day)
+            SELECT DISTINCT '{fact}', created_at::date FROM {fact} WHERE created_at IS NOT NULL
+            ON CONFLICT DO NOTHING
+        ''')
+
+def _011_data_version(cursor):
+    # Single-row counter bumped by every write to the fact tables, like
+    # reference_version for the lookup tables; the dashboard cache compares
+    # it to decide when to recompute
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS data_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version BIGINT NOT NULL DEFAULT 0
+        )
+    ''')
+    cursor.execute('INSERT INTO data_version (id, version) VALUES (1, 0) ON CONFLICT (id) DO NOTHING')
+    cursor.execute('''
+        CREATE OR REPLACE FUNCTION bump_data_version() RETURNS trigger AS $$
+        BEGIN
+            UPDATE data_version SET version = version + 1 WHERE id = 1;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    ''')
+    for table in ('documents', 'issues'):
+        cursor.execute(f'DROP TRIGGER IF EXISTS {table}_data_version ON {table}')
+        cursor.execute(f'''
+            CREATE TRIGGER {table}_data_version
+            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {table}
+            FOR EACH STATEMENT EXECUTE FUNCTION bump_data_version()
+        ''')
+
+def _012_document_search(cursor):
+    # Extracted text lives next to the documents rather than in them, so
+    # (re)indexing does not rewrite document rows or fire their triggers.
+    # content_key is the sha256 for blob-store files and mtime:size for
+    # legacy ones; see content_index.py.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS document_contents (
+            document_id INTEGER PRIMARY KEY REFERENCES documents(id) ON DELETE CASCADE,
+            content_key TEXT NOT NULL,
+            extractor TEXT NOT NULL,
+            content_tsv TSVECTOR NOT NULL,
+            indexed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_document_contents_tsv ON document_contents USING GIN (content_tsv)')
+    # Filenames are searchable as soon as a document is uploaded
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_documents_filename_tsv "
+                   "ON documents USING GIN (to_tsvector('simple', filename))")
+
+# Trigram indexes for filename substring search (ILIKE '%rev c%')
+TRIGRAM_INDEXES = {
+    'idx_documents_filename_trgm': 'documents',
+    'idx_issue_attachments_filename_trgm': 'issue_attachments',
+}
+
+def create_trigram_indexes(cursor, log=print):
+    # pg_trgm ships with Postgres but may not be installable (managed
+    # databases, missing contrib package, no CREATE privilege). Without it
+    # filename search still works, only by scanning; returns whether the
+    # indexes exist. On SQLite the FTS5 trigram tables come with the schema.
+    if db.SQLITE:
+        return True
+    cursor.execute('SAVEPOINT trigram')
+    try:
+        cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    except psycopg2.Error as e:
+        cursor.execute('ROLLBACK TO SAVEPOINT trigram')
+        log(f"pg_trgm is not available ({e.diag.message_primary or e}); filename search will not be indexed. "
+            "Install it and run 'flask trigram-indexes'.")
+        return False
+    cursor.execute('RELEASE SAVEPOINT trigram')
+    for name, table in TRIGRAM_INDEXES.items():
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {table} USING GIN (filename gin_trgm_ops)')
+    return True
+
+def _013_filename_trigrams(cursor):
+    create_trigram_indexes(cursor)
+
+def _014_jobs(cursor):
+    # Durable queue for work done after a request (see jobs.py). Workers
+    # claim pending rows with FOR UPDATE SKIP LOCKED; finished rows keep
+    # their timings until pruned.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id BIGSERIAL PRIMARY KEY,
+            kind TEXT NOT NULL,
+            payload JSONB NOT NULL DEFAULT '{}',
+            idempotency_key TEXT UNIQUE,
+            status TEXT NOT NULL DEFAULT 'pending' CHECK (status IN ('pending', 'running', 'done', 'failed')),
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL DEFAULT 5,
+            run_after TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            locked_by TEXT,
+            locked_at TIMESTAMP,
+            last_error TEXT,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            started_at TIMESTAMP,
+            finished_at TIMESTAMP,
+            duration_ms DOUBLE PRECISION
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_pending ON jobs (run_after, id) WHERE status = 'pending'")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_running ON jobs (locked_at) WHERE status = 'running'")
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_jobs_finished_at ON jobs (finished_at) WHERE finished_at IS NOT NULL')
+
+# Append new migrations here; never renumber or edit one that has shipped
+MIGRATIONS = [
+    (1, 'Initial schema and reference data', _001_initial_schema),
+    (2, 'Indexes on documents foreign keys and created_at', _002_document_indexes),
+    (3, 'Indexes on issues, issue_attachments and issue_documents', _003_issue_indexes),
+    (4, 'Reference data version counter and triggers', _004_reference_version),
+    (5, 'Composite filter + created_at indexes', _005_filter_indexes),
+    (6, 'Storage key, SHA-256 and size for uploaded files', _006_upload_metadata),
+    (7, 'Blob reference counts', _007_blobs),
+    (8, 'ON DELETE CASCADE for issue children and file reclaim queue', _008_cascades_and_reclaim_queue),
+    (9, 'Dashboard counters maintained by triggers', _009_dashboard_counters),
+    (10, 'Daily activity rollup and dirty-day markers', _010_daily_activity),
+    (11, 'Data version counter for the dashboard cache', _011_data_version),
+    (12, 'Full-text search over filenames and extracted contents', _012_document_search),
+    (13, 'Trigram indexes for filename substring search', _013_filename_trigrams),
+    (14, 'Background job queue', _014_jobs),
+]
+
+# SQLite (DATABASE_URL=sqlite:///...) gets the whole schema in one step,
+# numbered like the Postgres migration it matches. It also upgrades the
+# documents.db files of the original SQLite version of the app in place.
+SQLITE_LOOKUP_TABLES = {'document_types': 'type_name', 'projects': 'project_name', 'sites': 'site_name',
+                        'statuses': 'status_name', 'users': 'username', 'issue_statuses': 'status_name'}
+
+SQLITE_TABLES = [
+    '''
+    CREATE TABLE IF NOT EXISTS documents (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        filename TEXT NOT NULL,
+        file_path TEXT NOT NULL,
+        document_type_id INTEGER REFERENCES document_types(id),
+        project_id INTEGER REFERENCES projects(id),
+        site_id INTEGER REFERENCES sites(id),
+        status_id INTEGER REFERENCES statuses(id),
+        uploaded_by INTEGER REFERENCES users(id),
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        storage_key TEXT,
+        sha256 TEXT,
+        size_bytes INTEGER
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS issues (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        title TEXT NOT NULL,
+        description TEXT,
+        project_id INTEGER REFERENCES projects(id),
+        site_id INTEGER REFERENCES sites(id),
+        status_id INTEGER REFERENCES issue_statuses(id),
+        reported_by INTEGER REFERENCES users(id),
+        deadline DATE,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS issue_attachments (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        filename TEXT NOT NULL,
+        file_path TEXT NOT NULL,
+        issue_id INTEGER REFERENCES issues(id) ON DELETE CASCADE,
+        uploaded_by INTEGER REFERENCES users(id),
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        storage_key TEXT,
+        sha256 TEXT,
+        size_bytes INTEGER
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS issue_documents (
+        issue_id INTEGER REFERENCES issues(id) ON DELETE CASCADE,
+        document_id INTEGER REFERENCES documents(id) ON DELETE CASCADE,
+        PRIMARY KEY (issue_id, document_id)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS blobs (
+        sha256 TEXT PRIMARY KEY,
+        size_bytes INTEGER NOT NULL,
+        refcount INTEGER NOT NULL DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS file_reclaim_queue (
+        id INTEGER PRIMARY KEY,
+        file_path TEXT NOT NULL,
+        sha256 TEXT,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        last_error TEXT,
+        not_before TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS reference_version (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        version INTEGER NOT NULL DEFAULT 0
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS data_version (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        version INTEGER NOT NULL DEFAULT 0
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS dashboard_counters (
+        fact TEXT NOT NULL,
+        dimension TEXT NOT NULL,
+        key TEXT NOT NULL,
+        count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (fact, dimension, key)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS daily_activity (
+        fact TEXT NOT NULL,
+        day DATE NOT NULL,
+        project_id INTEGER,
+        category_id INTEGER,
+        count INTEGER NOT NULL
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS activity_dirty_days (
+        fact TEXT NOT NULL,
+        day DATE NOT NULL,
+        PRIMARY KEY (fact, day)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS document_contents (
+        document_id INTEGER PRIMARY KEY REFERENCES documents(id) ON DELETE CASCADE,
+        content_key TEXT NOT NULL,
+        extractor TEXT NOT NULL,
+        indexed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind TEXT NOT NULL,
+        payload JSONB NOT NULL DEFAULT '{}',
+        idempotency_key TEXT UNIQUE,
+        status TEXT NOT NULL DEFAULT 'pending' CHECK (status IN ('pending', 'running', 'done', 'failed')),
+        attempts INTEGER NOT NULL DEFAULT 0,
+        max_attempts INTEGER NOT NULL DEFAULT 5,
+        run_after TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        locked_by TEXT,
+        locked_at TIMESTAMP,
+        last_error TEXT,
+        created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        started_at TIMESTAMP,
+        finished_at TIMESTAMP,
+        duration_ms REAL
+    )
+    ''',
+]
+
+# The Postgres indexes (migrations 2, 3, 5, 10 and 14) under the same names
+SQLITE_INDEXES = [
+    'CREATE INDEX IF NOT EXISTS idx_documents_created_at_id ON documents (created_at DESC, id DESC)',
+    'CREATE INDEX IF NOT EXISTS idx_documents_uploaded_by ON documents (uploaded_by)',
+    'CREATE INDEX IF NOT EXISTS idx_issues_created_at_id ON issues (created_at DESC, id DESC)',
+    'CREATE INDEX IF NOT EXISTS idx_issues_reported_by ON issues (reported_by)',
+    'CREATE INDEX IF NOT EXISTS idx_issues_deadline ON issues (deadline) WHERE deadline IS NOT NULL',
+    'CREATE INDEX IF NOT EXISTS idx_issues_project_id_status_id_created_at '
+    'ON issues (project_id, status_id, created_at DESC, id DESC)',
+    'CREATE INDEX IF NOT EXISTS idx_issue_attachments_issue_id ON issue_attachments (issue_id)',
+    'CREATE INDEX IF NOT EXISTS idx_issue_attachments_uploaded_by ON issue_attachments (uploaded_by)',
+    'CREATE INDEX IF NOT EXISTS idx_issue_documents_document_id ON issue_documents (document_id)',
+    'CREATE INDEX IF NOT EXISTS idx_file_reclaim_queue_not_before ON file_reclaim_queue (not_before)',
+    'CREATE INDEX IF NOT EXISTS idx_daily_activity_fact_day ON daily_activity (fact, day)',
+    "CREATE INDEX IF NOT EXISTS idx_jobs_pending ON jobs (run_after, id) WHERE status = 'pending'",
+    "CREATE INDEX IF NOT EXISTS idx_jobs_running ON jobs (locked_at) WHERE status = 'running'",
+    'CREATE INDEX IF NOT EXISTS idx_jobs_finished_at ON jobs (finished_at) WHERE finished_at IS NOT NULL',
+] + [
+    f'CREATE INDEX IF NOT EXISTS idx_documents_{column}_created_at ON documents ({column}, created_at DESC, id DESC)'
+    for column in ('document_type_id', 'project_id', 'site_id', 'status_id')
+] + [
+    f'CREATE INDEX IF NOT EXISTS idx_issues_{column}_created_at ON issues ({column}, created_at DESC, id DESC)'
+    for column in ('project_id', 'site_id', 'status_id')
+]
+
+def _sqlite_columns(cursor, table):
+    cursor.execute(f'PRAGMA table_info({table})')
+    return [row['name'] for row in cursor.fetchall()]
+
+def _sqlite_rebuild(cursor, table, create_sql):
+    # SQLite cannot add ON DELETE CASCADE to an existing foreign key: the
+    # table is recreated with it and the rows copied over
+    columns = ', '.join(_sqlite_columns(cursor, table))
+    cursor.execute(f'ALTER TABLE {table} RENAME TO {table}_old')
+    cursor.execute(create_sql)
+    cursor.execute(f'INSERT INTO {table} ({columns}) SELECT {columns} FROM {table}_old')
+    cursor.execute(f'DROP TABLE {table}_old')
+
+def _sqlite_counter_statements(fact, row, delta):
+    # Row-level counterpart of _counter_upsert: SQLite triggers have no
+    # transition tables, so each changed row adjusts its counters
+    dimensions = ', '.join(f"('{dimension}', CAST({row}.{column} AS TEXT))"
+                           for dimension, column in COUNTED_DIMENSIONS[fact])
+    return f'''
+        INSERT INTO dashboard_counters (fact, dimension, key, count)
+        SELECT '{fact}', d.column1, d.column2, {delta}
+        FROM (VALUES ('total', ''), {dimensions}) d
+        WHERE d.column2 IS NOT NULL
+        ON CONFLICT (fact, dimension, key) DO UPDATE SET count = count + EXCLUDED.count;
+    '''
+
+def _sqlite_triggers(cursor):
+    events = {'insert': ('NEW',), 'delete': ('OLD',), 'update': ('OLD', 'NEW')}
+    for table in SQLITE_LOOKUP_TABLES:
+        for operation in events:
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_reference_version_{operation} AFTER {operation.upper()} ON {table}
+                BEGIN UPDATE reference_version SET version = version + 1 WHERE id = 1; END
+            ''')
+    for fact in COUNTED_DIMENSIONS:
+        for operation, rows in events.items():
+            body = ''.join(_sqlite_counter_statements(fact, row, 1 if row == 'NEW' else -1) for row in rows)
+            body += ''.join(f'''
+                INSERT OR IGNORE INTO activity_dirty_days (fact, day)
+                SELECT '{fact}', date({row}.created_at) WHERE {row}.created_at IS NOT NULL;
+            ''' for row in rows)
+            body += 'UPDATE data_version SET version = version + 1 WHERE id = 1;'
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {fact}_changes_{operation} AFTER {operation.upper()} ON {fact}
+                BEGIN {body} END
+            ''')
+
+def _sqlite_search(cursor):
+    # FTS5 tables in place of the GIN indexes: filename words (the
+    # 'simple' tsvector), filename trigrams (pg_trgm) for substring
+    # filters and autocomplete, and the extracted contents, stemmed when
+    # the search language is English. The filename tables index the
+    # rows of their table and are kept in step by triggers.
+    for table in ('documents', 'issue_attachments'):
+        cursor.execute(f'''
+            CREATE VIRTUAL TABLE IF NOT EXISTS {table}_filename_trgm
+            USING fts5(filename, content='{table}', content_rowid='id', tokenize='trigram')
+        ''')
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS documents_filename_words
+        USING fts5(filename, content='documents', content_rowid='id', tokenize='unicode61')
+    ''')
+    for table, index in (('documents', 'documents_filename_trgm'), ('documents', 'documents_filename_words'),
+                         ('issue_attachments', 'issue_attachments_filename_trgm')):
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {index}_insert AFTER INSERT ON {table} BEGIN
+                INSERT INTO {index} (rowid, filename) VALUES (NEW.id, NEW.filename);
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {index}_delete AFTER DELETE ON {table} BEGIN
+                INSERT INTO {index} ({index}, rowid, filename) VALUES ('delete', OLD.id, OLD.filename);
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {index}_update AFTER UPDATE OF filename ON {table} BEGIN
+                INSERT INTO {index} ({index}, rowid, filename) VALUES ('delete', OLD.id, OLD.filename);
+                INSERT INTO {index} (rowid, filename) VALUES (NEW.id, NEW.filename);
+            END
+        ''')
+        cursor.execute(f"INSERT INTO {index} ({index}) VALUES ('rebuild')")
+    tokenizer = 'porter unicode61' if db.SEARCH_LANGUAGE == 'english' else 'unicode61'
+    cursor.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS document_contents_fts USING fts5(content, tokenize='{tokenizer}')")
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS document_contents_fts_delete AFTER DELETE ON document_contents BEGIN
+            DELETE FROM document_contents_fts WHERE rowid = OLD.document_id;
+        END
+    ''')
+
+def _sqlite_schema(cursor):
+    for table, column in SQLITE_LOOKUP_TABLES.items():
+        cursor.execute(f'CREATE TABLE IF NOT EXISTS {table} '
+                       f'(id INTEGER PRIMARY KEY AUTOINCREMENT, {column} TEXT NOT NULL UNIQUE)')
+    for create_sql in SQLITE_TABLES:
+        cursor.execute(create_sql)
+    # Files from before this migration: the upload metadata columns, and
+    # the cascades of migration 8
+    for table in ('documents', 'issue_attachments'):
+        existing = _sqlite_columns(cursor, table)
+        for column, column_type in (('storage_key', 'TEXT'), ('sha256', 'TEXT'), ('size_bytes', 'INTEGER')):
+            if column not in existing:
+                cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {column_type}')
+    for table in ('issue_attachments', 'issue_documents'):
+        cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = %s", (table,))
+        if 'CASCADE' not in cursor.fetchone()['sql']:
+            _sqlite_rebuild(cursor, table, next(sql for sql in SQLITE_TABLES if f'EXISTS {table} (' in sql))
+    for create_index in SQLITE_INDEXES:
+        cursor.execute(create_index)
+    cursor.execute('INSERT OR IGNORE INTO reference_version (id, version) VALUES (1, 0)')
+    cursor.execute('INSERT OR IGNORE INTO data_version (id, version) VALUES (1, 0)')
+    _sqlite_triggers(cursor)
+    _sqlite_search(cursor)
+    # Counters and rollup markers for the rows already there, as in
+    # migrations 9 and 10
+    cursor.execute('DELETE FROM dashboard_counters')
+    for fact, dimensions in COUNTED_DIMENSIONS.items():
+        cursor.execute(f'''
+            INSERT INTO dashboard_counters (fact, dimension, key, count)
+            SELECT '{fact}', 'total', '', COUNT(*) FROM {fact}
+        ''')
+        for dimension, column in dimensions:
+            cursor.execute(f'''
+                INSERT INTO dashboard_counters (fact, dimension, key, count)
+                SELECT '{fact}', '{dimension}', CAST({column} AS TEXT), COUNT(*) FROM {fact}
+                WHERE {column} IS NOT NULL GROUP BY {column}
+            ''')
+        cursor.execute(f'''
+            INSERT OR IGNORE INTO activity_dirty_days (fact, day)
+            SELECT DISTINCT '{fact}', date(created_at) FROM {fact} WHERE created_at IS NOT NULL
+        ''')
+    # Reference data for an empty database, like migration 1
+    for table, names in (('document_types', ('Type A', 'Type B')), ('statuses', ('Draft', 'Final')),
+                         ('projects', ('Project A', 'Project B')), ('sites', ('Site 1', 'Site 2')),
+                         ('issue_statuses', ('Open', 'Closed')), ('users', ('user1',))):
+        cursor.execute(f'SELECT COUNT(*) FROM {table}')
+        if cursor.fetchone()[0] == 0:
+            for name in names:
+                cursor.execute(f'INSERT INTO {table} ({SQLITE_LOOKUP_TABLES[table]}) VALUES (%s)', (name,))
+
+    # One schema_version row per Postgres migration this schema includes,
+    # as on Postgres; the loop in apply_migrations adds the last one
+    for version, description, _ in MIGRATIONS:
+        if version < SQLITE_SCHEMA_VERSION:
+            cursor.execute('INSERT OR IGNORE INTO schema_version (version, description) VALUES (%s, %s)',
+                           (version, description))
+
+# Postgres migration the SQLite schema above matches. Every later
+# Postgres migration needs a SQLite counterpart with the same number,
+# even one that changes nothing on SQLite (_sqlite_noop still records the
+# version); apply_migrations refuses to run on SQLite without them.
+SQLITE_SCHEMA_VERSION = 14
+
+def _sqlite_noop(cursor):
+    pass
+
+SQLITE_MIGRATIONS = [
+    (SQLITE_SCHEMA_VERSION, 'Schema for SQLite deployments (Postgres migrations 1-14)', _sqlite_schema),
+]
+
+SQLITE_UNMATCHED = sorted({m[0] for m in MIGRATIONS if m[0] > SQLITE_SCHEMA_VERSION}
+                          - {m[0] for m in SQLITE_MIGRATIONS})
+
+ACTIVE_MIGRATIONS = SQLITE_MIGRATIONS if db.SQLITE else MIGRATIONS
+
+LATEST_VERSION = ACTIVE_MIGRATIONS[-1][0]
+
+def current_version(conn):
+    cursor = conn.cursor()
+    try:
+        cursor.execute('SELECT MAX(version) FROM schema_version')
+    except (psycopg2.errors.UndefinedTable, sqlite3.OperationalError):
+        conn.rollback()
+        return 0
+    version = cursor.fetchone()[0]
+    conn.rollback()
+    return version or 0
+
+def pending_migrations(conn):
+    version = current_version(conn)
+    return [m for m in ACTIVE_MIGRATIONS if m[0] > version]
+
+def apply_migrations(target=None, log=print):
+    # Each migration runs in its own transaction together with its
+    # schema_version row, so a failure leaves the schema at the last
+    # fully applied version.
+    if db.SQLITE and SQLITE_UNMATCHED:
+        raise RuntimeError(f"Postgres migration(s) {', '.join(map(str, SQLITE_UNMATCHED))} have no SQLite "
+                           f"counterpart in SQLITE_MIGRATIONS; add one (a no-op if nothing changes on SQLite)")
+    target = LATEST_VERSION if target is None else target
+    applied = []
+    conn = db.get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(SCHEMA_VERSION_TABLE)
+        conn.commit()
+        for version, description, migrate in ACTIVE_MIGRATIONS:
+            if version > target:
+                break
+            if db.SQLITE:
+                cursor.execute('BEGIN IMMEDIATE')  # the write lock serializes migrating processes
+            else:
+                cursor.execute('SELECT pg_advisory_xact_lock(%s)', (MIGRATION_LOCK_ID,))
+            cursor.execute('SELECT 1 FROM schema_version WHERE version = %s', (version,))
+            if cursor.fetchone():
+                conn.commit()
+                continue
+            log(f"Applying migration {version:03d}: {description}")
+            try:
+                migrate(cursor)
+                cursor.execute('INSERT INTO schema_version (version, description) VALUES (%s, %s)',
+                               (version, description))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            applied.append(version)
+    finally:
+        conn.close()
+    if applied:
+        db.reference_data.invalidate()
+    return applied
+
+def check_schema():
+    # Startup check: one query, no DDL
+    conn = db.get_db_connection()
+    try:
+        version = current_version(conn)
+    finally:
+        conn.close()
+    if db.SQLITE and SQLITE_UNMATCHED:
+        print(f"SQLite schema lacks Postgres migration(s) {', '.join(map(str, SQLITE_UNMATCHED))}; "
+              f"'flask --app app migrate' will refuse to run until SQLITE_MIGRATIONS covers them.")
+    if version < LATEST_VERSION:
+        if os.environ.get('AUTO_MIGRATE') == '1':
+            apply_migrations()
+            return LATEST_VERSION
+        print(f"Database schema is at version {version}, latest is {LATEST_VERSION}. "
+              f"Run 'flask --app app migrate' to upgrade.")
+    return version
+
+if __name__ == '__main__':
+    target = int(sys.argv[1]) if len(sys.argv) > 1 else None
+    applied = apply_migrations(target)
+    print(f"Applied {len(applied)} migration(s); schema is up to date." if applied else "Nothing to apply.")
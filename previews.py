@@ -0,0 +1,244 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+try:
+    import pypdfium2 as pdfium
+    from PIL import Image  # noqa: F401  (pypdfium2 renders to PIL images)
+except ImportError:  # optional: without them the browser renders PDFs itself
+    pdfium = None
+
+# Pre-rendered JPEGs of PDF pages, so lists and the preview modal load a
+# small image instead of the whole file. Images are keyed on the file
+# version (sha256 for blobs, path/mtime/size for legacy files) and live
+# under PREVIEW_FOLDER until the size limit evicts the least recently
+# used ones.
+PREVIEW_FOLDER = os.environ.get('PREVIEW_FOLDER', os.path.join(os.getcwd(), 'previews'))
+PREVIEW_CACHE_BYTES = int(os.environ.get('PREVIEW_CACHE_BYTES', 512 * 1024 * 1024))
+# Pages 1..PREVIEW_PAGES can be previewed; later pages only in the PDF
+PREVIEW_PAGES = int(os.environ.get('PREVIEW_PAGES', 5))
+# size name -> width in pixels
+PREVIEW_SIZES = {
+    'thumb': int(os.environ.get('PREVIEW_THUMB_WIDTH', 240)),
+    'page': int(os.environ.get('PREVIEW_PAGE_WIDTH', 1400)),
+}
+JPEG_QUALITY = 80
+# Part of every file name; bump it when the rendering changes
+RENDER_VERSION = 1
+
+# pdfium is not thread-safe
+_render_lock = threading.Lock()
+
+
+class UnreadablePdf(Exception):
+    # The file looks like a PDF but pdfium cannot open or render it
+    pass
+
+
+def available():
+    return pdfium is not None
+
+
+def is_pdf(path):
+    try:
+        with open(path, 'rb') as f:
+            return f.read(5) == b'%PDF-'
+    except OSError:
+        return False
+
+
+class PreviewCache:
+    def __init__(self, folder, max_bytes, pages=PREVIEW_PAGES, sizes=PREVIEW_SIZES,
+                 evict_interval=60.0, touch_interval=600.0):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.pages = pages
+        self.sizes = sizes
+        # Eviction walks the whole cache, so it runs at most this often
+        # per process; recency is the file mtime, refreshed on a hit at
+        # most every touch_interval seconds
+        self.evict_interval = evict_interval
+        self.touch_interval = touch_interval
+        self._lock = threading.Lock()
+        # Guards the counters; eviction holds _lock for a whole walk
+        self._stats_lock = threading.Lock()
+        self._evicted_at = 0.0
+        self.hits = 0
+        self.renders = 0
+        self.evictions = 0
+
+    def _directory(self, file_path, storage_key):
+        # One directory per file version
+        if storage_key and storage_key.startswith('blobs/'):
+            version = os.path.basename(storage_key)
+        else:
+            stat = os.stat(file_path)
+            version = hashlib.sha256(f"{storage_key}:{stat.st_mtime_ns}:{stat.st_size}".encode()).hexdigest()
+        return os.path.join(self.folder, version[:2], version)
+
+    def version(self, file_path, storage_key):
+        # Changes whenever the images for this file would; used as the ETag
+        return f"{os.path.basename(self._directory(file_path, storage_key))}-{RENDER_VERSION}"
+
+    def _write_atomic(self, path, write):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.render-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                write(f)
+            os.replace(temp_path, path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def _touch(self, path):
+        try:
+            if time.time() - os.stat(path).st_mtime > self.touch_interval:
+                os.utime(path)
+        except OSError:
+            pass
+
+    def _image_path(self, file_path, storage_key, size, page):
+        return os.path.join(self._directory(file_path, storage_key), f'{size}-{page}.v{RENDER_VERSION}.jpg')
+
+    def _meta_path(self, file_path, storage_key):
+        return os.path.join(self._directory(file_path, storage_key), f'meta.v{RENDER_VERSION}.json')
+
+    def known_page_count(self, file_path, storage_key):
+        # Pages of the PDF if a render has recorded them, else None
+        try:
+            with open(self._meta_path(file_path, storage_key)) as f:
+                return json.load(f)['pages']
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def page_count(self, file_path, storage_key):
+        # Pages of the PDF, remembered next to its images
+        pages = self.known_page_count(file_path, storage_key)
+        if pages is not None:
+            return pages
+        with _render_lock:
+            try:
+                document = pdfium.PdfDocument(file_path)
+            except pdfium.PdfiumError as e:
+                raise UnreadablePdf(f"{file_path}: {e}") from e
+            try:
+                pages = len(document)
+            finally:
+                document.close()
+        self._write_atomic(self._meta_path(file_path, storage_key),
+                           lambda f: f.write(json.dumps({'pages': pages}).encode()))
+        return pages
+
+    def cached(self, file_path, storage_key, size, page):
+        # Path of the JPEG of `page` (1-based) at `size` if it has been
+        # rendered, else None. Never renders: requests call this and leave
+        # rendering to the render_previews job.
+        if not available() or size not in self.sizes or not 1 <= page <= self.pages:
+            return None
+        path = self._image_path(file_path, storage_key, size, page)
+        if not os.path.exists(path):
+            return None
+        with self._stats_lock:
+            self.hits += 1
+        self._touch(path)
+        return path
+
+    def rendered(self, file_path, storage_key, size, pages):
+        # Whether pages 1..`pages` at `size` are all in the cache
+        return all(os.path.exists(self._image_path(file_path, storage_key, size, page))
+                   for page in range(1, pages + 1))
+
+    def get(self, file_path, storage_key, size, page):
+        # Like cached(), but renders the image on a miss; used by the
+        # render_previews job. None when there is no such page or previews
+        # are off.
+        image = self.cached(file_path, storage_key, size, page)
+        if image is not None or not available() or size not in self.sizes or not 1 <= page <= self.pages:
+            return image
+        if not is_pdf(file_path) or page > self.page_count(file_path, storage_key):
+            return None
+        path = self._image_path(file_path, storage_key, size, page)
+        self._write_atomic(path, lambda f: self._render(file_path, page, self.sizes[size], f))
+        with self._stats_lock:
+            self.renders += 1
+        self.evict()
+        return path
+
+    def _render(self, file_path, page_number, width, out):
+        with _render_lock:
+            try:
+                document = pdfium.PdfDocument(file_path)
+            except pdfium.PdfiumError as e:
+                raise UnreadablePdf(f"{file_path}: {e}") from e
+            try:
+                page = document[page_number - 1]
+                image = page.render(scale=width / page.get_width()).to_pil()
+                page.close()
+            except pdfium.PdfiumError as e:
+                raise UnreadablePdf(f"{file_path}: {e}") from e
+            finally:
+                document.close()
+        image.convert('RGB').save(out, 'JPEG', quality=JPEG_QUALITY, optimize=True)
+
+    def render_all(self, file_path, storage_key):
+        # Everything the list and the modal ask for: page 1 as a thumbnail
+        # and the first PREVIEW_PAGES pages full size
+        if not available() or not is_pdf(file_path):
+            return 0
+        pages = min(self.pages, self.page_count(file_path, storage_key))
+        self.get(file_path, storage_key, 'thumb', 1)
+        for page in range(1, pages + 1):
+            self.get(file_path, storage_key, 'page', page)
+        return pages
+
+    def evict(self, force=False):
+        # Deletes the least recently used images until the cache is back
+        # under 90% of max_bytes; returns the number of files removed
+        if not force and time.monotonic() - self._evicted_at < self.evict_interval:
+            return 0
+        with self._lock:
+            self._evicted_at = time.monotonic()
+            files = []
+            total = 0
+            for directory, _, names in os.walk(self.folder):
+                for name in names:
+                    path = os.path.join(directory, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    files.append((stat.st_mtime, stat.st_size, path))
+                    total += stat.st_size
+            if total <= self.max_bytes:
+                return 0
+            removed = 0
+            files.sort()
+            for _, size, path in files:
+                if total <= self.max_bytes * 0.9:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+                removed += 1
+                try:
+                    os.rmdir(os.path.dirname(path))  # only succeeds once empty
+                except OSError:
+                    pass
+            with self._stats_lock:
+                self.evictions += removed
+            return removed
+
+    def stats(self):
+        with self._stats_lock:
+            return {'available': available(), 'max_bytes': self.max_bytes, 'pages': self.pages,
+                    'hits': self.hits, 'renders': self.renders, 'evictions': self.evictions}
+
+
+cache = PreviewCache(PREVIEW_FOLDER, PREVIEW_CACHE_BYTES)
@@ -0,0 +1,115 @@
+import threading
+import time
+
+# kind -> (table, name column). The name column keeps its table's own name
+# in the cached rows so templates can keep using type.type_name etc.
+REFERENCE_TABLES = {
+    'document_types': ('document_types', 'type_name'),
+    'projects': ('projects', 'project_name'),
+    'sites': ('sites', 'site_name'),
+    'statuses': ('statuses', 'status_name'),
+    'users': ('users', 'username'),
+    'issue_statuses': ('issue_statuses', 'status_name'),
+}
+
+# All six tables plus the current version in a single round trip
+LOAD_QUERY = ' UNION ALL '.join(
+    [f"SELECT '{kind}' AS kind, id, {column} AS name FROM {table}"
+     for kind, (table, column) in REFERENCE_TABLES.items()]
+    + ["SELECT '_version' AS kind, version AS id, NULL AS name FROM reference_version WHERE id = 1"]
+) + ' ORDER BY kind, id'
+
+
+class ReferenceCache:
+    # In-process copy of the small lookup tables.
+    #
+    # Entries are reloaded (all six tables in one query) when:
+    #   - invalidate() was called in this process after a write,
+    #   - the reference_version row bumped by the database triggers changed
+    #     (checked at most every check_interval seconds), or
+    #   - the ttl expired, as a fallback for anything the above misses.
+    def __init__(self, get_connection, ttl=300.0, check_interval=5.0):
+        self._get_connection = get_connection
+        self.ttl = ttl
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._rows = None
+        self._stale = True
+        self._by_id = {}
+        self._by_name = {}
+        self._version = None
+        self._loaded_at = 0.0
+        self._checked_at = 0.0
+        self.loads = 0
+
+    def invalidate(self):
+        self._stale = True
+
+    def _fetch_version(self, cursor):
+        cursor.execute('SELECT version FROM reference_version WHERE id = 1')
+        row = cursor.fetchone()
+        return row[0] if row else 0
+
+    def _load(self, cursor):
+        version = 0
+        cursor.execute(LOAD_QUERY)
+        rows = {kind: [] for kind in REFERENCE_TABLES}
+        by_id = {kind: {} for kind in REFERENCE_TABLES}
+        by_name = {kind: {} for kind in REFERENCE_TABLES}
+        for row in cursor.fetchall():
+            kind = row['kind']
+            if kind == '_version':
+                version = row['id']
+                continue
+            column = REFERENCE_TABLES[kind][1]
+            rows[kind].append({'id': row['id'], column: row['name']})
+            by_id[kind][row['id']] = row['name']
+            by_name[kind][row['name']] = row['id']
+        self._rows, self._by_id, self._by_name = rows, by_id, by_name
+        self._version = version
+        self._stale = False
+        self._loaded_at = self._checked_at = time.monotonic()
+        self.loads += 1
+
+    def _ensure_fresh(self):
+        now = time.monotonic()
+        if (not self._stale and now - self._loaded_at < self.ttl
+                and now - self._checked_at < self.check_interval):
+            return
+        with self._lock:
+            now = time.monotonic()
+            conn = self._get_connection()
+            try:
+                cursor = conn.cursor()
+                if self._stale or now - self._loaded_at >= self.ttl:
+                    self._load(cursor)
+                elif now - self._checked_at >= self.check_interval:
+                    if self._fetch_version(cursor) != self._version:
+                        self._load(cursor)
+                    else:
+                        self._checked_at = now
+            finally:
+                conn.close()
+
+    def rows(self, kind):
+        self._ensure_fresh()
+        return self._rows[kind]
+
+    def name_for(self, kind, row_id):
+        self._ensure_fresh()
+        try:
+            return self._by_id[kind].get(int(row_id))
+        except (TypeError, ValueError):
+            return None
+
+    def id_for(self, kind, name):
+        self._ensure_fresh()
+        return self._by_name[kind].get(name)
+
+    def names(self, kind):
+        self._ensure_fresh()
+        return self._by_id[kind]
+
+    def ids(self, kind):
+        self._ensure_fresh()
+        return self._by_name[kind]
@@ -0,0 +1,350 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+from datetime import date, datetime
+from functools import lru_cache
+
+from psycopg2.extras import Json
+
+# Runs database.py on a single SQLite file, for single-node deployments
+# without a Postgres server. The queries stay written for psycopg2:
+# translate() rewrites the few constructs SQLite spells differently, and
+# the classes below stand in for the parts of psycopg2 and db_pool that
+# database.py uses. SQL that has no mechanical translation (full-text
+# search, date arithmetic, GROUPING SETS) is branched on in database.py.
+
+# Dates and timestamps are stored as ISO text, which sorts like the
+# values themselves, and come back as date/datetime for declared columns
+sqlite3.register_adapter(date, date.isoformat)
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(' '))
+sqlite3.register_converter('DATE', lambda value: date.fromisoformat(value.decode()))
+sqlite3.register_converter('TIMESTAMP', lambda value: datetime.fromisoformat(value.decode()))
+sqlite3.register_converter('JSONB', json.loads)
+
+# String literals, quoted names and comments, which translate() leaves alone
+_QUOTED = re.compile(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|--[^\n]*|/\*.*?\*/", re.S)
+_ANY = re.compile(r'=\s*ANY\s*\(\s*(%s|%\(\w+\)s)\s*\)', re.I)
+_ILIKE = re.compile(r'\bILIKE\s+(%s|%\(\w+\)s)', re.I)
+_FOR_UPDATE = re.compile(r'\s+FOR\s+UPDATE(\s+SKIP\s+LOCKED)?\b', re.I)
+_LOCK_TABLE = re.compile(r'LOCK\s+TABLE\b', re.I)
+_WRITES = re.compile(r'\b(INSERT|UPDATE|DELETE|REPLACE)\b', re.I)
+# Postgres syntax with no translation here: casts (database._cast spells
+# them per backend), other ANY/ILIKE forms and other row locks
+_UNTRANSLATED = re.compile(r'::|\bANY\s*\(|\bILIKE\b|\bFOR\s+(NO\s+KEY\s+UPDATE|UPDATE|KEY\s+SHARE|SHARE)\b'
+                           r'|\bNOWAIT\b', re.I)
+_PLACEHOLDER = re.compile(r'%\((\w+)\)s|%s|%%')
+_VALUES_AS = re.compile(r'\(VALUES %s\) AS (\w+) \(([^)]*)\)')
+_INSERT_RETURNING = re.compile(r'^(\s*INSERT\b.*\bRETURNING\s+)', re.I | re.S)
+WRITE_STATEMENTS = ('INSERT', 'UPDATE', 'DELETE', 'REPLACE', 'CREATE', 'DROP', 'ALTER')
+
+
+class UntranslatableSql(ValueError):
+    pass
+
+
+def _placeholder(match):
+    if match.group(0) == '%%':
+        return '%'
+    return f':{match.group(1)}' if match.group(1) else '?'
+
+
+def _translate_code(code, sql):
+    # One stretch of SQL outside literals and comments -> (SQLite SQL,
+    # whether it takes row locks)
+    code = _ANY.sub(r'IN (SELECT value FROM json_each(\1))', code)
+    code = _ILIKE.sub(r"LIKE \1 ESCAPE '\\'", code)
+    code, locks = _FOR_UPDATE.subn('', code)
+    leftover = _UNTRANSLATED.search(code)
+    if leftover:
+        raise UntranslatableSql(f"No SQLite translation for {leftover.group(0)!r} in: {sql.strip()}")
+    return code, bool(locks)
+
+
+@lru_cache(maxsize=1024)
+def translate(sql, has_params=True):
+    # psycopg2 SQL -> (SQLite SQL or None to skip it, whether it needs the
+    # write lock). Only these constructs are rewritten, and only outside
+    # string literals and comments:
+    #   x = ANY(%s)            x IN (SELECT value FROM json_each(%s)); lists
+    #                          are bound as JSON arrays
+    #   x ILIKE %s             x LIKE %s ESCAPE '\'
+    #   FOR UPDATE [SKIP LOCKED], LOCK TABLE ...
+    #                          dropped; the statement takes the write lock
+    #                          (BEGIN IMMEDIATE) instead, since SQLite has
+    #                          one writer at a time
+    # Any other Postgres-only syntax listed in _UNTRANSLATED raises
+    # UntranslatableSql rather than being run differently.
+    statement = sql.strip()
+    if _LOCK_TABLE.match(statement):
+        return None, True
+    parts = []
+    locks = False
+    writes = False
+    position = 0
+    for quoted in list(_QUOTED.finditer(statement)) + [None]:
+        end = quoted.start() if quoted else len(statement)
+        code, code_locks = _translate_code(statement[position:end], sql)
+        locks = locks or code_locks
+        writes = writes or bool(_WRITES.search(code))
+        parts.append(code)
+        if quoted:
+            parts.append(quoted.group(0))
+            position = quoted.end()
+    statement = ''.join(parts)
+    keyword = statement.split(None, 1)[0].upper() if statement else ''
+    writes = locks or keyword in WRITE_STATEMENTS or (keyword == 'WITH' and writes)
+    if has_params:
+        statement = _PLACEHOLDER.sub(_placeholder, statement)
+    return statement, writes
+
+
+def _adapt(value):
+    if isinstance(value, (list, tuple, set)):
+        return json.dumps(list(value), default=str)
+    if isinstance(value, Json):
+        return json.dumps(value.adapted)
+    return value
+
+
+def _adapt_params(params):
+    if isinstance(params, dict):
+        return {name: _adapt(value) for name, value in params.items()}
+    return [_adapt(value) for value in params]
+
+
+class Row(list):
+    # Like psycopg2's DictRow: a list that can also be indexed by column name
+    __slots__ = ('_index',)
+
+    def __init__(self, index, values):
+        super().__init__(values)
+        self._index = index
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            key = self._index[key]
+        return list.__getitem__(self, key)
+
+    def __setitem__(self, key, value):
+        if isinstance(key, str):
+            key = self._index[key]
+        list.__setitem__(self, key, value)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def keys(self):
+        return self._index.keys()
+
+    def values(self):
+        return list(self)
+
+    def items(self):
+        return [(name, list.__getitem__(self, i)) for name, i in self._index.items()]
+
+    def get(self, key, default=None):
+        return self[key] if key in self._index else default
+
+
+_indexes = {}
+
+
+def _row_factory(cursor, values):
+    names = tuple(column[0] for column in cursor.description)
+    index = _indexes.get(names)
+    if index is None:
+        index = _indexes[names] = {name: i for i, name in enumerate(names)}
+    return Row(index, values)
+
+
+def _drop_first_column(rows):
+    if not rows:
+        return rows
+    index = {name: i - 1 for name, i in rows[0]._index.items() if i}
+    names = tuple(index)
+    index = _indexes.setdefault(names, index)
+    return [Row(index, row[1:]) for row in rows]
+
+
+class Cursor:
+    def __init__(self, conn):
+        self._conn = conn
+        self._cursor = conn.cursor()
+
+    def execute(self, sql, params=None):
+        statement, writes = translate(sql, params is not None)
+        if writes and not self._conn.in_transaction:
+            self._cursor.execute('BEGIN IMMEDIATE')
+        if statement is not None:
+            self._cursor.execute(statement, _adapt_params(params) if params is not None else ())
+
+    def execute_values(self, sql, values, fetch=False):
+        # psycopg2.extras.execute_values: VALUES %s expands to one row per
+        # item, sent in chunks that stay under SQLite's limit of 32766
+        # bound variables
+        if not values:
+            return []
+        width = len(values[0])
+        row = '(' + ', '.join('?' * width) + ')'
+        # SQLite returns RETURNING rows in no set order. An INSERT hands out
+        # rowids in VALUES order, so sorting on them gives the input order.
+        ordered = fetch and _INSERT_RETURNING.match(sql)
+        if ordered:
+            sql = _INSERT_RETURNING.sub(r'\1rowid AS _row_position, ', sql, count=1)
+
+        def expand(rows):
+            match = _VALUES_AS.search(sql)
+            if match:
+                # SQLite has no column list on a derived table's alias
+                columns = ', '.join(f'column{i + 1} AS {name.strip()}'
+                                    for i, name in enumerate(match.group(2).split(',')))
+                return sql.replace(match.group(0), f'(SELECT {columns} FROM (VALUES {", ".join([row] * rows)})) '
+                                                    f'AS {match.group(1)}')
+            return sql.replace('VALUES %s', 'VALUES ' + ', '.join([row] * rows))
+
+        page = max(1, 30000 // width)
+        results = []
+        for start in range(0, len(values), page):
+            chunk = values[start:start + page]
+            self.execute(expand(len(chunk)), [value for item in chunk for value in item])
+            if not fetch:
+                continue
+            rows = self._cursor.fetchall()
+            if ordered:
+                rows = _drop_first_column(sorted(rows, key=lambda returned: returned[0]))
+            results.extend(rows)
+        return results if fetch else None
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def fetchmany(self, size=None):
+        return self._cursor.fetchmany(size or self._cursor.arraysize)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    def close(self):
+        self._cursor.close()
+
+
+class Connection:
+    # What get_db_connection() hands out; the counterpart of
+    # db_pool.PooledConnection. Transactions are opened by the first
+    # statement that writes (see translate), so reads never hold a lock.
+    def __init__(self, connections, conn, shared=False):
+        self._connections = connections
+        self._conn = conn
+        self._shared = shared
+        self._released = False
+
+    def cursor(self):
+        return Cursor(self._conn)
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def close(self):
+        if self._shared or self._released:
+            return
+        self._released = True
+        self._connections.putconn(self._conn)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self._conn.commit()
+        else:
+            self._conn.rollback()
+        self.close()
+
+
+class ThreadConnections:
+    # Stands in for db_pool.ConnectionPool. SQLite connections are cheap
+    # but lose their page cache when closed, so each thread keeps one open
+    # for its lifetime. A thread may borrow its connection again while it
+    # holds it (e.g. the reference cache loading inside a transaction);
+    # only the outermost return rolls back an unfinished transaction.
+    def __init__(self, path, pragmas):
+        self.path = path
+        self.pragmas = pragmas
+        self._lock = threading.Lock()
+        self._reset_state()
+
+    def _reset_state(self):
+        self._pid = os.getpid()
+        self._local = threading.local()
+        self._stats = {'checkouts': 0, 'connections_opened': 0}
+
+    def reset(self):
+        # After fork: the parent's connections must not be used (or closed)
+        # by the child
+        with self._lock:
+            self._reset_state()
+
+    def _open(self):
+        conn = sqlite3.connect(self.path, detect_types=sqlite3.PARSE_DECLTYPES, isolation_level=None,
+                               timeout=self.pragmas.get('busy_timeout', 5000) / 1000)
+        conn.row_factory = _row_factory
+        for name, value in self.pragmas.items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        with self._lock:
+            self._stats['connections_opened'] += 1
+        return conn
+
+    def getconn(self, timeout=None):
+        if os.getpid() != self._pid:
+            self.reset()
+        local = self._local
+        if getattr(local, 'conn', None) is None:
+            local.conn = self._open()
+            local.depth = 0
+        local.depth += 1
+        with self._lock:
+            self._stats['checkouts'] += 1
+        return local.conn
+
+    def putconn(self, conn):
+        local = self._local
+        if os.getpid() != self._pid or getattr(local, 'conn', None) is not conn:
+            return
+        local.depth = max(0, local.depth - 1)
+        if local.depth == 0 and conn.in_transaction:
+            conn.rollback()
+
+    def wrap(self, conn, shared=False):
+        return Connection(self, conn, shared=shared)
+
+    def connection(self):
+        return self.wrap(self.getconn())
+
+    def closeall(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats.update({'pid': self._pid, 'backend': 'sqlite', 'path': self.path,
+                      'journal_mode': self.pragmas.get('journal_mode')})
+        return stats
@@ -66,10 +66,39 @@ document.getElementById('filter-form')?.addEventListener('submit', function () {
 document.getElementById('clear-filters')?.addEventListener('click', function () {
     const form = document.getElementById('filter-form');
     form.querySelectorAll('select').forEach(select => select.value = '');
-    form.querySelector('input[type="date"]').value = ''; // Clear date input as well
+    form.querySelectorAll('input[type="date"]').forEach(input => input.value = ''); // Clear date inputs as well
+    form.querySelectorAll('input[type="search"]').forEach(input => input.value = '');
     form.submit();
 });
 
+// Filename suggestions: inputs with data-autocomplete fill their datalist
+// from /api/autocomplete as the user types
+document.querySelectorAll('input[data-autocomplete]').forEach(input => {
+    const datalist = document.getElementById(input.getAttribute('list'));
+    let timer = null;
+    let lastQuery = '';
+    input.addEventListener('input', function () {
+        clearTimeout(timer);
+        const query = input.value.trim();
+        if (query.length < 3 || query === lastQuery) return;
+        timer = setTimeout(() => {
+            lastQuery = query;
+            fetch(`${input.dataset.autocomplete}?q=${encodeURIComponent(query)}`)
+                .then(response => response.json())
+                .then(data => {
+                    if (input.value.trim() !== query) return; // outdated reply
+                    datalist.innerHTML = '';
+                    data.suggestions.forEach(name => {
+                        const option = document.createElement('option');
+                        option.value = name;
+                        datalist.appendChild(option);
+                    });
+                })
+                .catch(error => console.error('Autocomplete failed:', error));
+        }, 150);
+    });
+});
+
 // Report issue form submission handling
 document.getElementById('report-issue-form')?.addEventListener('submit', function (e) {
     const fileInput = document.getElementById('issue-file');
@@ -101,7 +130,8 @@ document.getElementById('filter-issues-form')?.addEventListener('submit', functi
 document.getElementById('clear-issue-filters')?.addEventListener('click', function () {
     const form = document.getElementById('filter-issues-form');
     form.querySelectorAll('select').forEach(select => select.value = '');
-    form.querySelector('input[type="date"]').value = ''; // Clear date input as well
+    form.querySelectorAll('input[type="date"]').forEach(input => input.value = ''); // Clear date inputs as well
+    form.querySelectorAll('input[type="search"]').forEach(input => input.value = '');
     form.submit();
 });
 
@@ -142,34 +172,74 @@ if (typeof pdfjsLib !== 'undefined') {
     pdfjsLib.GlobalWorkerOptions.workerSrc = 'https://cdnjs.cloudflare.com/ajax/libs/pdf.js/2.9.359/pdf.worker.min.js';
 }
 
+// Preview modal: server-rendered page images when the server has them,
+// otherwise page 1 rendered here with PDF.js
+let previewPages = [];
+let previewIndex = 0;
+
+function showPreviewPage(index) {
+    previewIndex = index;
+    document.getElementById('previewImage').src = previewPages[index];
+    document.getElementById('previewPageLabel').textContent = `Page ${index + 1} of ${previewPages.length}`;
+    document.getElementById('previewPrev').disabled = index === 0;
+    document.getElementById('previewNext').disabled = index === previewPages.length - 1;
+}
+
+async function showPreviewImages(pagesUrl) {
+    const response = await fetch(pagesUrl);
+    if (!response.ok) return false;
+    previewPages = (await response.json()).pages;
+    if (!previewPages.length) return false;
+    document.getElementById('pdfCanvas').classList.add('hidden');
+    document.getElementById('previewImage').classList.remove('hidden');
+    document.getElementById('previewPager').classList.toggle('hidden', previewPages.length < 2);
+    showPreviewPage(0);
+    return true;
+}
+
+async function renderPdfPreview(filePath) {
+    const canvas = document.getElementById('pdfCanvas');
+    const context = canvas.getContext('2d');
+    document.getElementById('previewImage').classList.add('hidden');
+    document.getElementById('previewPager').classList.add('hidden');
+    canvas.classList.remove('hidden');
+
+    // Only fetch the byte ranges needed for page 1 instead of the
+    // whole file (the download route answers Range requests)
+    const pdf = await pdfjsLib.getDocument({
+        url: filePath,
+        disableAutoFetch: true,
+        disableStream: true,
+        rangeChunkSize: 65536
+    }).promise;
+    const page = await pdf.getPage(1); // Render the first page
+
+    // Set canvas dimensions with scaling
+    const scale = 1.5; // Increase scale for better readability
+    const viewport = page.getViewport({ scale: scale });
+    canvas.height = viewport.height;
+    canvas.width = viewport.width;
+
+    // Render the PDF page into the canvas
+    await page.render({
+        canvasContext: context,
+        viewport: viewport
+    }).promise;
+}
+
 // Handle preview button clicks
 document.querySelectorAll('.preview-btn').forEach(button => {
     button.addEventListener('click', async function() {
         const filePath = this.getAttribute('data-filepath');
-        console.log('Attempting to preview PDF at:', filePath); // Debug log
+        const pagesUrl = this.getAttribute('data-preview-pages');
         const modal = document.getElementById('previewModal');
-        const canvas = document.getElementById('pdfCanvas');
-        const context = canvas.getContext('2d');
 
         // Show the modal
         modal.classList.remove('hidden');
 
         try {
-            // Load the PDF
-            const pdf = await pdfjsLib.getDocument(filePath).promise;
-            const page = await pdf.getPage(1); // Render the first page
-
-            // Set canvas dimensions with scaling
-            const scale = 1.5; // Increase scale for better readability
-            const viewport = page.getViewport({ scale: scale });
-            canvas.height = viewport.height;
-            canvas.width = viewport.width;
-
-            // Render the PDF page into the canvas
-            await page.render({
-                canvasContext: context,
-                viewport: viewport
-            }).promise;
+            if (pagesUrl && await showPreviewImages(pagesUrl)) return;
+            await renderPdfPreview(filePath);
         } catch (error) {
             console.error('Error loading PDF:', error);
             showPopup('Failed to load PDF preview. Ensure the file exists and is accessible.', 'error');
@@ -178,15 +248,20 @@ document.querySelectorAll('.preview-btn').forEach(button => {
     });
 });
 
+document.getElementById('previewPrev')?.addEventListener('click', () => showPreviewPage(Math.max(0, previewIndex - 1)));
+document.getElementById('previewNext')?.addEventListener('click', () => showPreviewPage(Math.min(previewPages.length - 1, previewIndex + 1)));
+
 // Handle preview modal close
 document.querySelectorAll('.close-modal').forEach(button => {
     button.addEventListener('click', function() {
         const modal = document.getElementById('previewModal');
         modal.classList.add('hidden');
-        // Clear the canvas
+        // Clear the canvas and the page image
         const canvas = document.getElementById('pdfCanvas');
         const context = canvas.getContext('2d');
         context.clearRect(0, 0, canvas.width, canvas.height);
+        document.getElementById('previewImage').removeAttribute('src');
+        previewPages = [];
     });
 });
 
@@ -0,0 +1,231 @@
+import hashlib
+import os
+import re
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import Request, current_app
+from werkzeug.exceptions import RequestEntityTooLarge
+
+CHUNK_SIZE = int(os.environ.get('UPLOAD_CHUNK_SIZE', 1024 * 1024))
+MAX_UPLOAD_SIZE = int(os.environ.get('MAX_UPLOAD_SIZE', 100 * 1024 * 1024))
+
+# Flat storage keys written before the blob store: '<32 hex chars>_<name>'
+STORAGE_KEY_RE = re.compile(r'^[0-9a-f]{32}_')
+
+
+class UploadTooLarge(RequestEntityTooLarge):
+    pass
+
+
+class IngestFile:
+    # Writable temp file in the upload folder that hashes and counts bytes
+    # as they are written. Werkzeug streams multipart file parts straight
+    # into it (see UploadRequest), so an upload touches the disk once and
+    # only needs a rename to be stored.
+    def __init__(self, directory, max_size=None):
+        fd, self.temp_path = tempfile.mkstemp(dir=directory, prefix='.ingest-')
+        self._file = os.fdopen(fd, 'w+b')
+        self._sha256 = hashlib.sha256()
+        self.size = 0
+        self.max_size = max_size
+        self.committed = False
+
+    def write(self, data):
+        self.size += len(data)
+        if self.max_size is not None and self.size > self.max_size:
+            self.discard()
+            raise UploadTooLarge(f"File exceeds the {self.max_size} byte upload limit")
+        self._sha256.update(data)
+        return self._file.write(data)
+
+    @property
+    def sha256(self):
+        return self._sha256.hexdigest()
+
+    def commit(self, final_path):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        os.replace(self.temp_path, final_path)
+        self.committed = True
+
+    def discard(self):
+        if not self._file.closed:
+            self._file.close()
+        if not self.committed and os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+
+    def close(self):
+        # Werkzeug closes request files at the end of the request; anything
+        # that was not committed by then is an abandoned upload
+        self.discard()
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+
+class UploadRequest(Request):
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return IngestFile(current_app.config['UPLOAD_FOLDER'],
+                          current_app.config.get('MAX_UPLOAD_SIZE', MAX_UPLOAD_SIZE))
+
+
+def display_name(storage_key):
+    # Original (sanitised) filename for Content-Disposition
+    basename = os.path.basename(storage_key)
+    return STORAGE_KEY_RE.sub('', basename)
+
+
+def hash_file(path):
+    sha256 = hashlib.sha256()
+    size = 0
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            sha256.update(chunk)
+            size += len(chunk)
+    return sha256.hexdigest(), size
+
+
+class BlobStore:
+    # Content-addressed files under <upload folder>/blobs/ab/cd/<sha256>.
+    # Keys are paths relative to the upload folder, so they can be served
+    # and stored in documents.storage_key like any other file. Reference
+    # counts live in the blobs table (see database.acquire_blob).
+    def __init__(self, upload_folder):
+        self.upload_folder = upload_folder
+
+    def key_for(self, sha256):
+        return f"blobs/{sha256[:2]}/{sha256[2:4]}/{sha256}"
+
+    def path_for(self, key):
+        return os.path.join(self.upload_folder, key)
+
+    def is_blob_key(self, key):
+        return bool(key) and key.startswith('blobs/')
+
+    def place(self, ingest_file, sha256):
+        # Move a finished upload into the store; identical content that is
+        # already there is kept and the new copy is dropped
+        path = self.path_for(self.key_for(sha256))
+        if os.path.exists(path):
+            ingest_file.discard()
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            ingest_file.commit(path)
+        return path
+
+    def adopt(self, existing_path, sha256):
+        # Same as place() for a file that is already on disk
+        path = self.path_for(self.key_for(sha256))
+        if os.path.exists(path):
+            if not os.path.samefile(existing_path, path):
+                os.remove(existing_path)
+                return path, True
+            return path, False
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(existing_path, path)
+        return path, False
+
+    def remove(self, key):
+        path = self.path_for(key)
+        if os.path.exists(path):
+            os.remove(path)
+            return True
+        return False
+
+
+class PendingUpload:
+    # A fully received and hashed upload that is not in the store yet.
+    # place() must run inside the database transaction that acquires the
+    # blob reference, so a concurrent delete of the same content cannot
+    # unlink the file in between.
+    def __init__(self, filename, stream, store):
+        self.filename = filename
+        self.sha256 = stream.sha256
+        self.size = stream.size
+        self.storage_key = store.key_for(self.sha256)
+        self.file_path = store.path_for(self.storage_key)
+        self._stream = stream
+        self._store = store
+
+    def place(self):
+        self._store.place(self._stream, self.sha256)
+
+    def discard(self):
+        self._stream.discard()
+
+
+def place_all(uploads, max_workers=8):
+    # Each place() ends in an fsync, so several files are flushed in
+    # parallel rather than one after another
+    if len(uploads) <= 1:
+        for upload in uploads:
+            upload.place()
+        return
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(uploads))) as executor:
+        list(executor.map(lambda upload: upload.place(), uploads))
+
+
+def ingest(file, store, max_size=MAX_UPLOAD_SIZE):
+    # Receive an uploaded werkzeug FileStorage into a hashed temp file
+    stream = file.stream
+    if not isinstance(stream, IngestFile):
+        # Stream not produced by UploadRequest: copy it over in chunks
+        stream = IngestFile(store.upload_folder, max_size)
+        try:
+            while True:
+                chunk = file.stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                stream.write(chunk)
+        except Exception:
+            stream.discard()
+            raise
+    return PendingUpload(file.filename, stream, store)
+
+
+def fold_legacy_files(store, log=print):
+    # One-off: move every upload row that still points into the flat
+    # uploads directory into the blob store. Byte-identical files collapse
+    # into one blob; returns a summary including the bytes reclaimed.
+    import database as db
+
+    summary = {'rows': 0, 'blobs': 0, 'duplicates': 0, 'reclaimed_bytes': 0, 'missing': [], 'orphans': [],
+               'orphan_bytes': 0}
+    moved = {}  # legacy path -> (sha256, size, new path)
+    for row in db.get_unfolded_files():
+        source = row['file_path']
+        if source not in moved and not os.path.exists(source):
+            source = os.path.join(store.upload_folder, row['storage_key'] or row['filename'])
+        if source in moved:
+            sha256, size, path = moved[source]
+        elif os.path.exists(source):
+            sha256, size = hash_file(source)
+            path = None
+        else:
+            summary['missing'].append(f"{row['table_name']}#{row['id']}: {row['filename']}")
+            continue
+        with db.transaction() as cursor:
+            db.acquire_blob(cursor, sha256, size)
+            if path is None:
+                path, duplicate = store.adopt(source, sha256)
+                moved[source] = (sha256, size, path)
+                if duplicate:
+                    summary['duplicates'] += 1
+                    summary['reclaimed_bytes'] += size
+                else:
+                    summary['blobs'] += 1
+            db.set_file_location(cursor, row['table_name'], row['id'], store.key_for(sha256), path, sha256, size)
+        summary['rows'] += 1
+        log(f"{row['table_name']}#{row['id']} {row['filename']} -> {store.key_for(sha256)}")
+
+    # Files nobody references are left alone, only reported
+    for name in sorted(os.listdir(store.upload_folder)):
+        path = os.path.join(store.upload_folder, name)
+        if os.path.isfile(path) and not name.startswith('.') and path not in moved:
+            summary['orphans'].append(name)
+            summary['orphan_bytes'] += os.path.getsize(path)
+    return summary
@@ -0,0 +1,52 @@
+import hashlib
+import json
+import threading
+import time
+
+
+class VersionedCache:
+    # Holds one computed value, serialized to JSON with an ETag, for as
+    # long as get_version() returns the same thing and at most `ttl`
+    # seconds. The version is read before computing, so a write landing
+    # during compute() only costs an extra recompute on the next call; it
+    # can never leave an old value filed under the new version.
+    def __init__(self, get_version, compute, ttl=60.0):
+        self._get_version = get_version
+        self._compute = compute
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entry = None
+        self.hits = 0
+        self.misses = 0
+
+    def _fresh(self, entry, version):
+        return (entry is not None and entry['version'] == version
+                and time.monotonic() - entry['computed_at'] < self.ttl)
+
+    def invalidate(self):
+        self._entry = None
+
+    def get(self):
+        # {'version', 'value', 'body', 'etag', 'computed_at'}
+        version = self._get_version()
+        entry = self._entry
+        if self._fresh(entry, version):
+            self.hits += 1
+            return entry
+        with self._lock:
+            entry = self._entry
+            if self._fresh(entry, version):
+                self.hits += 1
+                return entry
+            value = self._compute()
+            body = json.dumps(value, sort_keys=True, default=str)
+            entry = {
+                'version': version,
+                'value': value,
+                'body': body,
+                'etag': hashlib.sha256(body.encode()).hexdigest()[:32],
+                'computed_at': time.monotonic(),
+            }
+            self._entry = entry
+            self.misses += 1
+            return entry